@@ -17,10 +17,10 @@
 """
 
 import logging
-import copy
 
 import js_reserved
 import var_list
+import utility_df
 
 
 DECLARATIONS = ['VariableDeclaration', 'FunctionDeclaration']
@@ -30,6 +30,7 @@ EXPRESSIONS = ['AssignmentExpression', 'ArrayExpression', 'ArrowFunctionExpressi
                'MemberExpression', 'NewExpression', 'ObjectExpression', 'SequenceExpression',
                'TaggedTemplateExpression', 'ThisExpression', 'UnaryExpression', 'UpdateExpression',
                'YieldExpression']
+DEFERRED_BODY = 'DeferredBody'  # Placeholder of a function body whose data flow is built apart
 
 
 def get_pos_identifier(identifier_node, my_var_list):
@@ -77,15 +78,13 @@ def get_nearest_statement(node, answer=None):
 
     if answer is not None:
         return answer
-    else:
-        if node.is_statement():
-            return node
-        else:
-            if len(node.statement_dep_parents) > 1:
-                logging.warning('Several statement dependencies are joining on the same node %s',
-                                node.name)
-            # return get_nearest_statement(node.statement_dep_parents[0].extremity)
-            return get_nearest_statement(node.parent)
+    while not node.is_statement():
+        if len(node.statement_dep_parents) > 1:
+            logging.warning('Several statement dependencies are joining on the same node %s',
+                            node.name)
+        # node = node.statement_dep_parents[0].extremity
+        node = node.parent
+    return node
 
 
 def is_descendant(node1, node2):
@@ -164,6 +163,8 @@ def set_df(var, var_index, identifier_node):
     else:
         begin_df = get_nearest_statement(var.var_list[var_index], var.ref_list[var_index])
         begin_id_df = var.var_list[var_index]
+        if var.counters is not None:
+            var.counters.nb_edges += len(begin_df) if isinstance(begin_df, list) else 1
         if isinstance(begin_df, list):
             for i, _ in enumerate(begin_df):
                 get_nearest_statement(begin_df[i]).\
@@ -186,7 +187,7 @@ def assignment_df(identifier_node, var_loc, var_glob, unknown_var):
             Stores the variables currently declared and where they should be referred to.
         - var_glob: VarList
             Stores the global variables currently declared and where they should be referred to.
-        - unknown_var: list
+        - unknown_var: UnknownVarList
             Contains the variables currently not defined (could be valid because of hosting,
             therefore we check them later again).
     """
@@ -205,7 +206,7 @@ def assignment_df(identifier_node, var_loc, var_glob, unknown_var):
             # Data dependency between last time variable used and now
             set_df(var_glob, var_index, identifier_node)
         elif identifier_node.attributes['name'].lower() not in js_reserved.RESERVED_WORDS_LOWER:
-            unknown_var.append(identifier_node)  # TODO: handle scope of unknown var
+            unknown_var.add_var(identifier_node)  # TODO: handle scope of unknown var
 
 
 def var_decl_df(node, var_loc, var_glob, unknown_var, entry, assignt=False, obj=False):
@@ -220,7 +221,7 @@ def var_decl_df(node, var_loc, var_glob, unknown_var, entry, assignt=False, obj=
             Stores the variables currently declared and where they should be referred to.
         - var_glob: VarList
             Stores the global variables currently declared and where they should be referred to.
-        - unknown_var: list
+        - unknown_var: UnknownVarList
             Contains the variables currently not defined (could be valid because of hosting,
             therefore we check them later again).
         - entry: int
@@ -274,7 +275,7 @@ def var_declaration_df(node, var_loc, var_glob, unknown_var, id_list, entry):
             Stores the variables currently declared and where they should be referred to.
         - var_glob: VarList
             Stores the global variables currently declared and where they should be referred to.
-        - unknown_var: list
+        - unknown_var: UnknownVarList
             Contains the variables currently not defined (could be valid because of hosting,
             therefore we check them later again).
         - id_list: list
@@ -293,8 +294,8 @@ def var_declaration_df(node, var_loc, var_glob, unknown_var, id_list, entry):
             logging.warning('No identifier variable found')
 
         if len(node.children) > 1:  # Variable initialized
-            var_loc = build_dfg(node.children[1], var_loc, var_glob, unknown_var=unknown_var,
-                                id_list=id_list, entry=entry)
+            var_loc = yield build_dfg(node.children[1], var_loc, var_glob, unknown_var=unknown_var,
+                                      id_list=id_list, entry=entry)
             """
             search_handle_fun_expr(node, var_loc, var_glob, id_list)
             identifiers = search_identifiers(node.children[1], id_list, tab=[])
@@ -346,37 +347,38 @@ def search_identifiers(node, id_list, tab, rec=True):
             Stores the Identifier nodes found.
     """
 
-    if node.name == 'ObjectExpression':  # Only consider the object name, no properties
-        pass
-    elif node.name == 'Identifier':
-        """
-        MemberExpression can be:
-        - obj.prop[.prop.prop...]: we consider only obj;
-        - this.something or window.something: we consider only something.
-        """
-        if node.parent.name == 'MemberExpression':
-            if node.parent.children[0] == node:  # current = obj, this or window
-                # if node.attributes['name'].lower() in js_reserved.RESERVED_WORDS_LOWER:
-                if node.attributes['name'] == 'this' or node.attributes['name'] == 'window':
-                    id_list.append(node.id)  # As window an Identifier is
-                    logging.debug('%s is not the variable\'s name', node.attributes['name'])
-                    prop = node.parent.children[1]
-                    if prop.name == 'Identifier':
-                        tab.append(prop)  # We want the something after this/window
+    to_visit = [node]  # Explicit stack, visited in the same order as a recursive traversal
+    while to_visit:
+        node = to_visit.pop()
+        if node.name == 'ObjectExpression':  # Only consider the object name, no properties
+            pass
+        elif node.name == 'Identifier':
+            """
+            MemberExpression can be:
+            - obj.prop[.prop.prop...]: we consider only obj;
+            - this.something or window.something: we consider only something.
+            """
+            if node.parent.name == 'MemberExpression':
+                if node.parent.children[0] == node:  # current = obj, this or window
+                    # if node.attributes['name'].lower() in js_reserved.RESERVED_WORDS_LOWER:
+                    if node.attributes['name'] == 'this' or node.attributes['name'] == 'window':
+                        id_list.append(node.id)  # As window an Identifier is
+                        logging.debug('%s is not the variable\'s name', node.attributes['name'])
+                        prop = node.parent.children[1]
+                        if prop.name == 'Identifier':
+                            tab.append(prop)  # We want the something after this/window
+                    else:
+                        tab.append(node)  # otherwise current = obj, which we store
+                elif node.parent.children[0].name == 'ThisExpression':  # Parent of this
+                    tab.append(node)  # node is actually node.parent.children[1]
                 else:
-                    tab.append(node)  # otherwise current = obj, which we store
-            elif node.parent.children[0].name == 'ThisExpression':  # Parent of this=ThisExpression
-                tab.append(node)  # node is actually node.parent.children[1]
+                    if node.parent.attributes['computed']:  # Access through a table, e.g. index
+                        logging.debug('The variable %s was considered', node.attributes['name'])
+                        tab.append(node)
             else:
-                if node.parent.attributes['computed']:  # Access through a table, could be an index
-                    logging.debug('The variable %s was considered', node.attributes['name'])
-                    tab.append(node)
-        else:
-            tab.append(node)  # Otherwise this is just a variable
-    else:
-        if rec:
-            for child in node.children:
-                search_identifiers(child, id_list, tab, rec)
+                tab.append(node)  # Otherwise this is just a variable
+        elif rec:
+            to_visit.extend(reversed(node.children))
     return tab
 
 
@@ -394,7 +396,7 @@ def assignment_expr_df(node, var_loc, var_glob, unknown_var, id_list, entry, cal
             Stores the variables currently declared and where they should be referred to.
         - var_glob: VarList
             Stores the global variables currently declared and where they should be referred to.
-        - unknown_var: list
+        - unknown_var: UnknownVarList
             Contains the variables currently not defined (could be valid because of hosting,
             therefore we check them later again).
         - id_list: list
@@ -439,8 +441,8 @@ def assignment_expr_df(node, var_loc, var_glob, unknown_var, id_list, entry, cal
         logging.warning('No identifier assignee found')
 
     for i in range(1, len(node.children)):
-        var_loc = build_dfg(node.children[i], var_loc, var_glob, unknown_var=unknown_var,
-                            id_list=id_list, entry=entry)
+        var_loc = yield build_dfg(node.children[i], var_loc, var_glob, unknown_var=unknown_var,
+                                  id_list=id_list, entry=entry)
     """
     identifiers = search_identifiers(node.children[1], id_list, tab=[])
     for assignt in identifiers:
@@ -463,7 +465,7 @@ def update_expr_df(node, var_loc, var_glob, unknown_var, id_list, entry):
             Stores the variables currently declared and where they should be referred to.
         - var_glob: VarList
             Stores the global variables currently declared and where they should be referred to.
-        - unknown_var: list
+        - unknown_var: UnknownVarList
             Contains the variables currently not defined (could be valid because of hosting,
             therefore we check them later again).
         - id_list: list
@@ -498,7 +500,7 @@ def identifier_update(node, var_loc, var_glob, unknown_var, id_list, entry):
             Stores the variables currently declared and where they should be referred to.
         - var_glob: VarList
             Stores the global variables currently declared and where they should be referred to.
-        - unknown_var: list
+        - unknown_var: UnknownVarList
             Contains the variables currently not defined (could be valid because of hosting,
             therefore we check them later again).
         - id_list: list
@@ -522,11 +524,13 @@ def identifier_update(node, var_loc, var_glob, unknown_var, id_list, entry):
 def search_function_expression(node, tab):
     """ Seaches the FunctionExpression nodes descendant of node. """
 
-    if node.name == 'FunctionExpression':
-        tab.append(node)
-    else:
-        for child in node.children:
-            search_function_expression(child, tab)
+    to_visit = [node]
+    while to_visit:
+        node = to_visit.pop()
+        if node.name == 'FunctionExpression':
+            tab.append(node)
+        else:
+            to_visit.extend(reversed(node.children))
     return tab
 
 
@@ -593,19 +597,16 @@ def hoisting(node, unknown_var):
         Parameters:
         - node: Node
             Node corresponding to a function's name.
-        - unknown_var: list
+        - unknown_var: UnknownVarList
             Contains the variables currently not defined (could be valid because of hosting,
             therefore we check them later again).
     """
 
-    unknown_var_copy = copy.copy(unknown_var)
-    for unknown in unknown_var_copy:
-        if node.attributes['name'] == unknown.attributes['name']:
-            logging.debug('Using hoisting, the function %s was first used, then defined',
-                          node.attributes['name'])
-            get_nearest_statement(node).set_data_dependency(extremity=get_nearest_statement(
-                unknown), begin=node, end=unknown)
-            unknown_var.remove(unknown)
+    for unknown in unknown_var.pop_var(node.attributes['name']):
+        logging.debug('Using hoisting, the function %s was first used, then defined',
+                      node.attributes['name'])
+        get_nearest_statement(node).set_data_dependency(extremity=get_nearest_statement(
+            unknown), begin=node, end=unknown)
 
 
 def function_scope(node, var_loc, var_glob, unknown_var, id_list, fun_expr):
@@ -620,7 +621,7 @@ def function_scope(node, var_loc, var_glob, unknown_var, id_list, fun_expr):
             Stores the variables currently declared and where they should be referred to.
         - var_glob: VarList
             Stores the global variables currently declared and where they should be referred to.
-        - unknown_var: list
+        - unknown_var: UnknownVarList
             Contains the variables currently not defined (could be valid because of hosting,
             therefore we check them later again).
         - id_list: list
@@ -654,8 +655,8 @@ def function_scope(node, var_loc, var_glob, unknown_var, id_list, fun_expr):
                                 unknown_var=unknown_var, entry=0)
 
         else:
-            var_loc = build_dfg(child, var_loc=var_loc, var_glob=var_glob, unknown_var=unknown_var,
-                                id_list=id_list, entry=0)
+            var_loc = yield build_dfg(child, var_loc=var_loc, var_glob=var_glob,
+                                      unknown_var=unknown_var, id_list=id_list, entry=0)
 
     if fun_expr:
         link_fun_expr(node)
@@ -680,7 +681,7 @@ def obj_expr_scope(node, var_loc, var_glob, unknown_var, id_list):
             Stores the variables currently declared and where they should be referred to.
         - var_glob: VarList
             Stores the global variables currently declared and where they should be referred to.
-        - unknown_var: list
+        - unknown_var: UnknownVarList
             Contains the variables currently not defined (could be valid because of hosting,
             therefore we check them later again).
         - id_list: list
@@ -705,8 +706,8 @@ def obj_expr_scope(node, var_loc, var_glob, unknown_var, id_list):
                     hoisting(param, unknown_var)
 
             else:
-                var_loc = build_dfg(child, var_loc=var_loc, var_glob=var_glob,
-                                    unknown_var=unknown_var, id_list=id_list, entry=0)
+                var_loc = yield build_dfg(child, var_loc=var_loc, var_glob=var_glob,
+                                          unknown_var=unknown_var, id_list=id_list, entry=0)
 
     limit_scope(var_loc=var_loc)
 
@@ -725,7 +726,7 @@ def boolean_cf_dep(node_list, var_loc, var_glob, unknown_var, id_list, entry):
             Stores the variables currently declared and where they should be referred to.
         - var_glob: VarList
             Stores the global variables currently declared and where they should be referred to.
-        - unknown_var: list
+        - unknown_var: UnknownVarList
             Contains the variables currently not defined (could be valid because of hosting,
             therefore we check them later again).
         - id_list: list
@@ -746,8 +747,8 @@ def boolean_cf_dep(node_list, var_loc, var_glob, unknown_var, id_list, entry):
 
     for boolean_node in node_list:
         # var_loc.var_list modified for the branch
-        var_loc = build_dfg(boolean_node, var_loc=var_loc, var_glob=var_glob,
-                            unknown_var=unknown_var, id_list=id_list, entry=entry)
+        var_loc = yield build_dfg(boolean_node, var_loc=var_loc, var_glob=var_glob,
+                                  unknown_var=unknown_var, id_list=id_list, entry=entry)
 
     return [temp_list_loc, temp_list_glob, var_loc]  # returns the initial variables list + var_loc
 
@@ -771,6 +772,8 @@ def merge_var_boolean_cf(var_list_before_cond, var_list_true, var_list_false):
 
     # display_temp('True', var_list_true)
     # display_temp('False', var_list_false)
+    if var_list_true.counters is not None:
+        var_list_true.counters.nb_merges += 1
     for node_false in var_list_false.var_list:
         if not any(node_false.attributes['name'] == node_true.attributes['name']
                    for node_true in var_list_true.var_list):
@@ -817,7 +820,7 @@ def statement_scope(node, var_loc, var_glob, unknown_var, id_list, entry):
             Stores the variables currently declared and where they should be referred to.
         - var_glob: VarList
             Stores the global variables currently declared and where they should be referred to.
-        - unknown_var: list
+        - unknown_var: UnknownVarList
             Contains the variables currently not defined (could be valid because of hosting,
             therefore we check them later again).
         - id_list: list
@@ -833,8 +836,8 @@ def statement_scope(node, var_loc, var_glob, unknown_var, id_list, entry):
     for child_statement_dep in node.statement_dep_children:
         child_statement = child_statement_dep.extremity
         logging.debug('The node %s has a statement dependency', child_statement.name)
-        var_loc = build_dfg(child_statement, var_loc=var_loc, var_glob=var_glob,
-                            unknown_var=unknown_var, id_list=id_list, entry=entry)
+        var_loc = yield build_dfg(child_statement, var_loc=var_loc, var_glob=var_glob,
+                                  unknown_var=unknown_var, id_list=id_list, entry=entry)
 
     for child_cf_dep in node.control_dep_children:  # Control flow statements
         child_cf = child_cf_dep.extremity
@@ -849,17 +852,16 @@ def statement_scope(node, var_loc, var_glob, unknown_var, id_list, entry):
 
         else:  # Epsilon statements
             logging.debug('The node %s has an epsilon CF dependency', child_cf.name)
-            var_loc = build_dfg(child_cf, var_loc=var_loc, var_glob=var_glob,
-                                unknown_var=unknown_var, id_list=id_list, entry=entry)
+            var_loc = yield build_dfg(child_cf, var_loc=var_loc, var_glob=var_glob,
+                                      unknown_var=unknown_var, id_list=id_list, entry=entry)
 
     # Separate variables if separate true/false branches
-    [var_list_temp_loc, var_list_temp_glob, var_loc] = boolean_cf_dep(todo_true, var_loc=var_loc,
-                                                                      var_glob=var_glob,
-                                                                      unknown_var=unknown_var,
-                                                                      id_list=id_list, entry=entry)
-    [_, _, var_list_temp_loc] = boolean_cf_dep(todo_false, var_loc=var_list_temp_loc,
-                                               var_glob=var_list_temp_glob, unknown_var=unknown_var,
-                                               id_list=id_list, entry=entry)
+    [var_list_temp_loc, var_list_temp_glob, var_loc] = yield boolean_cf_dep(
+        todo_true, var_loc=var_loc, var_glob=var_glob, unknown_var=unknown_var, id_list=id_list,
+        entry=entry)
+    [_, _, var_list_temp_loc] = yield boolean_cf_dep(
+        todo_false, var_loc=var_list_temp_loc, var_glob=var_list_temp_glob,
+        unknown_var=unknown_var, id_list=id_list, entry=entry)
 
     if not var_loc.is_equal(var_list_temp_loc):  # Here we have
         # var_loc: variables declared in a branch when the condition was true
@@ -883,8 +885,8 @@ def build_df_variable_declaration(node, var_loc, var_glob, unknown_var, id_list,
 
     logging.debug('The node %s is a variable declaration', node.name)
     for child in node.children:
-        var_loc = var_declaration_df(child, var_loc=var_loc, var_glob=var_glob,
-                                     unknown_var=unknown_var, id_list=id_list, entry=entry)
+        var_loc = yield var_declaration_df(child, var_loc=var_loc, var_glob=var_glob,
+                                           unknown_var=unknown_var, id_list=id_list, entry=entry)
     return var_loc
 
 
@@ -892,18 +894,16 @@ def build_df_assignment(node, var_loc, var_glob, unknown_var, id_list, entry):
     """ AssignmentExpression data dependencies. """
 
     logging.debug('The node %s is an assignment expression', node.name)
-    var_loc = assignment_expr_df(node, var_loc=var_loc, var_glob=var_glob,
-                                 unknown_var=unknown_var, id_list=id_list, entry=entry)
-    return var_loc
+    return assignment_expr_df(node, var_loc=var_loc, var_glob=var_glob,
+                              unknown_var=unknown_var, id_list=id_list, entry=entry)
 
 
 def build_df_call_expr(node, var_loc, var_glob, unknown_var, id_list, entry):
     """ CallExpression on object data dependencies. """
 
     logging.debug('The node %s is a call expression on an object', node.name)
-    var_loc = assignment_expr_df(node, var_loc=var_loc, var_glob=var_glob, unknown_var=unknown_var,
-                                 id_list=id_list, entry=entry, call_expr=True)
-    return var_loc
+    return assignment_expr_df(node, var_loc=var_loc, var_glob=var_glob, unknown_var=unknown_var,
+                              id_list=id_list, entry=entry, call_expr=True)
 
 
 def build_df_update(node, var_loc, var_glob, unknown_var, id_list, entry):
@@ -943,7 +943,9 @@ def build_df_identifier(node, var_loc, var_glob, unknown_var, id_list, entry):
 
 def build_dfg(child, var_loc, var_glob, unknown_var, id_list, entry):
     """
-        Data dependency for a given node whatever it is.
+        Data dependency for a given node whatever it is. Frame to be run by run_df_frames: the
+        handlers do not call build_dfg recursively, they yield the frame of the node to handle
+        next and get its var_loc back.
 
         -------
         Parameters:
@@ -953,7 +955,7 @@ def build_dfg(child, var_loc, var_glob, unknown_var, id_list, entry):
             Stores the variables currently declared and where they should be referred to.
         - var_glob: VarList
             Stores the global variables currently declared and where they should be referred to.
-        - unknown_var: list
+        - unknown_var: UnknownVarList
             Contains the variables currently not defined (could be valid because of hosting,
             therefore we check them later again).
         - id_list: list
@@ -963,19 +965,28 @@ def build_dfg(child, var_loc, var_glob, unknown_var, id_list, entry):
 
         -------
         Returns:
-        - list
+        - VarList
             Variables currently declared.
     """
 
-    if child.name == 'VariableDeclaration':
+    counters = var_loc.counters
+    if counters is not None:
+        counters.enter_node(child.name, var_loc, var_glob)
+
+    if child.name == DEFERRED_BODY:  # Function body handled later, cf. build_dfg_parallel.py
+        child.set_attribute('var_loc', var_loc.copy_var_list_limited_scope())
+        child.set_attribute('var_glob', var_glob.copy_var_list_limited_scope())
+
+    elif child.name == 'VariableDeclaration':
         if child.attributes['kind'] != 'var':  # let or const
             if not var_loc.limited_scope.before_limit_list:  # If before_list is empty
                 var_loc.set_before_limit_list(var_loc.var_list)  # We fill it
             # Otherwise it stays as it is
 
-            var_loc = build_df_variable_declaration(child, var_loc=var_loc, var_glob=var_glob,
-                                                    unknown_var=unknown_var, id_list=id_list,
-                                                    entry=entry)
+            var_loc = yield build_df_variable_declaration(child, var_loc=var_loc,
+                                                          var_glob=var_glob,
+                                                          unknown_var=unknown_var,
+                                                          id_list=id_list, entry=entry)
             var_loc.set_limit(True)  # To limit the visibility only to the upper block
             for node in var_loc.var_list:
                 # If we have a node that is not in the before_list and has not been handled yet
@@ -986,56 +997,108 @@ def build_dfg(child, var_loc, var_glob, unknown_var, id_list, entry):
                     logging.debug('The variable %s has a limited scope', node.attributes['name'])
                     var_loc.add_el_limit_list(node)  # Add to after_list
         else:
-            var_loc = build_df_variable_declaration(child, var_loc=var_loc, var_glob=var_glob,
-                                                    unknown_var=unknown_var, id_list=id_list,
-                                                    entry=entry)
+            var_loc = yield build_df_variable_declaration(child, var_loc=var_loc,
+                                                          var_glob=var_glob,
+                                                          unknown_var=unknown_var,
+                                                          id_list=id_list, entry=entry)
 
     elif child.name == 'AssignmentExpression':
-        var_loc = build_df_assignment(child, var_loc=var_loc, var_glob=var_glob,
-                                      unknown_var=unknown_var, id_list=id_list, entry=entry)
+        var_loc = yield build_df_assignment(child, var_loc=var_loc, var_glob=var_glob,
+                                            unknown_var=unknown_var, id_list=id_list, entry=entry)
 
     elif (child.name == 'CallExpression' and child.children[0].name == 'MemberExpression'
           and child.children[0].children[0].name != 'ThisExpression'
           and 'window' not in child.children[0].children[0].attributes.values())\
             or (child.name == 'CallExpression' and child.children[0].name == 'MemberExpression'
                 and child.children[0].parent.name == 'MemberExpression'):
-        var_loc = build_df_call_expr(child, var_loc=var_loc, var_glob=var_glob,
-                                     unknown_var=unknown_var, id_list=id_list, entry=entry)
+        var_loc = yield build_df_call_expr(child, var_loc=var_loc, var_glob=var_glob,
+                                           unknown_var=unknown_var, id_list=id_list, entry=entry)
 
     elif child.name == 'UpdateExpression':
         build_df_update(child, var_loc=var_loc, var_glob=var_glob, unknown_var=unknown_var,
                         id_list=id_list, entry=entry)
 
     elif child.name == 'FunctionDeclaration':
-        var_loc = build_df_function(child, var_loc=var_loc, var_glob=var_glob,
-                                    unknown_var=unknown_var, id_list=id_list)
+        var_loc = yield build_df_function(child, var_loc=var_loc, var_glob=var_glob,
+                                          unknown_var=unknown_var, id_list=id_list)
 
     elif child.name == 'FunctionExpression':
-        var_loc = build_df_function(child, var_loc=var_loc, var_glob=var_glob,
-                                    unknown_var=unknown_var, id_list=id_list, fun_expr=True)
+        var_loc = yield build_df_function(child, var_loc=var_loc, var_glob=var_glob,
+                                          unknown_var=unknown_var, id_list=id_list, fun_expr=True)
 
     elif child.is_statement():
-        var_loc = build_df_statement(child, var_loc=var_loc, var_glob=var_glob,
-                                     unknown_var=unknown_var, id_list=id_list, entry=entry)
+        var_loc = yield build_df_statement(child, var_loc=var_loc, var_glob=var_glob,
+                                           unknown_var=unknown_var, id_list=id_list, entry=entry)
 
     elif child.name == 'ObjectExpression':  # Only consider the object name, no properties
-        var_loc = obj_expr_scope(child, var_loc=var_loc, var_glob=var_glob, unknown_var=unknown_var,
-                                 id_list=id_list)
+        var_loc = yield obj_expr_scope(child, var_loc=var_loc, var_glob=var_glob,
+                                       unknown_var=unknown_var, id_list=id_list)
 
     elif child.name == 'Identifier':
         build_df_identifier(child, var_loc=var_loc, var_glob=var_glob, unknown_var=unknown_var,
                             id_list=id_list, entry=entry)
 
     else:
-        var_loc = df_scoping(child, var_loc=var_loc, var_glob=var_glob, unknown_var=unknown_var,
-                             id_list=id_list)[1]
+        var_loc = yield df_children(child, var_loc=var_loc, var_glob=var_glob,
+                                    unknown_var=unknown_var, id_list=id_list, entry=0)
     # display_temp('> Local: ', var_loc)
     # display_temp('> Global: ', var_glob)
 
+    if counters is not None:
+        counters.exit_node()
     return var_loc
 
 
-def df_scoping(cfg_nodes, var_loc, var_glob, unknown_var, id_list, entry=0):
+def df_children(node, var_loc, var_glob, unknown_var, id_list, entry):
+    """ Frame handling the data dependencies of the children of node, one after the other. """
+
+    for child in node.children:
+        var_loc = yield build_dfg(child, var_loc=var_loc, var_glob=var_glob,
+                                  unknown_var=unknown_var, id_list=id_list, entry=entry)
+    return var_loc
+
+
+def run_df_frames(frame, budget=None, counters=None):
+    """
+        Runs a data flow frame with an explicit work stack, so that the depth of the AST is not
+        bounded by the Python recursion limit. Each frame is a generator which yields the frame of
+        a node to handle first (continuation) and is resumed with the var_loc that frame returned.
+
+        -------
+        Parameter:
+        - frame: generator
+            Frame to run, e.g. df_children(<cfg_nodes>, ...).
+        - budget: Budget
+            Checked before each frame is run, raises Budget.Exceeded once spent. Default: None.
+        - counters: DfCounters
+            Counts the frames run, per handler. Default: None.
+
+        -------
+        Returns:
+        - VarList
+            Value returned by frame, i.e. the variables currently declared.
+    """
+
+    stack = [frame]
+    var_loc = None
+    while stack:
+        try:
+            next_frame = stack[-1].send(var_loc)
+        except StopIteration as frame_end:
+            stack.pop()
+            var_loc = frame_end.value  # Handed back to the frame which yielded the ended one
+        else:
+            if budget is not None:
+                budget.step()
+            if counters is not None:
+                counters.count_frame(next_frame.__name__)
+            stack.append(next_frame)
+            var_loc = None  # A new generator can only be started with None
+    return var_loc
+
+
+def df_scoping(cfg_nodes, var_loc, var_glob, unknown_var, id_list, entry=0, budget=None,
+               counters=None):
     """
         Data dependency for a complete CFG.
 
@@ -1047,13 +1110,20 @@ def df_scoping(cfg_nodes, var_loc, var_glob, unknown_var, id_list, entry=0):
             Stores the variables currently declared and where they should be referred to.
         - var_glob: VarList
             Stores the global variables currently declared and where they should be referred to.
-        - unknown_var: list
+        - unknown_var: UnknownVarList
             Contains the variables currently not defined (could be valid because of hosting,
             therefore we check them later again).
         - id_list: list
             Stores the id of the node already handled.
         - entry: int
             Indicates if we are in the global scope (1) or not (0). Default: 0.
+        - budget: Budget
+            Steps and time allowed. Once spent, we stop and keep the data flow dependencies
+            added so far (budget.exceeded is then True). Default: None, i.e. unlimited.
+        - counters: DfCounters
+            Filled with the handler calls, VarList copies, edges, time per node kind. Carried
+            by var_loc and var_glob, and the VarLists copied from them, to the handlers.
+            Default: None, i.e. no instrumentation.
 
         -------
         Returns:
@@ -1061,7 +1131,11 @@ def df_scoping(cfg_nodes, var_loc, var_glob, unknown_var, id_list, entry=0):
             With data flow dependencies added.
     """
 
-    for child in cfg_nodes.children:
-        var_loc = build_dfg(child, var_loc=var_loc, var_glob=var_glob, unknown_var=unknown_var,
-                            id_list=id_list, entry=entry)
+    var_loc.counters = var_glob.counters = counters
+    try:
+        var_loc = run_df_frames(df_children(cfg_nodes, var_loc=var_loc, var_glob=var_glob,
+                                            unknown_var=unknown_var, id_list=id_list,
+                                            entry=entry), budget=budget, counters=counters)
+    except utility_df.Budget.Exceeded:
+        logging.warning('The data flow budget was exceeded after %s steps', budget.nb_steps)
     return [cfg_nodes, var_loc]
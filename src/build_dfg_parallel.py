@@ -0,0 +1,297 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Builds the data flow of the outermost function bodies in parallel.
+
+    1. Global summary: the bodies are replaced by a placeholder and df_scoping runs on the rest
+    of the file. Each placeholder stores the local and global variables known when entering the
+    body, i.e. the state function_scope would have given to it.
+    2. The bodies are handled by a process pool (forked, so that the PDG is not pickled), each
+    against its summary. The workers return their data flow edges as node ids.
+    3. A body which modified the global variables (e.g. a = 1 without var), or which declares a
+    function that may hoist a variable undefined in the global scope, influences what comes after
+    it. It is therefore handled sequentially in a new round, and the bodies whose summary changed
+    are handled again. So is a body df_scoping did not enter, and therefore did not summarize, e.g.
+    (function(){...}).call(this), whose identifiers it only searches.
+    4. The edges are merged back into the PDG, and the variables still undefined in a body are
+    hoisted with the functions declared after it, as function_scope would have done.
+
+    The summary and the results of each body are stored in the attribute function_bodies of the
+    PDG, so that they can be reused when the file is modified (cf. incremental_pdg.py).
+"""
+
+import logging
+import multiprocessing
+
+import build_dfg
+import utility_df
+import unknown_var_list
+from node import Node
+from pdg_format import get_all_nodes
+
+
+DEFERRED = []  # [placeholder, body] of the function bodies, inherited by the forked workers
+BUDGET = [None]  # Budget of the data flow, inherited by the forked workers
+
+
+def defer_function_bodies(cfg_nodes, inline_bodies):
+    """
+        Replaces the bodies of the outermost FunctionDeclaration and FunctionExpression nodes with
+        placeholders.
+
+        -------
+        Parameters:
+        - cfg_nodes: Node
+            Output of build_cfg.
+        - inline_bodies: set
+            Ids of the bodies to handle sequentially, i.e. not to replace.
+
+        -------
+        Returns:
+        - list
+            [placeholder, body] for each function body replaced.
+    """
+
+    deferred, to_visit = [], [cfg_nodes]
+    while to_visit:
+        node = to_visit.pop()
+        if node.name in ('FunctionDeclaration', 'FunctionExpression'):
+            for i, child in enumerate(node.children):
+                if child.body == 'body' and child.id not in inline_bodies:
+                    placeholder = Node(build_dfg.DEFERRED_BODY, parent=node)
+                    node.children[i] = placeholder
+                    deferred.append([placeholder, child])
+        else:
+            to_visit.extend(reversed(node.children))
+    return deferred
+
+
+def restore_function_bodies(deferred):
+    """ Puts the function bodies back in place of their placeholders. """
+
+    for placeholder, body in deferred:
+        fun_node = placeholder.parent
+        fun_node.children[fun_node.children.index(placeholder)] = body
+
+
+def same_scope(var_list1, var_list2):
+    """ Indicates whether two VarList objects refer to the same variables, same limited scope. """
+
+    return var_list1.is_equal(var_list2) and var_list1.get_limit() == var_list2.get_limit()\
+        and var_list1.get_before_limit_list() == var_list2.get_before_limit_list()\
+        and var_list1.get_after_limit_list() == var_list2.get_after_limit_list()
+
+
+def get_hoisting_nodes(node):
+    """ Identifier nodes descendant of node which call hoisting in build_dfg (function names and
+    object keys), per name, in the order they are handled. """
+
+    hoisting_nodes = dict()
+    for child in get_all_nodes(node):
+        if (child.body == 'id' and child.parent.name == 'FunctionDeclaration')\
+                or (child.body == 'key' and child.parent.parent.name == 'ObjectExpression'):
+            for identifier in build_dfg.search_identifiers(child, id_list=[], tab=[]):
+                hoisting_nodes.setdefault(identifier.attributes['name'], []).append(identifier)
+    return hoisting_nodes
+
+
+def get_var_list_ids(var_list):
+    """ VarList content (variables, references, functions, limited scope) with node ids. """
+
+    refs = []
+    for ref in var_list.ref_list:
+        if isinstance(ref, list):
+            refs.append([node.id for node in ref])
+        else:
+            refs.append(ref if ref is None else ref.id)
+    return [[node.id for node in var_list.var_list], refs, list(var_list.fun_list),
+            var_list.get_limit(), [node.id for node in var_list.get_before_limit_list()],
+            [node.id for node in var_list.get_after_limit_list()]]
+
+
+def df_function_body(index):
+    """
+        Data flow of one function body, run by a worker.
+
+        -------
+        Parameter:
+        - index: int
+            Position of the function body in DEFERRED.
+
+        -------
+        Returns:
+        - list
+            * Elt1: list of [begin, extremity, id_begin, id_end] ids, the data flow edges added;
+            * Elt2: list of the ids of the Identifier nodes still undefined;
+            * Elt3: bool, True if the global variables were modified;
+            * Elt4: bool, True if the budget was exceeded.
+    """
+
+    placeholder, body = DEFERRED[index]
+    var_glob = placeholder.attributes['var_glob'].copy_var_list_limited_scope()
+    unknown_var = unknown_var_list.UnknownVarList()
+    truncated = False
+    try:
+        build_dfg.run_df_frames(build_dfg.build_dfg(body, var_loc=placeholder.attributes['var_loc'],
+                                                    var_glob=var_glob, unknown_var=unknown_var,
+                                                    id_list=[], entry=0), budget=BUDGET[0])
+    except utility_df.Budget.Exceeded:
+        truncated = True
+
+    edges = []
+    for node in get_all_nodes(body):  # The edges added all end in the body
+        for dep in node.data_dep_parents:
+            edges.append([dep.extremity.id, node.id, dep.id_begin.id, dep.id_end.id])
+    return [edges, [unknown.id for unknown in unknown_var.get_var_list()],
+            not same_scope(var_glob, placeholder.attributes['var_glob']), truncated]
+
+
+def df_function_bodies(deferred, all_results, budget, workers, reusable=None):
+    """ Runs df_function_body in a process pool for the bodies of deferred whose summary is not
+    in all_results yet, or changed. all_results: body id -> [var_loc, var_glob, results].
+    reusable: ReusableBodies or None, results of a previous version of the file. """
+
+    todo = []
+    for i, [placeholder, body] in enumerate(deferred):
+        if body.id not in all_results\
+                or not same_scope(all_results[body.id][0], placeholder.attributes['var_loc'])\
+                or not same_scope(all_results[body.id][1], placeholder.attributes['var_glob']):
+            results = None
+            if reusable is not None:
+                results = reusable.get_results(body.id,
+                                               get_var_list_ids(placeholder.attributes['var_loc']),
+                                               get_var_list_ids(placeholder.attributes['var_glob']))
+            if results is None:
+                todo.append(i)
+            else:
+                all_results[body.id] = [placeholder.attributes['var_loc'],
+                                        placeholder.attributes['var_glob'], results]
+    logging.debug('Building the data flow of %s function bodies with %s processes',
+                  len(todo), workers)
+    if not todo:
+        return
+
+    DEFERRED[:] = deferred
+    BUDGET[0] = budget
+    try:
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            todo_results = pool.map(df_function_body, todo,
+                                    chunksize=max(1, len(todo) // (4 * workers)))
+    finally:
+        DEFERRED[:] = []
+        BUDGET[0] = None
+    for i, results in zip(todo, todo_results):
+        [placeholder, body] = deferred[i]
+        all_results[body.id] = [placeholder.attributes['var_loc'],
+                                placeholder.attributes['var_glob'], results]
+
+
+def merge_function_body(results, body, node_dict, hoisting_nodes, unknown_var):
+    """ Adds to the PDG the data flow edges found in body by df_function_body. """
+
+    [edges, unknown_ids, _, _] = results
+    for [begin, extremity, id_begin, id_end] in edges:
+        node_dict[begin].set_data_dependency(extremity=node_dict[extremity],
+                                             begin=node_dict[id_begin], end=node_dict[id_end])
+
+    last_id = max(node.id for node in get_all_nodes(body))
+    for unknown_id in unknown_ids:
+        unknown = node_dict[unknown_id]
+        # First function declared after the body, which would have hoisted unknown
+        fun_name = next((fun for fun in hoisting_nodes.get(unknown.attributes['name'], [])
+                         if fun.id > last_id), None)
+        if fun_name is not None:
+            logging.debug('Using hoisting, the function %s was first used, then defined',
+                          fun_name.attributes['name'])
+            build_dfg.get_nearest_statement(fun_name).set_data_dependency(
+                extremity=build_dfg.get_nearest_statement(unknown), begin=fun_name, end=unknown)
+        else:
+            unknown_var.add_var(unknown)
+
+
+def df_scoping_parallel(cfg_nodes, var_loc, var_glob, unknown_var, id_list, entry=0, budget=None,
+                        workers=utility_df.NUM_WORKERS, reusable=None, counters=None):
+    """
+        Data dependency for a complete CFG, the outermost function bodies being handled in
+        parallel. Same parameters and output as df_scoping, plus:
+
+        -------
+        Parameters:
+        - workers: int
+            Number of processes building the data flow of the function bodies.
+            Default: NUM_WORKERS.
+        - reusable: ReusableBodies
+            Data flow of the function bodies of a previous version of the file, reused when
+            neither a body nor its summary changed. Default: None.
+        - counters: DfCounters
+            As in df_scoping, the function bodies handled by the workers are not counted.
+            Default: None.
+    """
+
+    all_nodes = get_all_nodes(cfg_nodes)
+    all_results = dict()
+    inline_bodies = set()
+    while True:
+        for node in all_nodes:  # Data flow of the previous round
+            node.data_dep_parents, node.data_dep_children = [], []
+        round_unknown_var = unknown_var_list.UnknownVarList()
+        deferred = defer_function_bodies(cfg_nodes, inline_bodies)
+        try:
+            round_var_loc = build_dfg.df_scoping(cfg_nodes,
+                                                 var_loc=var_loc.copy_var_list_limited_scope(),
+                                                 var_glob=var_glob.copy_var_list(),
+                                                 unknown_var=round_unknown_var,
+                                                 id_list=list(id_list), entry=entry,
+                                                 budget=budget, counters=counters)[1]
+        finally:
+            restore_function_bodies(deferred)
+        # Bodies df_scoping did not enter, e.g. (function(){...}).call(this): it only searched
+        # their identifiers, which it can only do sequentially
+        unreached_bodies = set(body.id for [placeholder, body] in deferred
+                               if 'var_glob' not in placeholder.attributes)
+        deferred = [[placeholder, body] for [placeholder, body] in deferred
+                    if body.id not in unreached_bodies]
+        if budget is not None and budget.exceeded:
+            deferred = []  # Partial PDG, without the function bodies
+            break
+
+        df_function_bodies(deferred, all_results, budget, workers, reusable)
+        new_inline_bodies = unreached_bodies
+        for placeholder, body in deferred:
+            results = all_results[body.id][2]
+            if results[2] or any(round_unknown_var.was_unknown(fun_name)
+                                 for fun_name in get_hoisting_nodes(body)):
+                new_inline_bodies.add(body.id)
+            if results[3] and budget is not None:
+                budget.exceeded = True
+        if not new_inline_bodies or (budget is not None and budget.exceeded):
+            break
+        logging.debug('%s function bodies influence the global scope or are not entered, '
+                      'handled sequentially', len(new_inline_bodies))
+        inline_bodies |= new_inline_bodies
+
+    for unknown in round_unknown_var.get_var_list():
+        unknown_var.add_var(unknown)
+    node_dict = {node.id: node for node in all_nodes}
+    hoisting_nodes = get_hoisting_nodes(cfg_nodes)
+    function_bodies = []
+    for placeholder, body in deferred:
+        [body_var_loc, body_var_glob, results] = all_results[body.id]
+        merge_function_body(results, body, node_dict, hoisting_nodes, unknown_var)
+        if not results[3]:
+            function_bodies.append([body.id, get_var_list_ids(body_var_loc),
+                                    get_var_list_ids(body_var_glob), results])
+    cfg_nodes.set_attribute('function_bodies', function_bodies)
+    return [cfg_nodes, round_var_loc]
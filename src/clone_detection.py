@@ -16,8 +16,11 @@
 2. Find all clones.
 """
 
+import hashlib
+
 from equivalence_classes import *
 from clone_metric import *
+from utility_df import Budget
 
 
 LEAF_STATEMENTS = ['BreakStatement', 'ContinueStatement']
@@ -50,6 +53,23 @@ def traverse(node, tab):
     return tab
 
 
+def get_subtree_hash(nodes):
+    """ Hash of the types (Node.name) of a list of nodes, e.g. the output of traverse. """
+
+    return hashlib.sha1('\0'.join(node.name for node in nodes).encode('utf-8')).hexdigest()
+
+
+def get_subtree_kinds(node, subtree_kinds=None):
+    """ get_subtree_hash(traverse(node)), cached in subtree_kinds, {id(node): hash}, which only
+    holds the nodes of the current pair. """
+
+    if subtree_kinds is None:
+        return get_subtree_hash(traverse(node, tab=[]))
+    if id(node) not in subtree_kinds:
+        subtree_kinds[id(node)] = get_subtree_hash(traverse(node, tab=[]))
+    return subtree_kinds[id(node)]
+
+
 def handle_statement_node(node, non_statement_list, label):
     """
         Traverses a Statement node by following the statement / control dependencies.
@@ -102,7 +122,7 @@ def traverse_statement_node(node, non_statement_list, init=1):
     return non_statement_list
 
 
-def search_handled_nodes(node1, node2, all_clones_list):
+def search_handled_nodes(node1, node2, all_clones_list, budget=None, subtree_kinds=None):
     """
         Searches the nodes that have already been handled, so as not to do backward slicing again.
 
@@ -114,6 +134,10 @@ def search_handled_nodes(node1, node2, all_clones_list):
             Statement node 2.
         - all_clones_list: list of BiList()
             Contains the clones that have already been found so far.
+        - budget: Budget
+            Steps and time allowed for the clone detection. Default: None, i.e. unlimited.
+        - subtree_kinds: dict
+            Cache of get_subtree_kinds for the current pair. Default: None, i.e. no cache.
     """
 
     current_clone_list = all_clones_list[-1]  # current clone list stored last
@@ -127,10 +151,11 @@ def search_handled_nodes(node1, node2, all_clones_list):
             del current_clone_list.list1[i]
             del current_clone_list.list2[i]
     current_clone_list.append_list(node1, node2)  # Otherwise: new pair of clones
-    follow_dependencies(node1, node2, all_clones_list)
+    follow_dependencies(node1, node2, all_clones_list, budget, subtree_kinds)
 
 
-def find_clones(node1, node2, all_clones_list, tab_handled, jump=0, jump_match=0):
+def find_clones(node1, node2, all_clones_list, tab_handled, jump=0, jump_match=0, budget=None,
+                subtree_kinds=None):
     """
         Compare two statement nodes. We consider that they are equal (return True) iff:
             - they have the same type (referred to as Node.name);
@@ -155,13 +180,17 @@ def find_clones(node1, node2, all_clones_list, tab_handled, jump=0, jump_match=0
             Jumps over a sibling DD. Default: 0.
         - jump_match: int
             Jumps over a sibling DD and matches. Default: 0.
+        - budget: Budget
+            Steps and time allowed for the clone detection. Default: None, i.e. unlimited.
+        - subtree_kinds: dict
+            Cache of get_subtree_kinds for the current pair. Default: None, i.e. no cache.
     """
 
-    if node1.name == node2.name:
-        belongs_node1 = traverse(node1, tab=[])
-        belongs_node2 = traverse(node2, tab=[])
+    if budget is not None:
+        budget.step()
 
-        if [elt1.name for elt1 in belongs_node1] == [elt2.name for elt2 in belongs_node2]:
+    if node1.name == node2.name:
+        if get_subtree_kinds(node1, subtree_kinds) == get_subtree_kinds(node2, subtree_kinds):
             logging.debug('Clone found at the ' + node1.name + ' level, between node id '
                           + str(node1.id) + ' and ' + str(node2.id))
 
@@ -174,7 +203,7 @@ def find_clones(node1, node2, all_clones_list, tab_handled, jump=0, jump_match=0
                 # 4 - Still, we keep the clones history
                 all_clones_list.append(current_clone_list_copy)
             tab_handled.append(str(node1.id) + '_' + str(node2.id))
-            search_handled_nodes(node1, node2, all_clones_list)
+            search_handled_nodes(node1, node2, all_clones_list, budget, subtree_kinds)
 
             if jump != 0:
                 # 2 - and we have a match
@@ -182,6 +211,8 @@ def find_clones(node1, node2, all_clones_list, tab_handled, jump=0, jump_match=0
             return [jump, jump_match]
 
     for parent_f1_dep in data_or_control(node1, 'data'):  # Jump over benign DD if not match found
+        if budget is not None:
+            budget.step()
         jump += 1  # 1 - If the loop is iterated several times
         parent_f1 = parent_f1_dep.extremity
         if str(parent_f1.id) + '_' + str(node2.id) not in tab_handled:
@@ -189,11 +220,11 @@ def find_clones(node1, node2, all_clones_list, tab_handled, jump=0, jump_match=0
                           + str(parent_f1.id) + ' with the malicious ' + str(node2.id))
             tab_handled.append(str(parent_f1.id) + '_' + str(node2.id))
             [jump, jump_match] = find_clones(parent_f1, node2, all_clones_list, tab_handled, jump,
-                                             jump_match)
+                                             jump_match, budget, subtree_kinds)
     return [jump, jump_match]
 
 
-def follow_dependency(node1, node2, label, all_clones_list):
+def follow_dependency(node1, node2, label, all_clones_list, budget=None, subtree_kinds=None):
     """
         Given two statement nodes, does backward slicing to find clones.
 
@@ -207,6 +238,10 @@ def follow_dependency(node1, node2, label, all_clones_list):
             Indicates if we are handling data or control dependencies.
         - all_clones_list: list of BiList()
             Contains the clones that have already been found so far.
+        - budget: Budget
+            Steps and time allowed for the clone detection. Default: None, i.e. unlimited.
+        - subtree_kinds: dict
+            Cache of get_subtree_kinds for the current pair. Default: None, i.e. no cache.
     """
 
     for parent_f1_dep in data_or_control(node1, label):
@@ -215,10 +250,11 @@ def follow_dependency(node1, node2, label, all_clones_list):
             for parent_f2_dep in data_or_control(node2, label):
                 parent_f2 = parent_f2_dep.extremity
                 if node2.id != parent_f2_dep.extremity.id:  # To avoid infinite loops
-                    find_clones(parent_f1, parent_f2, all_clones_list, tab_handled=[])
+                    find_clones(parent_f1, parent_f2, all_clones_list, tab_handled=[],
+                                budget=budget, subtree_kinds=subtree_kinds)
 
 
-def follow_dependencies(node1, node2, all_clones_list):
+def follow_dependencies(node1, node2, all_clones_list, budget=None, subtree_kinds=None):
     """
         Given two statement nodes, does backward slicing to find clones.
 
@@ -230,10 +266,14 @@ def follow_dependencies(node1, node2, all_clones_list):
             Statement node 2.
         - all_clones_list: list of BiList()
             Contains the clones that have already been found so far.
+        - budget: Budget
+            Steps and time allowed for the clone detection. Default: None, i.e. unlimited.
+        - subtree_kinds: dict
+            Cache of get_subtree_kinds for the current pair. Default: None, i.e. no cache.
     """
 
-    follow_dependency(node1, node2, 'control', all_clones_list)
-    follow_dependency(node1, node2, 'data', all_clones_list)
+    follow_dependency(node1, node2, 'control', all_clones_list, budget, subtree_kinds)
+    follow_dependency(node1, node2, 'data', all_clones_list, budget, subtree_kinds)
 
     """
     if node1.name != 'Program' and node2.name != 'Program':
@@ -272,7 +312,52 @@ def annotate_clone(all_clones_list, res_dict):
             res_dict['similar'].append(list_per_statement)
 
 
-def find_all_clones(dfg_nodes1, dfg_nodes2):
+def use_sidecar(pdg, sidecar, my_id, equivalence_classes, subtree_kinds):
+    """
+        Fills equivalence_classes and subtree_kinds with the artifacts precomputed for pdg.
+
+        -------
+        Parameters:
+        - pdg: Node
+            PDG considered.
+        - sidecar: dict
+            Output of pdg_sidecar.build_sidecar(pdg).
+        - my_id: int, either 1 or 2
+            Indicates if we are handling graph1 or graph2.
+        - equivalence_classes: dict
+            Equivalence classes, as filled by get_equivalence_classes_graph.
+        - subtree_kinds: dict
+            Cache of get_subtree_kinds for the current pair.
+
+        -------
+        Returns:
+        - bool
+            False if the sidecar does not match pdg (nothing is filled then).
+    """
+
+    node_dict = dict()
+    to_visit = [pdg]
+    while to_visit:
+        node = to_visit.pop()
+        node_dict[node.id] = node
+        to_visit.extend(node.children)
+    if len(node_dict) != sidecar['nb_nodes']\
+            or any(int(node_id) not in node_dict for node_id in sidecar['subtrees'])\
+            or any(node_id not in node_dict for node_ids in sidecar['equivalence'].values()
+                   for node_id in node_ids):
+        logging.warning('The sidecar does not match the PDG, it is not used')
+        return False
+    for node_id, subtree_hash in sidecar['subtrees'].items():
+        subtree_kinds[id(node_dict[int(node_id)])] = subtree_hash
+    for kind, node_ids in sidecar['equivalence'].items():
+        if kind not in equivalence_classes:
+            equivalence_classes[kind] = BiList()
+        for node_id in node_ids:
+            equivalence_classes[kind].append_equivalence(node_dict[node_id], my_id)
+    return True
+
+
+def find_all_clones(dfg_nodes1, dfg_nodes2, budget=None, sidecars=None):
     """
         Given an EquivalenceClass object, tests all the nodes with one another to detect clones.
 
@@ -282,6 +367,12 @@ def find_all_clones(dfg_nodes1, dfg_nodes2):
             PDG of the benign file.
         - dfg_nodes2: Node
             PDG of the malicious file.
+        - budget: Budget
+            Steps and time allowed. Once spent, we stop and return the clones found so far
+            (budget.exceeded is then True). Default: None, i.e. unlimited.
+        - sidecars: list
+            [sidecar1, sidecar2], artifacts precomputed for dfg_nodes1 and dfg_nodes2 (cf.
+            pdg_sidecar.py), each possibly None. Default: None, i.e. computed here.
 
         -------
         Returns:
@@ -289,15 +380,26 @@ def find_all_clones(dfg_nodes1, dfg_nodes2):
             Contains the groups of clones, after duplicate deletion, found at the end.
     """
 
-    equivalence_classes = get_equivalence_classes(dfg_nodes1, dfg_nodes2, equivalence_classes={})
+    equivalence_classes = dict()
+    subtree_kinds = dict()  # Of this pair only: ids of nodes may be reused after it
+    for my_id, [pdg, sidecar] in enumerate(zip([dfg_nodes1, dfg_nodes2], sidecars or [None] * 2)):
+        if sidecar is None or not use_sidecar(pdg, sidecar, my_id + 1, equivalence_classes,
+                                              subtree_kinds):
+            get_equivalence_classes_graph(pdg, my_id + 1, equivalence_classes)
     all_clones_list, tab_handled = [], []
-    for equivalence_class in equivalence_classes.values():
-        for node2 in equivalence_class.list2:
-            for node1 in equivalence_class.list1:
-                all_clones_list.append(BiList())
-                find_clones(node1, node2, all_clones_list, tab_handled=tab_handled)
-                if all_clones_list[-1].is_empty():
-                    all_clones_list.remove(all_clones_list[-1])
+    try:
+        for equivalence_class in equivalence_classes.values():
+            for node2 in equivalence_class.list2:
+                for node1 in equivalence_class.list1:
+                    all_clones_list.append(BiList())
+                    find_clones(node1, node2, all_clones_list, tab_handled=tab_handled,
+                                budget=budget, subtree_kinds=subtree_kinds)
+                    if all_clones_list[-1].is_empty():
+                        all_clones_list.remove(all_clones_list[-1])
+    except Budget.Exceeded:
+        logging.warning('The clone detection budget was exceeded after %s steps',
+                        budget.nb_steps)
+        del all_clones_list[-1]  # Clone being built when the budget was exceeded
     # print_clones(all_clones_list)
     return all_clones_list
 
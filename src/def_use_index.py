@@ -0,0 +1,114 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Definition of class DefUseIndex: reaching definitions of each use of a variable, from the
+    id_begin/id_end of the data flow edges. Stored in JSON next to the PDG, so that it can be
+    queried without unpickling the PDG.
+    The def-use index of <folder>/<PDG name> is <folder>-def-use/<PDG name>.json.
+"""
+
+import os
+import json
+
+
+class DefUseIndex:
+
+    def __init__(self):
+        self.use_dict = dict()  # Use Identifier id -> ids of its reaching definitions
+        self.def_dict = dict()  # Definition Identifier id -> ids of the uses it reaches
+        self.name_dict = dict()  # Variable name -> {'defs': ids, 'uses': ids}
+
+    def __len__(self):
+        return len(self.use_dict)
+
+    def add_def_use(self, def_node, use_node):
+        defs = self.use_dict.setdefault(use_node.id, [])
+        if def_node.id in defs:
+            return
+        defs.append(def_node.id)
+        self.def_dict.setdefault(def_node.id, []).append(use_node.id)
+        for identifier, kind in ((def_node, 'defs'), (use_node, 'uses')):
+            ids = self.name_dict.setdefault(identifier.attributes['name'],
+                                            {'defs': [], 'uses': []})[kind]
+            if identifier.id not in ids:
+                ids.append(identifier.id)
+
+    def get_definitions(self, use_id):
+        return self.use_dict.get(use_id, [])
+
+    def get_uses(self, def_id):
+        return self.def_dict.get(def_id, [])
+
+    def get_definitions_by_name(self, var_name):
+        return self.name_dict.get(var_name, {'defs': []})['defs']
+
+    def get_uses_by_name(self, var_name):
+        return self.name_dict.get(var_name, {'uses': []})['uses']
+
+    def store(self, json_path):
+        with open(json_path, 'w') as json_file:
+            json.dump({'uses': self.use_dict, 'defs': self.def_dict, 'names': self.name_dict},
+                      json_file)
+
+    @staticmethod
+    def load(json_path):
+        def_use = DefUseIndex()
+        with open(json_path) as json_file:
+            data = json.load(json_file)
+        # JSON keys are strings
+        def_use.use_dict = {int(use_id): defs for use_id, defs in data['uses'].items()}
+        def_use.def_dict = {int(def_id): uses for def_id, uses in data['defs'].items()}
+        def_use.name_dict = data['names']
+        return def_use
+
+
+def build_def_use_index(dfg_nodes):
+    """
+        Def-use index of a PDG.
+
+        -------
+        Parameter:
+        - dfg_nodes: Node
+            Output of df_scoping.
+
+        -------
+        Returns:
+        - DefUseIndex
+    """
+
+    def_use = DefUseIndex()
+    to_visit = [dfg_nodes]
+    while to_visit:
+        node = to_visit.pop()
+        for dep in node.data_dep_children:
+            if dep.id_begin is not None and dep.id_end is not None:
+                def_use.add_def_use(dep.id_begin, dep.id_end)
+        to_visit.extend(reversed(node.children))
+    return def_use
+
+
+def get_def_use_path(pdg_path):
+    """ Path of the def-use index of the PDG pdg_path (possibly in an archive). """
+
+    return os.path.join(os.path.normpath(os.path.dirname(pdg_path)) + '-def-use',
+                        os.path.basename(pdg_path) + '.json')
+
+
+def store_def_use_index(def_use, pdg_path):
+    """ Stores the DefUseIndex def_use of the PDG stored in pdg_path. """
+
+    def_use_path = get_def_use_path(pdg_path)
+    os.makedirs(os.path.dirname(def_use_path), exist_ok=True)
+    def_use.store(def_use_path)
@@ -28,9 +28,10 @@ from node import *
 from extended_ast import *
 
 SRC_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__)))
+JSON_SEPARATOR = '##!!JSON!!##'  # Before the AST in the output of js_ast.js, for json_path '-'
 
 
-def get_extended_ast(input_file, json_path='1', remove_json=True):
+def get_extended_ast(input_file, json_path='1', remove_json=True, source=None):
     """
         JavaScript AST production.
 
@@ -39,10 +40,14 @@ def get_extended_ast(input_file, json_path='1', remove_json=True):
         - input_file: str
             Path of the file to produce an AST from.
         - json_path: str
-            Path of the JSON file to temporary store the AST in.
+            Path of the JSON file to temporary store the AST in, or '-' to get it through the
+            stdout of Esprima, without any file.
         - remove_json: bool
             Indicates whether to remove or not the JSON file containing the Esprima AST.
             Default: True.
+        - source: bytes
+            Content of input_file, given to Esprima on stdin, e.g. for a member of an archive
+            which is not extracted. Default: None, i.e. input_file is read.
 
         -------
         Returns:
@@ -52,29 +57,32 @@ def get_extended_ast(input_file, json_path='1', remove_json=True):
         - None if an error occurred.
     """
 
-    produce_ast = run(['node', os.path.join(SRC_PATH, 'js_ast.js'), input_file, json_path],
-                      stdout=PIPE)
+    produce_ast = run(['node', os.path.join(SRC_PATH, 'js_ast.js'),
+                       input_file if source is None else '-', json_path],
+                      stdout=PIPE, input=source)
     if produce_ast.returncode == 0:
         if json_path == '1':
             ast = produce_ast.stdout.decode('utf-8').replace('\n', '')
             return ast.split('##!!**##')
+        if json_path == '-':
+            esprima_ast = json.loads(produce_ast.stdout.decode('utf-8').split(JSON_SEPARATOR)[-1])
         else:
             with open(json_path) as json_data:
                 esprima_ast = json.loads(json_data.read())
             if remove_json:
                 os.remove(json_path)
 
-            extended_ast = ExtendedAst()
-            extended_ast.set_type(esprima_ast['type'])
-            extended_ast.set_body(esprima_ast['body'])
-            extended_ast.set_source_type(esprima_ast['sourceType'])
-            extended_ast.set_range(esprima_ast['range'])
-            extended_ast.set_tokens(esprima_ast['tokens'])
-            extended_ast.set_comments(esprima_ast['comments'])
-            if 'leadingComments' in esprima_ast:
-                extended_ast.set_leading_comments(esprima_ast['leadingComments'])
-
-            return extended_ast
+        extended_ast = ExtendedAst()
+        extended_ast.set_type(esprima_ast['type'])
+        extended_ast.set_body(esprima_ast['body'])
+        extended_ast.set_source_type(esprima_ast['sourceType'])
+        extended_ast.set_range(esprima_ast['range'])
+        extended_ast.set_tokens(esprima_ast['tokens'])
+        extended_ast.set_comments(esprima_ast['comments'])
+        if 'leadingComments' in esprima_ast:
+            extended_ast.set_leading_comments(esprima_ast['leadingComments'])
+
+        return extended_ast
     logging.error('Esprima could not produce an AST for %s', input_file)
     return None
 
@@ -0,0 +1,183 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Reuse of the data flow of a previous PDG of a file, once the file has been modified.
+
+    The new AST is matched with the previous PDG at top-level statement granularity (longest
+    common subsequence of their structural hashes), then the outermost functions not matched
+    yet are matched with an identical function of the previous PDG. Two matched subtrees being
+    identical, their nodes are paired in pre-order, giving a map previous id -> new id.
+    The data flow of a function body (cf. build_dfg_parallel.py) is reused if the body was
+    matched and if the variables known when entering it are the matching ones.
+"""
+
+import difflib
+import hashlib
+import logging
+
+from pdg_format import get_all_nodes
+
+
+IGNORED_ATTRIBUTES = ['range', 'loc', 'function_bodies', 'truncated']  # Not part of the code
+
+
+def get_node_hashes(node):
+    """ Structural hash of each subtree of node: node id -> hash. """
+
+    hashes = dict()
+    for child in reversed(get_all_nodes(node)):  # The children before their parent
+        sha = hashlib.sha1()
+        sha.update(repr((child.name, child.body,
+                         sorted((att, repr(value)) for att, value in child.attributes.items()
+                                if att not in IGNORED_ATTRIBUTES))).encode('utf-8'))
+        for grandchild in child.children:
+            sha.update(hashes[grandchild.id].encode('utf-8'))
+        hashes[child.id] = sha.hexdigest()
+    return hashes
+
+
+def get_outermost_functions(node):
+    """ Outermost FunctionDeclaration and FunctionExpression nodes descendant of node. """
+
+    functions, to_visit = [], [node]
+    while to_visit:
+        child = to_visit.pop()
+        if child.name in ('FunctionDeclaration', 'FunctionExpression'):
+            functions.append(child)
+        else:
+            to_visit.extend(reversed(child.children))
+    return functions
+
+
+def map_subtrees(old_node, new_node, id_map):
+    """ Pairs the nodes of two identical subtrees in id_map. """
+
+    for old_child, new_child in zip(get_all_nodes(old_node), get_all_nodes(new_node)):
+        id_map[old_child.id] = new_child.id
+
+
+def match_pdgs(previous_pdg, cfg_nodes):
+    """
+        Matches the nodes of a previous PDG with the ones of a new CFG.
+
+        -------
+        Parameters:
+        - previous_pdg: Node
+            PDG of the previous version of the file.
+        - cfg_nodes: Node
+            CFG of the new version of the file.
+
+        -------
+        Returns:
+        - dict
+            Previous node id -> new node id, for the nodes of the unchanged regions.
+    """
+
+    old_hashes = get_node_hashes(previous_pdg)
+    new_hashes = get_node_hashes(cfg_nodes)
+    id_map = {previous_pdg.id: cfg_nodes.id}
+
+    old_statements, new_statements = previous_pdg.children, cfg_nodes.children
+    matcher = difflib.SequenceMatcher(None, [old_hashes[node.id] for node in old_statements],
+                                      [new_hashes[node.id] for node in new_statements],
+                                      autojunk=False)
+    for block in matcher.get_matching_blocks():
+        for i in range(block.size):
+            map_subtrees(old_statements[block.a + i], new_statements[block.b + i], id_map)
+    logging.debug('%s/%s top-level statements unchanged', sum(block.size for block in
+                                                              matcher.get_matching_blocks()),
+                  len(new_statements))
+
+    # Functions moved or in a modified statement
+    old_functions = dict()
+    for fun in get_outermost_functions(previous_pdg):
+        if fun.id not in id_map:
+            old_functions.setdefault(old_hashes[fun.id], []).append(fun)
+    new_mapped = set(id_map.values())
+    for fun in get_outermost_functions(cfg_nodes):
+        if fun.id not in new_mapped and old_functions.get(new_hashes[fun.id]):
+            map_subtrees(old_functions[new_hashes[fun.id]].pop(0), fun, id_map)
+    return id_map
+
+
+class ReusableBodies:
+    """ Data flow of the function bodies of a previous PDG, for df_scoping_parallel. """
+
+    def __init__(self, previous_pdg, cfg_nodes):
+        self.id_map = match_pdgs(previous_pdg, cfg_nodes)
+        self.records = dict()  # New body id -> [var_loc ids, var_glob ids, results]
+        for [body_id, var_loc, var_glob, results] in previous_pdg.attributes['function_bodies']:
+            if body_id in self.id_map:
+                self.records[self.id_map[body_id]] = [var_loc, var_glob, results]
+        self.reused = set()
+
+    def get_nb_reused(self):
+        return len(self.reused)
+
+    def map_ids(self, ids):
+        """ Translates a list of previous ids, or returns None if one of them changed. """
+
+        if any(node_id not in self.id_map for node_id in ids):
+            return None
+        return [self.id_map[node_id] for node_id in ids]
+
+    def map_var_list_ids(self, var_list):
+        """ Translates the output of get_var_list_ids, or returns None. """
+
+        [var_ids, refs, fun_list, limit, before_ids, after_ids] = var_list
+        new_refs = []
+        for ref in refs:
+            if isinstance(ref, list):
+                new_refs.append(self.map_ids(ref))
+            else:
+                new_refs.append(ref if ref is None else self.id_map.get(ref))
+            if ref is not None and new_refs[-1] is None:
+                return None
+        var_ids, before_ids, after_ids = [self.map_ids(ids)
+                                          for ids in (var_ids, before_ids, after_ids)]
+        if var_ids is None or before_ids is None or after_ids is None:
+            return None
+        return [var_ids, new_refs, fun_list, limit, before_ids, after_ids]
+
+    def get_results(self, body_id, var_loc, var_glob):
+        """
+            Data flow of a function body in the previous PDG.
+
+            -------
+            Parameters:
+            - body_id: int
+                Id of the function body in the new CFG.
+            - var_loc, var_glob: list
+                Output of get_var_list_ids for the variables known when entering the body.
+
+            -------
+            Returns:
+            - list
+                Output of df_function_body, with the new ids;
+            - or None if the body or its variables changed.
+        """
+
+        if body_id not in self.records:
+            return None
+        [old_var_loc, old_var_glob, [edges, unknown_ids, glob_changed, _]] = self.records[body_id]
+        if self.map_var_list_ids(old_var_loc) != var_loc\
+                or self.map_var_list_ids(old_var_glob) != var_glob:
+            return None
+        new_edges = [self.map_ids(edge) for edge in edges]
+        new_unknown_ids = self.map_ids(unknown_ids)
+        if new_unknown_ids is None or None in new_edges:
+            return None
+        self.reused.add(body_id)
+        return [new_edges, new_unknown_ids, glob_changed, False]
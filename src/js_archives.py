@@ -0,0 +1,90 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    JS files read from .tar (possibly compressed) and .zip archives, without extracting them.
+    The other members, e.g. package.json or README.md in npm packages, are skipped. The PDG of a member is named after the path of the archive and its path in the archive, cf.
+    get_member_pdg_name.
+"""
+
+import os
+import tarfile
+import zipfile
+import logging
+from urllib.parse import quote
+
+
+TAR_EXTENSIONS = ['.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz']
+ZIP_EXTENSIONS = ['.zip']
+JS_EXTENSIONS = ['.js']  # Members to get the PDG of
+
+
+def is_js_archive(file_name):
+    """ Indicates whether file_name is a tar or zip archive, based on its extension. """
+
+    return any(file_name.lower().endswith(extension)
+               for extension in TAR_EXTENSIONS + ZIP_EXTENSIONS)
+
+
+def get_member_pdg_name(member_path, archive_path=None):
+    """ Name of the PDG of the archive member member_path, prefixed with archive_path, the path
+    of the archive in the input folder, as several archives can contain the same member path,
+    e.g. package/index.js for npm packages. '/' is escaped so that the PDGs of the members of
+    all folders can be stored in the same PDG folder. """
+
+    if archive_path is not None:
+        member_path = os.path.join(archive_path, member_path)
+    return quote(member_path.replace('.js', ''), safe='')
+
+
+def is_js_member(member_path, extensions=JS_EXTENSIONS):
+    """ Indicates whether the archive member member_path is a JS file, based on its extension,
+    e.g. not index.d.ts. """
+
+    return any(member_path.lower().endswith(extension) for extension in extensions)
+
+
+def get_archive_members(archive_path, extensions=JS_EXTENSIONS):
+    """
+        Reads the JS files of an archive one after the other, tar archives being read as a
+        stream.
+
+        -------
+        Parameters:
+        - archive_path: str
+            Path of the tar or zip archive.
+        - extensions: list
+            Extensions of the members to read. Default: JS_EXTENSIONS.
+
+        -------
+        Returns:
+        - generator
+            [member path, content (bytes), mtime] of each regular JS file of the archive.
+    """
+
+    try:
+        if any(archive_path.lower().endswith(extension) for extension in ZIP_EXTENSIONS):
+            with zipfile.ZipFile(archive_path) as zip_archive:
+                for member in zip_archive.infolist():
+                    if not member.is_dir() and is_js_member(member.filename, extensions):
+                        yield [member.filename, zip_archive.read(member),
+                               list(member.date_time)]
+        else:
+            with tarfile.open(archive_path, mode='r|*') as tar_archive:
+                for member in tar_archive:
+                    if member.isfile() and is_js_member(member.name, extensions):
+                        yield [member.name, tar_archive.extractfile(member).read(),
+                               member.mtime]
+    except (tarfile.TarError, zipfile.BadZipFile, EOFError, OSError) as error_message:
+        logging.error('Could not read the archive %s: %s', archive_path, str(error_message))
@@ -28,12 +28,12 @@ var fs = require("fs");
 /**
  * Extraction of the AST of an input JS file using Esprima.
  *
- * @param js
- * @param json_path
+ * @param js, '-' to read the JS code from stdin
+ * @param json_path, '-' to display the AST in stdout after '##!!JSON!!##'
  * @returns {*}
  */
 function js2ast(js, json_path) {
-    var text = fs.readFileSync(js).toString('utf-8');
+    var text = fs.readFileSync(js === '-' ? 0 : js).toString('utf-8');
     var ast = esprima.parse(text, {range: true, tokens: true, comment: true}, function (node) {
         console.log(node.type);
         //console.log(node.range);
@@ -47,6 +47,12 @@ function js2ast(js, json_path) {
         // Attaching comments is a separate step for Escodegen
         ast = es.attachComments(ast, ast.comments, ast.tokens);
 
+        if (json_path === '-') {
+            console.log('##!!JSON!!##');
+            console.log(JSON.stringify(ast));
+            return ast;
+        }
+
         fs.writeFile(json_path, JSON.stringify(ast), function (err) {
             if (err) {
                 console.error(err);
@@ -19,6 +19,9 @@
 import logging
 
 
+COMMENTS = ['Line', 'Block']
+
+
 class Dependence:
 
     def __init__(self, dependency_type, extremity, label, begin=None, end=None):
@@ -115,8 +118,7 @@ class Node:
         return False
 
     def is_comment(self):
-        comments = ['Line', 'Block']
-        if self.name in comments:
+        if self.name in COMMENTS:
             return True
         return False
 
@@ -0,0 +1,155 @@
+# Copyright (C) 2020 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Checkpoint journal of replace_ast_df_folder, so that a restarted run skips the pairs
+    already analyzed.
+
+    Append-only file with one JSON record per analyzed (benign, malicious) pair:
+    {'benign', 'malicious', 'status', 'time'}, status being 'done', 'rejected' (prefilter),
+    'failed' (invalid PDG) or 'quarantined' (crashed or timed out too many times, cf.
+    samples_generation.WorkerPool). Each worker appends its records line by line and fsyncs
+    them every JOURNAL_BATCH records, so that at most a batch per worker is analyzed again after
+    a reboot.
+"""
+
+import os
+import json
+import timeit
+import logging
+
+
+JOURNAL_BATCH = 20  # Records per fsync
+PROGRESS_INTERVAL = 60  # Seconds between two progress reports
+
+
+def get_journal_path(malicious_pdgs):
+    """ Path of the journal of the pairs of malicious_pdgs. """
+
+    return os.path.normpath(malicious_pdgs) + '-journal.jsonl'
+
+
+def load_journal(journal_path):
+    """
+        Pairs recorded in a journal, the last record of a pair prevailing.
+
+        -------
+        Parameter:
+        - journal_path: str
+            Path of the journal.
+
+        -------
+        Returns:
+        - dict
+            [benign PDG path, malicious PDG path] as a tuple -> record.
+    """
+
+    pairs = dict()
+    if not os.path.isfile(journal_path):
+        return pairs
+    with open(journal_path, 'rb+') as journal:
+        lines = journal.read().split(b'\n')
+        if lines[-1]:  # Last line interrupted: ended so that the next records are readable
+            journal.write(b'\n')
+    for line in lines:
+        try:
+            record = json.loads(line.decode('utf-8'))
+        except ValueError:
+            continue
+        pairs[(record['benign'], record['malicious'])] = record
+    return pairs
+
+
+class PairJournal:
+    """ Appends the records of the pairs analyzed by a worker to the journal. """
+
+    def __init__(self, journal_path, batch=JOURNAL_BATCH):
+        self.journal_path = journal_path
+        self.batch = batch
+        self.journal = None
+        self.nb_unsynced = 0
+
+    def add_pair(self, benign, malicious, status, elapsed_time):
+        if self.journal is None:
+            self.journal = open(self.journal_path, 'a')
+        # One write per line, the journal being shared by the workers
+        self.journal.write(json.dumps({'benign': benign, 'malicious': malicious,
+                                       'status': status, 'time': elapsed_time}) + '\n')
+        self.journal.flush()
+        self.nb_unsynced += 1
+        if self.nb_unsynced >= self.batch:
+            self.sync()
+
+    def sync(self):
+        if self.journal is not None and self.nb_unsynced > 0:
+            os.fsync(self.journal.fileno())
+            self.nb_unsynced = 0
+
+    def close(self):
+        if self.journal is not None:
+            self.sync()
+            self.journal.close()
+            self.journal = None
+
+
+class JournalProgress:
+    """ Progress and ETA of a run, from the records appended to the journal since its start. """
+
+    def __init__(self, journal_path, nb_pairs):
+        self.journal_path = journal_path
+        self.nb_pairs = nb_pairs  # Pairs to analyze during this run
+        self.offset = os.path.getsize(journal_path) if os.path.isfile(journal_path) else 0
+        self.statuses = dict()  # Status -> number of pairs analyzed during this run
+        self.start = timeit.default_timer()
+        self.last_report = self.start
+
+    def update(self):
+        if not os.path.isfile(self.journal_path):
+            return
+        with open(self.journal_path, 'rb') as journal:
+            journal.seek(self.offset)
+            data = journal.read()
+        data = data[:data.rfind(b'\n') + 1]  # Only the complete lines
+        self.offset += len(data)
+        for line in data.split(b'\n'):
+            try:
+                status = json.loads(line.decode('utf-8'))['status']
+            except (ValueError, KeyError):
+                continue
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def get_nb_analyzed(self):
+        return sum(self.statuses.values())
+
+    def get_eta(self):
+        """ Seconds left at the rate observed so far, or None if nothing was analyzed yet. """
+
+        nb_analyzed = self.get_nb_analyzed()
+        if nb_analyzed == 0:
+            return None
+        elapsed_time = timeit.default_timer() - self.start
+        return max(self.nb_pairs - nb_analyzed, 0) * elapsed_time / nb_analyzed
+
+    def report_if_due(self):
+        if timeit.default_timer() - self.last_report >= PROGRESS_INTERVAL:
+            self.report()
+
+    def report(self):
+        self.last_report = timeit.default_timer()
+        self.update()
+        eta = self.get_eta()
+        logging.info('%s/%s pairs analyzed (%s), ETA: %s', self.get_nb_analyzed(), self.nb_pairs,
+                     ', '.join(str(nb) + ' ' + status
+                               for status, nb in sorted(self.statuses.items())) or 'none',
+                     'unknown' if eta is None else str(int(eta)) + 's')
@@ -0,0 +1,198 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Archive of PDGs: many PDGs in the flat binary format packed into large shard files, instead
+    of one file per PDG.
+
+    An archive is a folder containing <prefix>-<n>.shard files and one index-<prefix>.json file
+    per writer (PDG name -> [shard, offset, size]), so that several processes can write to the
+    same archive. Readers mmap the shards and only deserialize the PDG asked for.
+    A PDG of an archive is designated by the path <archive folder>/<PDG name>, as if the archive
+    was a folder of PDG files.
+"""
+
+import os
+import json
+import mmap
+import pickle
+import logging
+
+from pdg_format import dump_flat_pdg, compress_flat_pdg, parse_flat_pdg, is_flat_pdg, LazyPdg
+
+
+SHARD_SIZE = 256 * 1024 * 1024  # Bytes per shard, before starting a new one
+INDEX_PREFIX = 'index-'
+ARCHIVES = dict()  # Archive folder -> PdgArchive opened by this process
+
+
+class PdgArchiveWriter:
+    """ Appends PDGs to the shards of an archive. """
+
+    def __init__(self, archive_folder, prefix, shard_size=SHARD_SIZE, codec=None):
+        os.makedirs(archive_folder, exist_ok=True)
+        self.archive_folder = archive_folder
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.codec = codec  # Compression of each PDG, cf. pdg_format.CODECS
+        self.index = dict()
+        self.nb_shards = 0
+        self.shard = None
+        self.shard_name = None
+        self.offset = 0
+
+    def new_shard(self):
+        if self.shard is not None:
+            self.shard.close()
+        self.shard_name = self.prefix + '-' + str(self.nb_shards) + '.shard'
+        self.shard = open(os.path.join(self.archive_folder, self.shard_name), 'wb')
+        self.nb_shards += 1
+        self.offset = 0
+
+    def add_data(self, pdg_name, data):
+        if self.shard is None or (self.offset > 0 and self.offset + len(data) > self.shard_size):
+            self.new_shard()
+        self.shard.write(data)
+        self.index[pdg_name] = [self.shard_name, self.offset, len(data)]
+        self.offset += len(data)
+
+    def add_pdg(self, pdg_name, pdg):
+        self.add_data(pdg_name, compress_flat_pdg(dump_flat_pdg(pdg), self.codec))
+
+    def close(self):
+        if self.shard is not None:
+            self.shard.close()
+            self.shard = None
+        with open(os.path.join(self.archive_folder, INDEX_PREFIX + self.prefix + '.json'),
+                  'w') as json_file:
+            json.dump(self.index, json_file)
+
+
+class PdgArchive:
+    """ Random access to the PDGs of an archive. """
+
+    def __init__(self, archive_folder):
+        self.archive_folder = archive_folder
+        self.index = dict()
+        for index_file in sorted(os.listdir(archive_folder)):
+            if index_file.startswith(INDEX_PREFIX) and index_file.endswith('.json'):
+                with open(os.path.join(archive_folder, index_file)) as json_file:
+                    self.index.update(json.load(json_file))
+        self.shards = dict()  # Shard name -> mmap
+
+    def get_names(self):
+        return list(self.index)
+
+    def get_shard(self, shard_name):
+        if shard_name not in self.shards:
+            with open(os.path.join(self.archive_folder, shard_name), 'rb') as shard:
+                self.shards[shard_name] = mmap.mmap(shard.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.shards[shard_name]
+
+    def get_pdg(self, pdg_name):
+        if pdg_name not in self.index:
+            logging.error('No PDG %s in the archive %s', pdg_name, self.archive_folder)
+            return None
+        [shard_name, offset, size] = self.index[pdg_name]
+        with memoryview(self.get_shard(shard_name)) as shard:
+            with shard[offset:offset + size] as data:
+                return parse_flat_pdg(data, os.path.join(self.archive_folder, pdg_name))
+
+    def get_lazy_pdg(self, pdg_name):
+        if pdg_name not in self.index:
+            logging.error('No PDG %s in the archive %s', pdg_name, self.archive_folder)
+            return None
+        [shard_name, offset, size] = self.index[pdg_name]
+        return LazyPdg(self.get_shard(shard_name)[offset:offset + size],
+                       os.path.join(self.archive_folder, pdg_name))
+
+    def close(self):
+        for shard in self.shards.values():
+            shard.close()
+        self.shards = dict()
+
+
+def is_pdg_archive(folder):
+    """ Indicates whether folder is a PDG archive. """
+
+    return os.path.isdir(folder) and any(file_name.startswith(INDEX_PREFIX)
+                                         for file_name in os.listdir(folder))
+
+
+def get_archive(archive_folder):
+    """ PdgArchive of archive_folder, opened once per process. """
+
+    if archive_folder not in ARCHIVES:
+        ARCHIVES[archive_folder] = PdgArchive(archive_folder)
+    return ARCHIVES[archive_folder]
+
+
+def close_archive(archive_folder):
+    """ Closes the PdgArchive of archive_folder, e.g. once modified, so that it is reopened. """
+
+    archive = ARCHIVES.pop(archive_folder, None)
+    if archive is not None:
+        archive.close()
+
+
+def load_archived_pdg(pdg_path):
+    """ Loads the PDG <archive folder>/<PDG name>. """
+
+    return get_archive(os.path.dirname(pdg_path)).get_pdg(os.path.basename(pdg_path))
+
+
+def load_archived_lazy_pdg(pdg_path):
+    """ LazyPdg of the PDG <archive folder>/<PDG name>. """
+
+    return get_archive(os.path.dirname(pdg_path)).get_lazy_pdg(os.path.basename(pdg_path))
+
+
+def list_pdgs(pdg_folder):
+    """ Names of the PDGs of a folder of PDG files or of an archive. """
+
+    if is_pdg_archive(pdg_folder):
+        return get_archive(pdg_folder).get_names()
+    return os.listdir(pdg_folder)
+
+
+def pack_pdg_folder(pdg_folder, archive_folder, shard_size=SHARD_SIZE, codec=None):
+    """
+        Packs a folder of PDG files (flat binary format or pickled) into an archive.
+
+        -------
+        Parameters:
+        - pdg_folder: str
+            Path of the folder containing the PDGs.
+        - archive_folder: str
+            Path of the archive to create.
+        - shard_size: int
+            Bytes per shard. Default: SHARD_SIZE.
+        - codec: str
+            Compression of the pickled PDGs, cf. pdg_format.CODECS. The PDGs already in the
+            flat binary format are copied as they are. Default: None.
+    """
+
+    writer = PdgArchiveWriter(archive_folder, 'pack', shard_size, codec)
+    for pdg_name in sorted(os.listdir(pdg_folder)):
+        pdg_path = os.path.join(pdg_folder, pdg_name)
+        if not os.path.isfile(pdg_path):
+            continue
+        if is_flat_pdg(pdg_path):
+            with open(pdg_path, 'rb') as pdg_file:
+                writer.add_data(pdg_name, pdg_file.read())
+        else:
+            with open(pdg_path, 'rb') as pdg_file:
+                writer.add_pdg(pdg_name, pickle.load(pdg_file))
+    writer.close()
+    logging.info('Packed %s PDGs into %s shards', len(writer.index), writer.nb_shards)
@@ -0,0 +1,218 @@
+# Copyright (C) 2020 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Benign PDG corpus kept resident in memory, against which workers search for clones of
+    malicious PDGs, e.g., for interactive hunting:
+        corpus = PdgCorpus('FOLDER_BENIGN_PDGS')
+        hunt(corpus, 'FOLDER_MALICIOUS_PDGS')  # As many times as needed
+
+    The corpus is loaded once, then gc.freeze()-ed before the workers are forked: the garbage
+    collector of the workers ignores its objects, so that collecting does not write to, and
+    therefore copy, its pages. The pages of the nodes the clone detection goes through are still
+    copied (reference counts, Node.clone). The parent unfreezes the corpus once the workers are
+    forked. The part of the corpus each worker still shares with the parent, i.e. saved compared
+    to loading its own copy, is reported at the end of a hunt: the size of the corpus minus the
+    private memory the worker gained since the fork (pages copied, malicious PDGs loaded).
+    Requires the fork start method (Linux).
+"""
+
+import gc
+import os
+import queue
+import timeit
+import logging
+import multiprocessing
+
+from utility_df import NUM_WORKERS, CLONE_LIMITS
+from pdg_format import get_all_nodes
+from pdg_archive import list_pdgs
+from pdg_sidecar import load_sidecar
+from samples_generation import load_pdg, put_task, replace_ast_df
+
+
+def get_memory_usage():
+    """ [resident, shared, private] memory of this process in kB, from /proc/self/smaps_rollup,
+    or None if it is not available. """
+
+    fields = dict()
+    try:
+        with open('/proc/self/smaps_rollup') as smaps:
+            for line in smaps:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == 'kB':
+                    fields[parts[0].rstrip(':')] = int(parts[1])
+    except OSError:
+        return None
+    return [fields.get('Rss', 0), fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0),
+            fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)]
+
+
+class CorpusEntry:
+    """ PDG of the corpus, with its sidecar and the Node.clone values it was loaded with. """
+
+    def __init__(self, pdg_path, pdg):
+        self.pdg_path = pdg_path
+        self.pdg = pdg
+        self.sidecar = load_sidecar(pdg_path)
+        self.nodes = get_all_nodes(pdg)
+        self.clones = [node.clone for node in self.nodes]
+
+    def restore(self):
+        """ Resets the Node.clone values marked by the clone detection. Only the nodes which
+        changed are written, not to copy more pages than needed. """
+
+        for node, clone in zip(self.nodes, self.clones):
+            if node.clone != clone:
+                node.clone = clone
+
+
+class PdgCorpus:
+    """ Read-only benign PDGs of a folder or archive, shared with the workers of hunt. """
+
+    def __init__(self, benign_pdgs):
+        start = timeit.default_timer()
+        memory = get_memory_usage()
+        self.entries = list()
+        for pdg_name in list_pdgs(benign_pdgs):
+            pdg_path = os.path.join(benign_pdgs, pdg_name)
+            try:
+                pdg = load_pdg(pdg_path)
+            except Exception:
+                logging.exception('Could not load %s', pdg_path)
+                continue
+            if pdg is not None:
+                self.entries.append(CorpusEntry(pdg_path, pdg))
+        gc.collect()
+        self.size = None if memory is None else get_memory_usage()[0] - memory[0]  # kB
+        logging.info('Loaded %s benign PDGs (%s) in %ss', len(self.entries),
+                     'unknown size' if self.size is None else str(self.size // 1024) + ' MB',
+                     round(timeit.default_timer() - start, 2))
+
+    @staticmethod
+    def freeze():
+        """ Moves the corpus, and every object allocated so far, out of reach of the garbage
+        collector, before forking. """
+
+        gc.collect()
+        gc.freeze()
+
+    @staticmethod
+    def unfreeze():
+        """ Gives the objects frozen back to the garbage collector of this process, once the
+        workers are forked: they stay frozen in the workers. """
+
+        gc.unfreeze()
+
+
+def worker(corpus, my_queue, results, limits):
+    """ Worker, until it gets None. Searches for clones of each malicious PDG in the corpus. """
+
+    memory = get_memory_usage()  # Right after the fork
+    while True:
+        item = my_queue.get()
+        if item is None:
+            break
+        [malicious_pdg_path, json_analysis] = item
+        try:
+            malicious = CorpusEntry(malicious_pdg_path, load_pdg(malicious_pdg_path))
+        except Exception:
+            logging.exception('Could not load %s', malicious_pdg_path)
+            continue
+        for entry in corpus.entries:
+            res_dict = {'malicious': malicious_pdg_path, 'benign': entry.pdg_path}
+            try:
+                if replace_ast_df(entry.pdg, malicious.pdg, res_dict, json_analysis, limits,
+                                  [entry.sidecar, malicious.sidecar]) is not None:
+                    results.put(['clone', entry.pdg_path, malicious_pdg_path])
+            except Exception:
+                logging.exception('Could not analyze %s and %s', malicious_pdg_path,
+                                  entry.pdg_path)
+            finally:
+                entry.restore()
+                malicious.restore()
+    results.put(['memory', os.getpid(), None if memory is None
+                 else get_memory_usage()[2] - memory[2]])
+
+
+def hunt(corpus, malicious_pdgs, workers=NUM_WORKERS, limits=CLONE_LIMITS):
+    """
+        Searches for clones of the malicious PDGs in the corpus, with workers processes forked
+        from this one. As in samples_generation.replace_ast_df_folder, the findings of each pair
+        are stored in the folder PDG_NAME-analysis next to malicious_pdgs.
+
+        -------
+        Parameters:
+        - corpus: PdgCorpus
+            Benign PDGs, frozen while the workers are forked.
+        - malicious_pdgs: str
+            Path of the folder or archive containing the malicious PDGs.
+        - workers: int
+            Number of processes. Default: NUM_WORKERS.
+        - limits: list
+            [seconds, steps] allowed to detect clones, cf. detect_clones. Default: CLONE_LIMITS.
+
+        -------
+        Returns:
+        - list
+            [benign PDG path, malicious PDG path] of the pairs where the whole malicious PDG was
+            found in the benign one.
+    """
+
+    start = timeit.default_timer()
+    context = multiprocessing.get_context('fork')  # The workers must inherit the corpus
+    my_queue = context.Queue(maxsize=2 * workers)
+    results = context.Queue()
+    processes = list()
+    corpus.freeze()
+    try:
+        for _ in range(workers):
+            p = context.Process(target=worker, args=(corpus, my_queue, results, limits))
+            p.start()
+            processes.append(p)
+    finally:
+        corpus.unfreeze()
+
+    for malicious_pdg in list_pdgs(malicious_pdgs):
+        json_analysis = os.path.join(os.path.dirname(malicious_pdgs), malicious_pdg + '-analysis')
+        if not put_task(my_queue, [os.path.join(malicious_pdgs, malicious_pdg), json_analysis],
+                        processes):
+            break
+    for _ in processes:
+        if not put_task(my_queue, None, processes):
+            break
+
+    clones, nb_reports = list(), 0
+    while nb_reports < len(processes):  # Read before joining, not to block the workers
+        try:
+            result = results.get(timeout=1)
+        except queue.Empty:
+            if not any(p.is_alive() for p in processes):
+                break
+            continue
+        if result[0] == 'clone':
+            clones.append(result[1:])
+        else:
+            nb_reports += 1
+            [pid, private_growth] = result[1:]
+            if private_growth is not None and corpus.size is not None:
+                logging.info('Worker %s: %s MB of the corpus still shared with the parent (saved), '
+                             '%s MB private memory gained', pid,
+                             max(corpus.size - private_growth, 0) // 1024, private_growth // 1024)
+    for p in processes:
+        p.join()
+
+    logging.info('Found %s whole malicious PDGs in the corpus in %ss', len(clones),
+                 round(timeit.default_timer() - start, 2))
+    return clones
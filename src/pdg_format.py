@@ -0,0 +1,462 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Flat binary format of the PDGs, written and read iteratively (no recursion, contrary to
+    pickle on the cyclic Node/Dependence graph).
+
+    Layout (little-endian):
+    - header: magic, version, number of strings, of nodes and of edges per table;
+    - string table: length (uint32) + UTF-8 bytes. Node names are stored as is, the other
+    values (body, body_list, attributes, labels) in JSON;
+    - node table, in pre-order: id, name, body, body_list, clone, parent position, attributes;
+    - edge tables, one per Node list in DEP_LISTS: node position, type, extremity position,
+    label, id_begin position, id_end position (-1 for None). Both directions are stored, so
+    that the order of each list is kept.
+
+    A compressed PDG starts with COMPRESSED_HEADER (magic, codec, uncompressed size), followed
+    by the PDG in the above format compressed with the codec.
+"""
+
+import bz2
+import json
+import lzma
+import os
+import pickle
+import random
+import struct
+import tempfile
+import timeit
+import logging
+import zlib
+
+from node import Node, Dependence, COMMENTS
+
+
+MAGIC = b'JSPDG'
+VERSION = 1
+DEP_LISTS = ['data_dep_children', 'data_dep_parents', 'control_dep_children',
+             'control_dep_parents', 'comment_dep_children', 'comment_dep_parents',
+             'statement_dep_children', 'statement_dep_parents']
+
+HEADER = struct.Struct('<5sHII' + 'I' * len(DEP_LISTS))
+STRING_LEN = struct.Struct('<I')
+NODE = struct.Struct('<qIIIBiI')
+EDGE = struct.Struct('<iIiIii')
+
+COMPRESSED_MAGIC = b'JSPDZ'
+COMPRESSED_HEADER = struct.Struct('<5sBQ')
+CODECS = {'zlib': [1, zlib.compress, zlib.decompress],  # Codec -> [id, compress, decompress]
+          'lzma': [2, lzma.compress, lzma.decompress],
+          'bz2': [3, bz2.compress, bz2.decompress]}
+
+
+def get_all_nodes(pdg):
+    """ Nodes of pdg, in pre-order. """
+
+    all_nodes, to_visit = [], [pdg]
+    while to_visit:
+        node = to_visit.pop()
+        all_nodes.append(node)
+        to_visit.extend(reversed(node.children))
+    return all_nodes
+
+
+def dump_flat_pdg(pdg):
+    """
+        Serializes a PDG in the flat binary format.
+
+        -------
+        Parameter:
+        - pdg: Node
+            PDG to serialize.
+
+        -------
+        Returns:
+        - bytes
+    """
+
+    strings, string_dict = [], dict()
+
+    def get_string(value):
+        if value not in string_dict:
+            string_dict[value] = len(strings)
+            strings.append(value)
+        return string_dict[value]
+
+    json_dict = dict()  # (type, value) -> string index, for the hashable values (not True == 1)
+
+    def get_json_string(value):
+        key = (type(value), value)
+        if key not in json_dict:
+            json_dict[key] = get_string(json.dumps(value))
+        return json_dict[key]
+
+    all_nodes = get_all_nodes(pdg)
+    positions = {id(node): i for i, node in enumerate(all_nodes)}
+
+    def get_position(node):
+        if node is None:
+            return -1
+        if id(node) not in positions:
+            raise ValueError('The node ' + str(node.id) + ' is not part of the PDG')
+        return positions[id(node)]
+
+    nodes = bytearray()
+    for node in all_nodes:
+        nodes += NODE.pack(node.id, get_string(node.name), get_json_string(node.body),
+                           get_json_string(node.body_list), node.clone,
+                           get_position(node.parent) if node is not pdg else -1,
+                           get_string(json.dumps(node.attributes)))
+
+    edge_tables, nb_edges = [], []
+    for dep_list in DEP_LISTS:
+        edges = bytearray()
+        nb_edges.append(0)
+        for i, node in enumerate(all_nodes):
+            for dep in getattr(node, dep_list):
+                edges += EDGE.pack(i, get_string(dep.type), get_position(dep.extremity),
+                                   get_json_string(dep.label), get_position(dep.id_begin),
+                                   get_position(dep.id_end))
+                nb_edges[-1] += 1
+        edge_tables.append(edges)
+
+    data = bytearray(HEADER.pack(MAGIC, VERSION, len(strings), len(all_nodes), *nb_edges))
+    for string in strings:
+        encoded = string.encode('utf-8', 'surrogatepass')
+        data += STRING_LEN.pack(len(encoded))
+        data += encoded
+    data += nodes
+    for edges in edge_tables:
+        data += edges
+    return bytes(data)
+
+
+def compress_flat_pdg(data, codec):
+    """ Compresses the output of dump_flat_pdg with codec (cf. CODECS), None for no
+    compression. """
+
+    if codec is None:
+        return data
+    [codec_id, compress, _] = CODECS[codec]
+    return COMPRESSED_HEADER.pack(COMPRESSED_MAGIC, codec_id, len(data)) + compress(data)
+
+
+def decompress_flat_pdg(data):
+    """ Output of dump_flat_pdg, from a PDG possibly compressed with compress_flat_pdg. """
+
+    if bytes(data[:len(COMPRESSED_MAGIC)]) != COMPRESSED_MAGIC:
+        return data
+    [_, codec_id, size] = COMPRESSED_HEADER.unpack_from(data)
+    for codec, [other_id, _, decompress] in CODECS.items():
+        if other_id == codec_id:
+            data = decompress(data[COMPRESSED_HEADER.size:])
+            if len(data) != size:
+                raise ValueError('Corrupted PDG, ' + codec + ' gave ' + str(len(data))
+                                 + ' bytes instead of ' + str(size))
+            return data
+    raise ValueError('Unsupported PDG codec ' + str(codec_id))
+
+
+def store_flat_pdg(pdg, pdg_path, codec=None):
+    """ Stores a PDG in the flat binary format in pdg_path, compressed with codec (cf.
+    CODECS), or not if None. """
+
+    data = compress_flat_pdg(dump_flat_pdg(pdg), codec)
+    with open(pdg_path, 'wb') as pdg_file:
+        pdg_file.write(data)
+
+
+def is_flat_pdg(pdg_path):
+    """ Indicates whether pdg_path is stored in the flat binary format, compressed or not. """
+
+    with open(pdg_path, 'rb') as pdg_file:
+        return pdg_file.read(len(MAGIC)) in (MAGIC, COMPRESSED_MAGIC)
+
+
+def load_flat_pdg(pdg_path):
+    """ Loads a PDG stored with store_flat_pdg in pdg_path. """
+
+    with open(pdg_path, 'rb') as pdg_file:
+        return parse_flat_pdg(pdg_file.read(), pdg_path)
+
+
+def parse_flat_pdg(data, pdg_name):
+    """
+        Deserializes a PDG in the flat binary format.
+
+        -------
+        Parameters:
+        - data: bytes or memoryview
+            Output of dump_flat_pdg or compress_flat_pdg, e.g. a slice of a memory-mapped file.
+        - pdg_name: str
+            Name of the PDG, for the error messages.
+
+        -------
+        Returns:
+        - Node
+            The PDG.
+    """
+
+    data = decompress_flat_pdg(data)
+    header = HEADER.unpack_from(data)
+    if header[0] != MAGIC or header[1] != VERSION:
+        raise ValueError('Unsupported PDG format ' + str(header[:2]) + ' for ' + pdg_name)
+    nb_strings, nb_nodes, nb_edges = header[2], header[3], header[4:]
+
+    offset = HEADER.size
+    strings = []
+    for _ in range(nb_strings):
+        length = STRING_LEN.unpack_from(data, offset)[0]
+        offset += STRING_LEN.size
+        strings.append(str(data[offset:offset + length], 'utf-8', 'surrogatepass'))
+        offset += length
+    json_values = dict()  # Each JSON string decoded once, they are shared by many nodes
+
+    def get_json(index):
+        if index not in json_values:
+            json_values[index] = json.loads(strings[index])
+        return json_values[index]
+
+    all_nodes = []
+    for [node_id, name, body, body_list, clone, parent, attributes]\
+            in NODE.iter_unpack(data[offset:offset + nb_nodes * NODE.size]):
+        node = Node(strings[name])
+        node.id = node_id
+        node.body = get_json(body)
+        node.body_list = get_json(body_list)
+        node.clone = bool(clone)
+        node.attributes = json.loads(strings[attributes])  # Not shared, may be modified
+        if parent >= 0:
+            node.parent = all_nodes[parent]
+            node.parent.children.append(node)  # Pre-order: same order as the children
+        all_nodes.append(node)
+    offset += nb_nodes * NODE.size
+
+    def get_node(position):
+        return None if position < 0 else all_nodes[position]
+
+    for dep_list, nb_dep in zip(DEP_LISTS, nb_edges):
+        for [position, dep_type, extremity, label, begin, end]\
+                in EDGE.iter_unpack(data[offset:offset + nb_dep * EDGE.size]):
+            getattr(all_nodes[position], dep_list).append(
+                Dependence(strings[dep_type], all_nodes[extremity], get_json(label),
+                           get_node(begin), get_node(end)))
+        offset += nb_dep * EDGE.size
+    return all_nodes[0] if all_nodes else None
+
+
+class LazyPdg:
+    """ PDG deserialized in two levels: the kinds of its nodes (node table only), then the whole
+    PDG, with its attributes and dependencies, only if needed. """
+
+    def __init__(self, data, pdg_name, pdg=None):
+        self.data = data  # Output of compress_flat_pdg, None if pdg is already given
+        self.pdg_name = pdg_name
+        self.pdg = pdg
+        self.node_kinds = None
+
+    def get_node_kinds(self):
+        """ Names of the nodes of the PDG, without the comments. """
+
+        if self.node_kinds is not None:
+            return self.node_kinds
+        if self.pdg is not None:
+            names = [node.name for node in get_all_nodes(self.pdg)]
+        else:
+            self.data = decompress_flat_pdg(self.data)
+            header = HEADER.unpack_from(self.data)
+            if header[0] != MAGIC or header[1] != VERSION:
+                raise ValueError('Unsupported PDG format ' + str(header[:2]) + ' for '
+                                 + self.pdg_name)
+            offset = HEADER.size
+            string_offsets = []
+            for _ in range(header[2]):  # Only the names are decoded
+                length = STRING_LEN.unpack_from(self.data, offset)[0]
+                string_offsets.append([offset + STRING_LEN.size, length])
+                offset += STRING_LEN.size + length
+            name_ids = set(row[1] for row in NODE.iter_unpack(
+                self.data[offset:offset + header[3] * NODE.size]))
+            names = [str(self.data[string_offsets[name_id][0]:
+                                   string_offsets[name_id][0] + string_offsets[name_id][1]],
+                         'utf-8', 'surrogatepass') for name_id in name_ids]
+        self.node_kinds = set(names) - set(COMMENTS)
+        return self.node_kinds
+
+    def get_pdg(self):
+        if self.pdg is None:
+            self.pdg = parse_flat_pdg(self.data, self.pdg_name)
+            self.data = None
+        return self.pdg
+
+
+def same_pdg(pdg1, pdg2):
+    """ Indicates whether two PDGs have the same nodes, attributes and dependencies. """
+
+    all_nodes1, all_nodes2 = get_all_nodes(pdg1), get_all_nodes(pdg2)
+    if len(all_nodes1) != len(all_nodes2):
+        return False
+    for node1, node2 in zip(all_nodes1, all_nodes2):
+        if [node1.id, node1.name, node1.body, node1.body_list, node1.clone, node1.attributes,
+                len(node1.children)] != [node2.id, node2.name, node2.body, node2.body_list,
+                                         node2.clone, node2.attributes, len(node2.children)]:
+            return False
+        for dep_list in DEP_LISTS:
+            deps1, deps2 = getattr(node1, dep_list), getattr(node2, dep_list)
+            if [[dep.type, dep.extremity.id, dep.label,
+                 None if dep.id_begin is None else dep.id_begin.id,
+                 None if dep.id_end is None else dep.id_end.id] for dep in deps1]\
+                    != [[dep.type, dep.extremity.id, dep.label,
+                         None if dep.id_begin is None else dep.id_begin.id,
+                         None if dep.id_end is None else dep.id_end.id] for dep in deps2]:
+                return False
+    return True
+
+
+def benchmark_pdg_formats(pdg_folder, tmp_folder):
+    """
+        Compares the flat binary format to pickle on pickled PDGs, and checks the round trip.
+
+        -------
+        Parameters:
+        - pdg_folder: str
+            Path of the folder containing pickled PDGs.
+        - tmp_folder: str
+            Path of a folder to write the PDGs in.
+
+        -------
+        Returns:
+        - dict
+            Total seconds and bytes per format, number of PDGs and of round-trip failures.
+    """
+
+    results = {'pickle store': 0, 'pickle load': 0, 'pickle size': 0, 'flat store': 0,
+               'flat load': 0, 'flat size': 0, 'PDGs': 0, 'round-trip failures': 0}
+    tmp_pickle, tmp_flat = os.path.join(tmp_folder, 'pdg.pickle'), os.path.join(tmp_folder,
+                                                                               'pdg.flat')
+    for pdg_name in sorted(os.listdir(pdg_folder)):
+        with open(os.path.join(pdg_folder, pdg_name), 'rb') as pdg_file:
+            pdg = pickle.load(pdg_file)
+
+        start = timeit.default_timer()
+        with open(tmp_pickle, 'wb') as pdg_file:
+            pickle.dump(pdg, pdg_file)
+        results['pickle store'] += timeit.default_timer() - start
+        start = timeit.default_timer()
+        with open(tmp_pickle, 'rb') as pdg_file:
+            pickle.load(pdg_file)
+        results['pickle load'] += timeit.default_timer() - start
+        results['pickle size'] += os.path.getsize(tmp_pickle)
+
+        start = timeit.default_timer()
+        store_flat_pdg(pdg, tmp_flat)
+        results['flat store'] += timeit.default_timer() - start
+        start = timeit.default_timer()
+        flat_pdg = load_flat_pdg(tmp_flat)
+        results['flat load'] += timeit.default_timer() - start
+        results['flat size'] += os.path.getsize(tmp_flat)
+
+        results['PDGs'] += 1
+        if not same_pdg(pdg, flat_pdg):
+            logging.error('The PDG %s changed after a round trip', pdg_name)
+            results['round-trip failures'] += 1
+
+    for tmp_file in (tmp_pickle, tmp_flat):
+        if os.path.isfile(tmp_file):
+            os.remove(tmp_file)
+    logging.info('PDG formats on %s PDGs: %s', results['PDGs'], results)
+    return results
+
+
+def get_synthetic_pdg(nb_statements, seed):
+    """ PDG-like graph of nb_statements declarations, calls and conditions on random variables,
+    with their statement, control and data dependencies, to benchmark the storage. """
+
+    rand = random.Random(seed)
+    pdg = Node('Program')
+    declared = []  # [Identifier, statement] of the variables declared so far
+    for i in range(nb_statements):
+        kind = rand.choice(['VariableDeclaration', 'ExpressionStatement', 'IfStatement'])
+        statement = Node(kind, parent=pdg)
+        statement.set_attribute('range', [i * 40, i * 40 + 39])
+        pdg.children.append(statement)
+        pdg.set_statement_dependency(extremity=statement)
+        pdg.set_control_dependency(extremity=statement, label='e')
+        expression = Node('BinaryExpression' if kind == 'IfStatement' else 'CallExpression',
+                          parent=statement)
+        expression.set_attribute('operator', rand.choice(['+', '===', '<']))
+        statement.children.append(expression)
+        for _ in range(rand.randint(1, 4)):
+            if declared and rand.random() < 0.7:
+                [definition, def_statement] = rand.choice(declared)
+                leaf = Node('Identifier', parent=expression)
+                leaf.set_attribute('name', definition.attributes['name'])
+                def_statement.set_data_dependency(extremity=statement, begin=definition,
+                                                  end=leaf)
+            else:
+                leaf = Node('Literal', parent=expression)
+                leaf.set_attribute('value', rand.randint(0, 1000))
+                leaf.set_attribute('raw', str(leaf.attributes['value']))
+            leaf.set_attribute('range', [i * 40 + 1, i * 40 + 2])
+            expression.children.append(leaf)
+        if kind == 'VariableDeclaration':
+            identifier = Node('Identifier', parent=statement)
+            identifier.set_attribute('name', 'v' + str(rand.randint(0, nb_statements // 4)))
+            statement.children.insert(0, identifier)
+            declared.append([identifier, statement])
+    return pdg
+
+
+def benchmark_codecs(pdgs=None, nb_pdgs=50, nb_statements=500):
+    """
+        Size ratio and store/load throughput of each codec of CODECS (and None, no compression).
+
+        -------
+        Parameters:
+        - pdgs: list of Node
+            Corpus of PDGs. Default: None, i.e. nb_pdgs synthetic PDGs of nb_statements
+            statements (cf. get_synthetic_pdg).
+        - nb_pdgs, nb_statements: int
+            Size of the synthetic corpus. Default: 50 and 500.
+
+        -------
+        Returns:
+        - dict
+            Codec -> {'ratio': compressed / uncompressed size, 'store MB/s', 'load MB/s'}, the
+            throughputs being in uncompressed MB.
+    """
+
+    if pdgs is None:
+        pdgs = [get_synthetic_pdg(nb_statements, seed) for seed in range(nb_pdgs)]
+    results = dict()
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        for codec in [None] + list(CODECS):
+            raw_size, size, store_time, load_time = 0, 0, 0, 0
+            for i, pdg in enumerate(pdgs):
+                pdg_path = os.path.join(tmp_folder, str(i))
+                start = timeit.default_timer()
+                store_flat_pdg(pdg, pdg_path, codec)
+                store_time += timeit.default_timer() - start
+                start = timeit.default_timer()
+                load_flat_pdg(pdg_path)
+                load_time += timeit.default_timer() - start
+                raw_size += len(dump_flat_pdg(pdg))
+                size += os.path.getsize(pdg_path)
+            results[str(codec)] = {'ratio': size / raw_size,
+                                   'store MB/s': raw_size / store_time / 1e6,
+                                   'load MB/s': raw_size / load_time / 1e6}
+            logging.info('Codec %s: size ratio %.3f, store %.1f MB/s, load %.1f MB/s', codec,
+                         results[str(codec)]['ratio'], results[str(codec)]['store MB/s'],
+                         results[str(codec)]['load MB/s'])
+    return results
@@ -0,0 +1,186 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Manifest of a PDG folder, so that store_pdg_folder only processes the new or changed inputs.
+
+    The manifest of <store_pdgs> is <store_pdgs>-manifest.json, with one entry per input file
+    (path relative to the input folder, followed by the member path for the members of an
+    archive): {'sha1', 'size', 'mtime', 'version', 'status', 'pdg'}, status being 'stored' or
+    'failed' and pdg the name of the PDG. An input is up to date if its entry has the current
+    version and the same SHA-1 (only computed again if the size or mtime changed), and, if its
+    PDG was stored, if it is still there. An input which failed is therefore only processed
+    again if it changed, or on demand (retry_failed). The version changes with the format of the
+    PDGs and with the code producing them, cf. get_tool_version.
+"""
+
+import os
+import json
+import hashlib
+import logging
+
+from utility_df import PDG_CODEC
+from pdg_format import VERSION
+from pdg_archive import INDEX_PREFIX
+
+SRC_PATH = os.path.dirname(os.path.abspath(__file__))
+# Code the PDGs and their def-use indexes and sidecars depend on
+GENERATOR_SOURCES = ['js_ast.js', 'extended_ast.py', 'handle_json.py', 'node.py',
+                     'js_reserved.py', 'var_list.py', 'unknown_var_list.py', 'build_cfg.py',
+                     'build_dfg.py', 'build_dfg_parallel.py', 'incremental_pdg.py',
+                     'pdg_format.py', 'def_use_index.py', 'pdg_sidecar.py', 'clone_detection.py',
+                     'equivalence_classes.py']
+GENERATOR_HASH = list()  # Computed once
+
+
+def get_generator_hash():
+    """ SHA-1 of the GENERATOR_SOURCES. """
+
+    if not GENERATOR_HASH:
+        sources_hash = hashlib.sha1()
+        for source in GENERATOR_SOURCES:
+            sources_hash.update(source.encode('utf-8'))
+            sources_hash.update(get_file_hash(os.path.join(SRC_PATH, source)).encode('utf-8'))
+        GENERATOR_HASH.append(sources_hash.hexdigest())
+    return GENERATOR_HASH[0]
+
+
+def get_tool_version():
+    """ Version of the stored PDGs: their format and codec, cf. pdg_format.py, and the code
+    producing them. """
+
+    return [VERSION, PDG_CODEC, get_generator_hash()]
+
+
+def get_manifest_path(store_pdgs):
+    return os.path.normpath(store_pdgs) + '-manifest.json'
+
+
+def load_manifest(store_pdgs):
+    """ Manifest of store_pdgs, empty if there is none. """
+
+    manifest_path = get_manifest_path(store_pdgs)
+    if not os.path.isfile(manifest_path):
+        return dict()
+    try:
+        with open(manifest_path) as json_file:
+            return json.load(json_file)
+    except ValueError as error_message:
+        logging.error('Could not read the manifest %s, all files will be processed: %s',
+                      manifest_path, str(error_message))
+        return dict()
+
+
+def store_manifest(manifest, store_pdgs):
+    # Written then renamed, not to lose the previous manifest if interrupted
+    manifest_path = get_manifest_path(store_pdgs)
+    with open(manifest_path + '.tmp', 'w') as json_file:
+        json.dump(manifest, json_file, indent=1, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def get_file_hash(file_path):
+    file_hash = hashlib.sha1()
+    with open(file_path, 'rb') as input_file:
+        for block in iter(lambda: input_file.read(1024 * 1024), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def get_manifest_entry(file_path, entry=None):
+    """
+        Manifest entry of file_path, the status being left to set.
+
+        -------
+        Parameters:
+        - file_path: str
+            Path of the input file.
+        - entry: dict
+            Previous entry of file_path, whose SHA-1 is reused if the size and mtime did not
+            change. Default: None.
+
+        -------
+        Returns:
+        - dict
+    """
+
+    stat = os.stat(file_path)
+    if entry is not None and entry.get('size') == stat.st_size\
+            and entry.get('mtime') == stat.st_mtime:
+        file_hash = entry['sha1']
+    else:
+        file_hash = get_file_hash(file_path)
+    return {'sha1': file_hash, 'size': stat.st_size, 'mtime': stat.st_mtime,
+            'version': get_tool_version(), 'status': None}
+
+
+def get_source_entry(source, mtime):
+    """ Manifest entry of a file read from an archive, cf. get_manifest_entry. """
+
+    return {'sha1': hashlib.sha1(source).hexdigest(), 'size': len(source), 'mtime': mtime,
+            'version': get_tool_version(), 'status': None}
+
+
+def is_up_to_date(new_entry, entry, stored_pdgs, retry_failed=False):
+    """ Indicates whether the outputs recorded in entry are still valid for new_entry,
+    stored_pdgs being the names of the PDGs which are there, cf. pdg_archive.list_pdgs. The
+    unchanged inputs which failed are only processed again with retry_failed. """
+
+    if entry is None or entry.get('version') != new_entry['version']\
+            or entry['sha1'] != new_entry['sha1']:
+        return False
+    if entry.get('status') == 'stored':
+        return entry.get('pdg') in stored_pdgs
+    return not retry_failed
+
+
+def is_output_folder(folder, store_pdgs):
+    """ Indicates whether folder contains outputs of store_pdgs (PDGs, def-use indexes,
+    sidecars), which are not inputs. """
+
+    store_pdgs = os.path.normpath(store_pdgs)
+    folder = os.path.normpath(folder)
+    return folder == store_pdgs or folder.startswith(store_pdgs + '-')
+
+
+def remove_output_files(store_pdgs, pdg_names):
+    """ Removes the PDG files pdg_names from store_pdgs, with their def-use indexes and
+    sidecars. """
+
+    store_pdgs = os.path.normpath(store_pdgs)
+    for pdg_name in pdg_names:
+        for output_path in [os.path.join(store_pdgs, pdg_name),
+                            os.path.join(store_pdgs + '-def-use', pdg_name + '.json'),
+                            os.path.join(store_pdgs + '-sidecar', pdg_name + '.json')]:
+            if os.path.isfile(output_path):
+                os.remove(output_path)
+
+
+def remove_archived_pdgs(archive_folder, pdg_names):
+    """ Removes the PDGs pdg_names from the indexes of the archive archive_folder (cf.
+    pdg_archive.py), their bytes remaining in the shards until repacked. """
+
+    pdg_names = set(pdg_names)
+    if not pdg_names or not os.path.isdir(archive_folder):
+        return
+    for index_file in os.listdir(archive_folder):
+        if index_file.startswith(INDEX_PREFIX) and index_file.endswith('.json'):
+            index_path = os.path.join(archive_folder, index_file)
+            with open(index_path) as json_file:
+                index = json.load(json_file)
+            if pdg_names & set(index):
+                for pdg_name in pdg_names & set(index):
+                    del index[pdg_name]
+                with open(index_path, 'w') as json_file:
+                    json.dump(index, json_file)
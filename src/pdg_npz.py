@@ -0,0 +1,150 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Export of the PDG structure to NumPy .npz files, for corpus statistics.
+
+    Arrays of a .npz file, the nodes being numbered in pre-order:
+    - kinds: names of the nodes (Node.name) present in the PDG;
+    - node_kind: position of the name of each node in kinds;
+    - node_id: Node.id of each node;
+    - parent: position of the parent of each node, -1 for the root;
+    - depth: depth of each node, 0 for the root;
+    - labels: labels of the dependencies present in the PDG, as strings;
+    - <type>_src, <type>_dst, <type>_label for each type of EDGE_TYPES: position of the source
+    and destination nodes of each dependency, and of its label in labels.
+"""
+
+import os
+import pickle
+import logging
+
+import numpy as np
+
+from pdg_format import get_all_nodes
+from pdg_archive import list_pdgs
+from samples_generation import load_pdg
+
+
+EDGE_TYPES = {'data': 'data_dep_children', 'control': 'control_dep_children',
+              'comment': 'comment_dep_children', 'statement': 'statement_dep_children'}
+
+
+def get_pdg_arrays(pdg):
+    """
+        Structure of a PDG as NumPy arrays.
+
+        -------
+        Parameter:
+        - pdg: Node
+            Output of df_scoping.
+
+        -------
+        Returns:
+        - dict
+            Array name -> array, cf. the description of this module.
+    """
+
+    all_nodes = get_all_nodes(pdg)
+    positions = {id(node): i for i, node in enumerate(all_nodes)}
+    kind_codes, label_codes = dict(), dict()
+    node_kind, node_id, parent, depth = [], [], [], []
+    for node in all_nodes:
+        node_kind.append(kind_codes.setdefault(node.name, len(kind_codes)))
+        node_id.append(node.id)
+        parent.append(positions[id(node.parent)] if node is not pdg else -1)
+        depth.append(depth[parent[-1]] + 1 if parent[-1] >= 0 else 0)
+
+    arrays = {'kinds': np.array(list(kind_codes), dtype=str),
+              'node_kind': np.array(node_kind, dtype=np.int32),
+              'node_id': np.array(node_id, dtype=np.int64),
+              'parent': np.array(parent, dtype=np.int32),
+              'depth': np.array(depth, dtype=np.int32)}
+    for edge_type, dep_list in EDGE_TYPES.items():
+        src, dst, label = [], [], []
+        for i, node in enumerate(all_nodes):
+            for dep in getattr(node, dep_list):
+                src.append(i)
+                dst.append(positions[id(dep.extremity)])
+                label.append(label_codes.setdefault(str(dep.label), len(label_codes)))
+        arrays[edge_type + '_src'] = np.array(src, dtype=np.int32)
+        arrays[edge_type + '_dst'] = np.array(dst, dtype=np.int32)
+        arrays[edge_type + '_label'] = np.array(label, dtype=np.int32)
+    arrays['labels'] = np.array(list(label_codes), dtype=str)
+    return arrays
+
+
+def export_pdg_npz(pdg, npz_path):
+    """ Stores the structure of a PDG in npz_path (cf. get_pdg_arrays). """
+
+    np.savez_compressed(npz_path, **get_pdg_arrays(pdg))
+
+
+def export_pdg_folder_npz(pdg_folder, npz_folder):
+    """
+        Exports the PDGs of a folder or archive to <npz_folder>/<PDG name>.npz.
+
+        -------
+        Parameters:
+        - pdg_folder: str
+            Path of the folder or archive (cf. pdg_archive.py) containing the PDGs.
+        - npz_folder: str
+            Path of the folder to store the .npz files in.
+    """
+
+    os.makedirs(npz_folder, exist_ok=True)
+    nb_exported = 0
+    for pdg_name in list_pdgs(pdg_folder):
+        try:
+            pdg = load_pdg(os.path.join(pdg_folder, pdg_name))
+        except (ValueError, EOFError, pickle.UnpicklingError) as error_message:
+            logging.error('Could not load the PDG %s: %s', pdg_name, str(error_message))
+            continue
+        if pdg is not None:
+            export_pdg_npz(pdg, os.path.join(npz_folder, pdg_name + '.npz'))
+            nb_exported += 1
+    logging.info('Exported %s PDGs to %s', nb_exported, npz_folder)
+
+
+def get_corpus_statistics(npz_folder):
+    """
+        Node-kind frequencies, edge-type counts and depth distribution of exported PDGs.
+
+        -------
+        Parameter:
+        - npz_folder: str
+            Output folder of export_pdg_folder_npz.
+
+        -------
+        Returns:
+        - dict
+            'kinds': node name -> number of nodes; 'edges': edge type -> number of edges;
+            'depths': array, number of nodes per depth.
+    """
+
+    kinds, edges, depths = dict(), dict.fromkeys(EDGE_TYPES, 0), np.zeros(0, dtype=np.int64)
+    for npz_name in sorted(os.listdir(npz_folder)):
+        if not npz_name.endswith('.npz'):
+            continue
+        with np.load(os.path.join(npz_folder, npz_name)) as arrays:
+            counts = np.bincount(arrays['node_kind'], minlength=len(arrays['kinds']))
+            for kind, nb_nodes in zip(arrays['kinds'].tolist(), counts.tolist()):
+                kinds[kind] = kinds.get(kind, 0) + nb_nodes
+            for edge_type in EDGE_TYPES:
+                edges[edge_type] += len(arrays[edge_type + '_src'])
+            pdg_depths = np.bincount(arrays['depth'])
+            if len(pdg_depths) > len(depths):
+                depths = np.pad(depths, (0, len(pdg_depths) - len(depths)))
+            depths[:len(pdg_depths)] += pdg_depths
+    return {'kinds': kinds, 'edges': edges, 'depths': depths}
@@ -0,0 +1,243 @@
+# Copyright (C) 2020 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Staged executor of store_pdg_folder, instead of handling each file from start to end in a
+    process (pdgs_generation.PdgPool):
+        store_pdg_folder('FOLDER_NAME', executor=PdgPipeline(parsers=2, builders=4))
+
+    Stages, connected by queues of queue_size items at most:
+    - parse: threads, waiting for Esprima (Node.js subprocess) to give the AST of each file;
+    - build: processes, producing the PDG from the AST and serializing it, with its sidecar
+    and def-use index (CPU-bound Python);
+    - write: a thread, storing them (I/O), one file per PDG or in the archive.
+    Each worker of a stage measures the time it spends working ('busy'), waiting for its input
+    ('starved') and blocked on a full output queue ('blocked'). At the end, the share of each,
+    over the stage workers and the run, is logged and stored in PdgPipeline.utilization: the
+    busiest stage is the bottleneck, the one to give more workers.
+"""
+
+import os
+import queue
+import timeit
+import logging
+import threading
+from multiprocessing import Process, Queue
+
+from utility_df import NUM_WORKERS, PDG_CODEC
+from handle_json import get_extended_ast
+from pdgs_generation import build_pdg, get_pdg_name
+from pdg_format import dump_flat_pdg, compress_flat_pdg
+from pdg_archive import PdgArchiveWriter
+from pdg_sidecar import build_sidecar, write_sidecar
+from def_use_index import build_def_use_index, store_def_use_index
+
+
+class StageClock:
+    """ Time a stage worker spent busy, starved and blocked. """
+
+    def __init__(self):
+        self.times = {'busy': 0, 'starved': 0, 'blocked': 0}
+        self.last = timeit.default_timer()
+
+    def tick(self, state):
+        """ The time since the previous tick was spent in state. """
+
+        now = timeit.default_timer()
+        self.times[state] += now - self.last
+        self.last = now
+
+
+def parser(inputs, asts, results, clock):
+    """ Parse stage, until it gets None: [folder, file name, PDG folder, source] ->
+    [folder, file name, PDG folder, PDG name, ExtendedAst]. """
+
+    while True:
+        item = inputs.get()
+        clock.tick('starved')
+        if item is None:
+            break
+        [root, js, store_pdgs, source] = item
+        input_file = os.path.join(root, js) if source is None else js
+        pdg_name = get_pdg_name(root, js, store_pdgs, source)
+        try:
+            extended_ast = get_extended_ast(input_file, '-', source=source)
+        except Exception:
+            logging.exception('Could not parse %s', input_file)
+            extended_ast = None
+        clock.tick('busy')
+        if extended_ast is None:
+            results.put([root, js, False])
+        else:
+            asts.put([root, js, store_pdgs, pdg_name, extended_ast])
+            clock.tick('blocked')
+
+
+def builder(asts, pdgs, stats):
+    """ Build stage, until it gets None: [folder, file name, PDG folder, PDG name, ExtendedAst] ->
+    [folder, file name, PDG folder, PDG name, flat PDG, sidecar, DefUseIndex], or
+    [folder, file name] if the PDG could not be produced. """
+
+    clock = StageClock()
+    while True:
+        item = asts.get()
+        clock.tick('starved')
+        if item is None:
+            break
+        [root, js, store_pdgs, pdg_name, extended_ast] = item
+        try:
+            dfg_nodes = build_pdg(extended_ast, os.path.join(root, js), dict())[0]
+            output = [root, js, store_pdgs, pdg_name,
+                      compress_flat_pdg(dump_flat_pdg(dfg_nodes), PDG_CODEC),
+                      build_sidecar(dfg_nodes), build_def_use_index(dfg_nodes)]
+        except Exception:
+            logging.exception('Could not produce the PDG of %s', os.path.join(root, js))
+            output = [root, js]
+        clock.tick('busy')
+        pdgs.put(output)
+        clock.tick('blocked')
+    stats.put(clock.times)
+
+
+def writer(pdgs, results, clock, run_id):
+    """ Write stage, until it gets None. """
+
+    archive_writer = None
+    while True:
+        item = pdgs.get()
+        clock.tick('starved')
+        if item is None:
+            break
+        if len(item) == 2:
+            results.put(item + [False])
+            continue
+        [root, js, store_pdgs, pdg_name, data, sidecar, def_use] = item
+        pdg_path = os.path.join(store_pdgs, pdg_name)
+        try:
+            if run_id is not None:
+                if archive_writer is None:
+                    archive_writer = PdgArchiveWriter(store_pdgs, 'pipeline-' + run_id,
+                                                      codec=PDG_CODEC)
+                archive_writer.add_data(pdg_name, data)
+            else:
+                with open(pdg_path, 'wb') as pdg_file:
+                    pdg_file.write(data)
+            write_sidecar(sidecar, pdg_path)
+            store_def_use_index(def_use, pdg_path)
+            stored = True
+        except (ValueError, TypeError, OSError) as error_message:
+            logging.error('Something wrong occurred to store the PDG of %s: %s', pdg_path,
+                          str(error_message))
+            stored = False
+        results.put([root, js, stored])
+        clock.tick('busy')
+    if archive_writer is not None:
+        archive_writer.close()
+
+
+class PdgPipeline:
+    """ Executor of store_pdg_folder with parse, build and write stages, cf. the description of
+    this module. """
+
+    def __init__(self, parsers=2, builders=NUM_WORKERS, queue_size=None):
+        self.parsers = parsers
+        self.builders = builders
+        self.queue_size = queue_size or 2 * max(parsers, builders)
+        self.inputs = queue.Queue(maxsize=self.queue_size)
+        self.asts = Queue(maxsize=self.queue_size)
+        self.pdgs = Queue(maxsize=self.queue_size)
+        self.stats = Queue()
+        self.results = queue.Queue()
+        self.threads = {'parse': [], 'write': []}
+        self.processes = list()
+        self.clocks = {'parse': [], 'build': [], 'write': []}
+        self.start_time = None
+        self.utilization = dict()  # Stage -> {'workers', 'busy', 'starved', 'blocked'}
+
+    def start(self, run_id=None):
+        """ Starts the stages. run_id names the shards of the archive the PDGs are packed into,
+        None if they are stored one file per PDG. """
+
+        self.start_time = timeit.default_timer()
+        for _ in range(self.builders):
+            p = Process(target=builder, args=(self.asts, self.pdgs, self.stats))
+            p.start()
+            self.processes.append(p)
+        # Started after the processes, not to be forked
+        for _ in range(self.parsers):
+            self.clocks['parse'].append(StageClock())
+            self.threads['parse'].append(threading.Thread(target=parser, args=(
+                self.inputs, self.asts, self.results, self.clocks['parse'][-1])))
+        self.clocks['write'].append(StageClock())
+        self.threads['write'].append(threading.Thread(target=writer, args=(
+            self.pdgs, self.results, self.clocks['write'][-1], run_id)))
+        for thread in self.threads['parse'] + self.threads['write']:
+            thread.start()
+
+    def put(self, item):
+        """ Handles item, [folder, file name, PDG folder, source], cf.
+        pdgs_generation.get_pdg_inputs. Blocks while the parse stage is late. """
+
+        self.inputs.put(item)
+
+    def close(self, nb_items):
+        """ Waits for the nb_items put, one stage after the other, then logs the utilization of
+        each stage. Returns {input path: True if its PDG could be stored}. """
+
+        for _ in self.threads['parse']:
+            self.inputs.put(None)
+        for thread in self.threads['parse']:
+            thread.join()
+        for _ in self.processes:
+            self.asts.put(None)
+        while len(self.clocks['build']) < len(self.processes):  # Before joining the processes
+            try:
+                times = self.stats.get(timeout=1)
+            except queue.Empty:
+                if not any(p.is_alive() for p in self.processes):
+                    break
+                continue
+            clock = StageClock()
+            clock.times = times
+            self.clocks['build'].append(clock)
+        for p in self.processes:
+            p.join()
+        self.pdgs.put(None)
+        for thread in self.threads['write']:
+            thread.join()
+
+        self.report(timeit.default_timer() - self.start_time)
+        statuses = dict()
+        while not self.results.empty():
+            [root, js, stored] = self.results.get()
+            statuses[os.path.join(root, js)] = stored
+        if len(statuses) < nb_items:
+            logging.error('%s files were lost by the pipeline', nb_items - len(statuses))
+        return statuses
+
+    def report(self, elapsed_time):
+        """ Stores and logs the share of time each stage was busy, starved and blocked. """
+
+        for stage, nb_workers in [['parse', self.parsers], ['build', self.builders],
+                                  ['write', 1]]:
+            total_time = max(elapsed_time * nb_workers, 1e-9)
+            self.utilization[stage] = {'workers': nb_workers}
+            for state in ['busy', 'starved', 'blocked']:
+                self.utilization[stage][state] = sum(clock.times[state] for clock
+                                                     in self.clocks[stage]) / total_time
+            logging.info('%s stage, %s workers: %s%% busy, %s%% starved, %s%% blocked', stage,
+                         nb_workers, *[round(100 * self.utilization[stage][state], 1)
+                                       for state in ['busy', 'starved', 'blocked']])
+        bottleneck = max(self.utilization, key=lambda stage: self.utilization[stage]['busy'])
+        logging.info('Bottleneck: %s stage', bottleneck)
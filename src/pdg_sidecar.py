@@ -0,0 +1,98 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Sidecar of a PDG: artifacts of the clone detection which only depend on one PDG, computed
+    once when the PDG is stored instead of for each pair.
+
+    Content (JSON, node ids):
+    - nb_nodes: number of nodes of the PDG, to check that the sidecar matches it;
+    - equivalence: equivalence class -> statement node ids, cf. get_equivalence_classes_graph;
+    - subtrees: statement node id -> get_subtree_hash(traverse(node)), cf. find_clones;
+    - kinds: Node.name -> number of nodes, comments excluded;
+    - literals: type of the value of the Literal nodes -> number of nodes.
+    The sidecar of <folder>/<PDG name> is <folder>-sidecar/<PDG name>.json.
+"""
+
+import os
+import json
+
+from clone_detection import traverse, get_subtree_hash, get_equivalence_classes_graph
+
+
+def get_sidecar_path(pdg_path):
+    """ Path of the sidecar of the PDG pdg_path (possibly in an archive). """
+
+    return os.path.join(os.path.normpath(os.path.dirname(pdg_path)) + '-sidecar',
+                        os.path.basename(pdg_path) + '.json')
+
+
+def build_sidecar(pdg):
+    """
+        Precomputes the artifacts of pdg used by the clone detection.
+
+        -------
+        Parameter:
+        - pdg: Node
+            PDG considered.
+
+        -------
+        Returns:
+        - dict
+            Cf. the description of this module.
+    """
+
+    sidecar = {'nb_nodes': 0, 'equivalence': dict(), 'subtrees': dict(), 'kinds': dict(),
+               'literals': dict()}
+    for kind, equivalence_class in get_equivalence_classes_graph(pdg, 1, dict()).items():
+        sidecar['equivalence'][kind] = [node.id for node in equivalence_class.list1]
+    to_visit = [pdg]
+    while to_visit:
+        node = to_visit.pop()
+        sidecar['nb_nodes'] += 1
+        if node.is_statement():
+            sidecar['subtrees'][node.id] = get_subtree_hash(traverse(node, tab=[]))
+        if not node.is_comment():
+            sidecar['kinds'][node.name] = sidecar['kinds'].get(node.name, 0) + 1
+        if node.name == 'Literal':
+            literal_type = 'regex' if 'regex' in node.attributes\
+                else type(node.attributes.get('value')).__name__
+            sidecar['literals'][literal_type] = sidecar['literals'].get(literal_type, 0) + 1
+        to_visit.extend(node.children)
+    return sidecar
+
+
+def store_sidecar(pdg, pdg_path):
+    """ Stores the sidecar of the PDG pdg stored in pdg_path. """
+
+    write_sidecar(build_sidecar(pdg), pdg_path)
+
+
+def write_sidecar(sidecar, pdg_path):
+    """ Stores sidecar, built with build_sidecar, for the PDG stored in pdg_path. """
+
+    sidecar_path = get_sidecar_path(pdg_path)
+    os.makedirs(os.path.dirname(sidecar_path), exist_ok=True)
+    with open(sidecar_path, 'w') as json_file:
+        json.dump(sidecar, json_file)
+
+
+def load_sidecar(pdg_path):
+    """ Sidecar of the PDG pdg_path, or None if it has not been stored. """
+
+    sidecar_path = get_sidecar_path(pdg_path)
+    if not os.path.isfile(sidecar_path):
+        return None
+    with open(sidecar_path) as json_file:
+        return json.load(json_file)
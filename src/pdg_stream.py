@@ -0,0 +1,235 @@
+# Copyright (C) 2020 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Streaming entry point: NDJSON records read from stdin, one result record per input record
+    written to stdout, without any file. Possibility for multiprocessing (NUM_WORKERS defined in
+    utility_df.py).
+
+    Input records:
+    - {"id": ..., "source": JS code}: PDG of the source;
+    - {"id": ..., "benign": JS code, "malicious": JS code}: clones between the two sources.
+    Output records, in the order in which they are produced:
+    - {"id": ..., "pdg": PDG in the flat binary format (cf. pdg_format.py) encoded in base64,
+    "truncated": bool};
+    - {"id": ..., "clones": findings of samples_generation.detect_clones};
+    - {"id": ..., "error": message} if the record is invalid or could not be handled.
+    At most max_in_flight records are read and not written yet: stdin is then not read any more
+    until results are written (back-pressure). A record whose worker is killed gets an error
+    record, the worker being replaced.
+"""
+
+import sys
+import json
+import time
+import queue
+import base64
+import logging
+import threading
+import contextlib
+
+from utility_df import NUM_WORKERS, PDG_CODEC, DFG_LIMITS, CLONE_LIMITS, POLL_INTERVAL
+from pdgs_generation import get_data_flow
+from pdg_format import dump_flat_pdg, compress_flat_pdg
+from samples_generation import detect_clones
+from worker_slots import WorkerSlots
+
+
+def handle_record(record, dfg_limits=DFG_LIMITS, clone_limits=CLONE_LIMITS):
+    """
+        Handles an input record.
+
+        -------
+        Parameters:
+        - record: dict
+            Input record, cf. the description of this module.
+        - dfg_limits: list
+            [seconds, steps] allowed to produce the data flow of each source. Default: DFG_LIMITS.
+        - clone_limits: list
+            [seconds, steps] allowed to detect clones. Default: CLONE_LIMITS.
+
+        -------
+        Returns:
+        - dict
+            Output record, cf. the description of this module.
+    """
+
+    result = {'id': record.get('id')}
+    if isinstance(record.get('source'), str):
+        pdg = get_data_flow(input_file=str(record.get('id')), benchmarks=dict(),
+                            limits=dfg_limits, source=record['source'].encode('utf-8'))
+        if pdg is None:
+            result['error'] = 'Could not produce the PDG'
+        else:
+            result['pdg'] = base64.b64encode(compress_flat_pdg(dump_flat_pdg(pdg),
+                                                               PDG_CODEC)).decode('ascii')
+            result['truncated'] = 'truncated' in pdg.attributes
+    elif isinstance(record.get('benign'), str) and isinstance(record.get('malicious'), str):
+        pdgs = [get_data_flow(input_file=str(record.get('id')) + ' (' + kind + ')',
+                              benchmarks=dict(), limits=dfg_limits,
+                              source=record[kind].encode('utf-8'))
+                for kind in ['benign', 'malicious']]
+        if None in pdgs:
+            result['error'] = 'Could not produce the PDG of the ' + ' and '.join(
+                kind for kind, pdg in zip(['benign', 'malicious'], pdgs) if pdg is None)
+        else:
+            res_dict = dict()
+            detect_clones(pdgs[0], pdgs[1], res_dict, clone_limits)
+            result['clones'] = res_dict
+    else:
+        result['error'] = 'Expected a source, or a benign and a malicious source'
+    return result
+
+
+def worker(my_queue, results, dfg_limits, clone_limits):
+    """ Worker, until it gets None. """
+
+    with contextlib.redirect_stdout(sys.stderr):  # stdout only contains the output records
+        while True:
+            record = my_queue.get()
+            if record is None:
+                break
+            try:
+                result = handle_record(record, dfg_limits, clone_limits)
+            except Exception as e:
+                logging.exception('Could not handle the record %s', record.get('id'))
+                result = {'id': record.get('id'), 'error': str(e)}
+            results.put(result)
+
+
+class RecordPool:
+    """ nb_workers processes of worker, each one handling a record at a time, with its own
+    queues (cf. worker_slots.py). The record each process holds is known, so that a process
+    which is killed (e.g. by the OOM killer, or a Segfault) is replaced and an error record is
+    produced for its record. """
+
+    def __init__(self, nb_workers, dfg_limits, clone_limits):
+        self.slots = WorkerSlots(nb_workers, worker, [dfg_limits, clone_limits])
+        self.holding = [None] * nb_workers  # Per slot: record being handled
+        for slot in range(nb_workers):
+            self.slots.start(slot)
+
+    def has_room(self):
+        return None in self.holding
+
+    def is_busy(self):
+        return any(record is not None for record in self.holding)
+
+    def put(self, record):
+        slot = self.holding.index(None)
+        self.holding[slot] = record
+        self.slots.put(slot, record)
+
+    def get_results(self):
+        """ Output records produced so far, replacing the processes which were killed. """
+
+        output = list()
+        for slot, p in enumerate(self.slots.processes):
+            [results, alive] = self.slots.get_outputs(slot)
+            if results:
+                output.extend(results)
+                self.holding[slot] = None
+            if alive:
+                continue
+            p.join()
+            logging.error('Worker %s was killed (exit code %s)', p.pid, p.exitcode)
+            if self.holding[slot] is not None:
+                output.append({'id': self.holding[slot].get('id'),
+                               'error': 'The worker was killed (exit code ' + str(p.exitcode)
+                                        + ')'})
+                self.holding[slot] = None
+            self.slots.start(slot)
+        return output
+
+    def close(self):
+        self.slots.stop()
+        for p in self.slots.processes:
+            p.join()
+
+
+def read_records(input_stream, records, in_flight):
+    """ Reads the NDJSON records of input_stream into records, invalid ones as
+    [output record], then None. """
+
+    for line in input_stream:
+        if not line.strip():
+            continue
+        in_flight.acquire()  # Blocks while max_in_flight records are being handled
+        try:
+            record = json.loads(line)
+        except ValueError as error_message:
+            records.put([{'id': None, 'error': 'Invalid JSON: ' + str(error_message)}])
+            continue
+        if not isinstance(record, dict):
+            records.put([{'id': None, 'error': 'Expected a JSON object'}])
+            continue
+        records.put(record)
+    records.put(None)
+
+
+def stream_records(input_stream=None, output_stream=None, max_in_flight=None,
+                   dfg_limits=DFG_LIMITS, clone_limits=CLONE_LIMITS):
+    """
+        Handles the NDJSON records of input_stream with NUM_WORKERS processes and writes one
+        result record per input record to output_stream, cf. the description of this module.
+        The workers which are killed are replaced, cf. RecordPool.
+
+        -------
+        Parameters:
+        - input_stream: file object
+            Text stream of the input records. Default: None, i.e. stdin.
+        - output_stream: file object
+            Text stream of the output records. Default: None, i.e. stdout.
+        - max_in_flight: int
+            Records read but not written yet, at most. Default: None, i.e. 2 * NUM_WORKERS.
+        - dfg_limits: list
+            [seconds, steps] allowed to produce the data flow of each source. Default: DFG_LIMITS.
+        - clone_limits: list
+            [seconds, steps] allowed to detect clones. Default: CLONE_LIMITS.
+    """
+
+    if input_stream is None or input_stream is sys.stdin:
+        # Read through its own buffer: a worker forked while the reader thread holds the lock
+        # of sys.stdin would wait for it forever, when closing sys.stdin
+        input_stream = open(sys.stdin.fileno(), encoding='utf-8', closefd=False)
+    output_stream = sys.stdout if output_stream is None else output_stream
+    in_flight = threading.BoundedSemaphore(max_in_flight or 2 * NUM_WORKERS)
+    records = queue.Queue()
+    pool = RecordPool(NUM_WORKERS, dfg_limits, clone_limits)
+    # Started after the workers, not to be forked
+    reader = threading.Thread(target=read_records, args=(input_stream, records, in_flight))
+    reader.start()
+
+    reading = True
+    while reading or pool.is_busy():
+        output = pool.get_results()
+        while reading and pool.has_room():
+            try:
+                item = records.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                reading = False
+            elif isinstance(item, list):
+                output.extend(item)
+            else:
+                pool.put(item)
+        for result in output:
+            output_stream.write(json.dumps(result) + '\n')
+            output_stream.flush()
+            in_flight.release()
+        if not output:
+            time.sleep(POLL_INTERVAL)
+    pool.close()
+    reader.join()
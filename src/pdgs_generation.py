@@ -17,26 +17,75 @@
     defined in utility_df.py).
 """
 
-import pickle
+import queue
+import shutil
+import tempfile
 from multiprocessing import Process, Queue
 
 from utility_df import *
 from handle_json import *
 from build_cfg import *
 from build_dfg import *
+from build_dfg_parallel import df_scoping_parallel
+from incremental_pdg import ReusableBodies
+from def_use_index import build_def_use_index, store_def_use_index
+from pdg_format import store_flat_pdg, load_flat_pdg, get_all_nodes
+from pdg_archive import PdgArchiveWriter, close_archive, list_pdgs
+from pdg_sidecar import store_sidecar
+from pdg_manifest import *
+from js_archives import is_js_archive, get_member_pdg_name, get_archive_members
 from var_list import *
+from unknown_var_list import *
 
 
 GIT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
 
+# [name, source] checked by check_parallel_dfg in addition to the files of its folder: function
+# bodies called through a member, which df_scoping does not enter
+DFG_CHECK_CASES = [
+    ['call.js', b'(function(){ var a = 1; var b = a + 1; }).call(this);\n'
+                b'function f(x) { var y = x; return y; }\n'
+                b'var z = f(2);\n'],
+    ['apply.js', b'var c = 1;\n'
+                 b'if (c) { (function(){ var a = c; a = a + 1; }).apply(this); }\n'
+                 b'function g() { return c; }\n'],
+    ['nested.js', b'var g = 0;\n'
+                  b'(function(){ function h(x) { return x + g; } g = h(1); }).call(this);\n'
+                  b'(function(u){ var v = u; (function(){ var w = v; }).apply(this, [v]); })(g);\n'
+                  b'var obj = { run: function() { return g; } };\n'
+                  b'obj.run.call(obj);\n'
+                  b'(function(){ k = 2; }).call(this);\n'
+                  b'var m = k + g;\n'],
+    ['hoisting.js', b'(function(){ var a = later(); }).call(this);\n'
+                    b'function later() { return 1; }\n'
+                    b'if (later()) { (function(){ return later; }).apply(this); }\n'
+                    b'else { var q = 3; }\n']
+]
 
-def pickle_dump_process(dfg_nodes, store_pdg):
-    """ Call to pickle.dump """
+# [name, source, edited source] checked by check_incremental_pdg
+INCREMENTAL_CHECK_CASES = [
+    ['call.js', b'(function(){ var a = 1; var b = a + 1; }).call(this);\n'
+                b'function f(x) { var y = x; return y; }\n'
+                b'var z = f(2);\n',
+     b'(function(){ var a = 1; var b = a + 1; }).call(this);\n'
+     b'function f(x) { var y = x; return y; }\n'
+     b'var z = f(3);\n'
+     b'(function(){ var c = z; }).call(this);\n'],
+    ['apply.js', b'var c = 1;\n'
+                 b'function g() { return c; }\n'
+                 b'if (c) { (function(){ var a = c; a = a + 1; }).apply(this); }\n'
+                 b'function h(d) { var e = d + 1; return e; }\n',
+     b'var c = 1;\n'
+     b'function g() { return c; }\n'
+     b'if (c) { (function(){ var a = c; a = a + 2; }).apply(this); }\n'
+     b'(function(){ c = g(); }).call(this);\n'
+     b'function h(d) { var e = d + 1; return e; }\n']
+]
 
-    pickle.dump(dfg_nodes, open(store_pdg, 'wb'))
 
-
-def get_data_flow(input_file, benchmarks, store_pdgs=None, check_var=False):
+def get_data_flow(input_file, benchmarks, store_pdgs=None, check_var=False, limits=DFG_LIMITS,
+                  parallel_dfg=False, previous_pdg=None, counters=False, source=None,
+                  pdg_name=None):
     """
         Produces the PDG of a given file.
 
@@ -47,10 +96,31 @@ def get_data_flow(input_file, benchmarks, store_pdgs=None, check_var=False):
         - benchmarks: dict
             Contains the different microbenchmarks. Should be empty.
         - store_pdgs: str
-            Path of the folder to store the PDG in.
+            Path of the folder to store the PDG in, its def-use index being stored in
+            <store_pdgs>-def-use and its sidecar (cf. pdg_sidecar.py) in <store_pdgs>-sidecar.
             Or None to pursue without storing it.
         - check_var: bool
             Build PDG just to check if our malicious variables are undefined. Default: False.
+        - limits: list
+            [seconds, steps] allowed to produce the data flow, None meaning unlimited. Once
+            reached, the partial PDG is returned with the attribute truncated. Default: DFG_LIMITS.
+        - parallel_dfg: bool
+            Builds the data flow of the function bodies with NUM_WORKERS processes, cf.
+            build_dfg_parallel.py. Default: False.
+        - previous_pdg: Node
+            PDG of a previous version of the file, produced with parallel_dfg. The data flow of
+            its unchanged function bodies is reused, cf. incremental_pdg.py. Default: None.
+        - counters: bool
+            Stores the DFG counters (handler calls, VarList copies, edges, time per node kind,
+            cf. DfCounters) in benchmarks['DFG counters']. Default: False.
+        - source: bytes
+            Content of the file, e.g. read from an archive (cf. js_archives.py) or a stream (cf.
+            pdg_stream.py): input_file is then only a name, e.g. the path of the member in the
+            archive, which is never extracted, and the PDG is named after it. No helper file is
+            written. Default: None, i.e. input_file is read.
+        - pdg_name: str
+            Name of the PDG in store_pdgs, cf. get_pdg_name. Default: None, i.e. named after
+            input_file.
 
         -------
         Returns:
@@ -60,108 +130,454 @@ def get_data_flow(input_file, benchmarks, store_pdgs=None, check_var=False):
     """
 
     start = timeit.default_timer()
-    if input_file.endswith('.js'):
+    if source is not None:
+        esprima_json = '-'  # No file at all
+    elif input_file.endswith('.js'):
         esprima_json = input_file.replace('.js', '.json')
     else:
         esprima_json = input_file + '.json'
-    extended_ast = get_extended_ast(input_file, esprima_json)
+    extended_ast = get_extended_ast(input_file, esprima_json, source=source)
     if extended_ast is not None:
         benchmarks['got AST'] = timeit.default_timer() - start
         start = micro_benchmark('Successfully got Esprima AST in', timeit.default_timer() - start)
-        ast = extended_ast.get_ast()
-        # beautiful_print_ast(ast, delete_leaf=[])
-        ast_nodes = ast_to_ast_nodes(ast, ast_nodes=Node('Program'))
-        benchmarks['AST'] = timeit.default_timer() - start
-        start = micro_benchmark('Successfully produced the AST in', timeit.default_timer() - start)
-        # draw_ast(ast_nodes, attributes=True, save_path=save_path_ast)
-        cfg_nodes = build_cfg(ast_nodes)
-        benchmarks['CFG'] = timeit.default_timer() - start
-        start = micro_benchmark('Successfully produced the CFG in', timeit.default_timer() - start)
-        # draw_cfg(cfg_nodes, attributes=True, save_path=save_path_cfg)
-        unknown_var = []
-        try:
-            with Timeout(60):  # Tries to produce DF within 60s
-                dfg_nodes = df_scoping(cfg_nodes, var_loc=VarList(), var_glob=VarList(),
-                                       unknown_var=unknown_var, id_list=[], entry=1)[0]
-        except Timeout.Timeout:
-            logging.exception('Timed out for %s', input_file)
-            return None
-        # draw_pdg(dfg_nodes, attributes=True, save_path=save_path_pdg)
-        for unknown in unknown_var:
-            logging.warning('The variable ' + unknown.attributes['name'] + ' is not declared')
+        [dfg_nodes, unknown_var] = build_pdg(extended_ast, input_file, benchmarks, limits,
+                                             parallel_dfg, previous_pdg, counters)
         if check_var:
-            return unknown_var
-        benchmarks['PDG'] = timeit.default_timer() - start
-        micro_benchmark('Successfully produced the PDG in', timeit.default_timer() - start)
+            return unknown_var.get_var_list()
         if store_pdgs is not None:
-            store_pdg = os.path.join(store_pdgs, os.path.basename(input_file.replace('.js', '')))
-            # pickle.dump(dfg_nodes, open(store_pdg, 'wb'))
-            # I don't know why, but some PDGs lead to Segfault, this way it does not kill the
-            # current process at least
-            p = Process(target=pickle_dump_process, args=(dfg_nodes, store_pdg))
-            p.start()
-            p.join()
-            if p.exitcode != 0:
-                logging.error('Something wrong occurred to pickle the PDG of %s', store_pdg)
-                if os.path.isfile(store_pdg) and os.stat(store_pdg).st_size == 0:
+            if pdg_name is None:
+                pdg_name = get_member_pdg_name(input_file) if source is not None\
+                    else os.path.basename(input_file.replace('.js', ''))
+            store_pdg = os.path.join(store_pdgs, pdg_name)
+            # Flat binary format, written iteratively: pickle on the cyclic graph led to
+            # Segfaults, hence a process per dump
+            try:
+                store_flat_pdg(dfg_nodes, store_pdg, codec=PDG_CODEC)
+                store_sidecar(dfg_nodes, store_pdg)
+            except (ValueError, TypeError, OSError) as error_message:
+                logging.error('Something wrong occurred to store the PDG of %s: %s', store_pdg,
+                              str(error_message))
+                if os.path.isfile(store_pdg):
                     os.remove(store_pdg)
+            else:  # Only for a stored PDG
+                store_def_use_index(build_def_use_index(dfg_nodes), store_pdg)
         return dfg_nodes
     return None
 
 
-def handle_one_pdg(root, js, store_pdgs):
-    """ Stores the PDG of js located in root, in store_pdgs. """
+def build_pdg(extended_ast, input_file, benchmarks, limits=DFG_LIMITS, parallel_dfg=False,
+              previous_pdg=None, counters=False):
+    """
+        Produces the PDG of an AST given by Esprima, cf. get_data_flow for the parameters.
+
+        -------
+        Returns:
+        - list
+            [PDG, UnknownVarList of the undeclared variables].
+    """
+
+    start = timeit.default_timer()
+    ast = extended_ast.get_ast()
+    # beautiful_print_ast(ast, delete_leaf=[])
+    ast_nodes = ast_to_ast_nodes(ast, ast_nodes=Node('Program'))
+    benchmarks['AST'] = timeit.default_timer() - start
+    start = micro_benchmark('Successfully produced the AST in', timeit.default_timer() - start)
+    # draw_ast(ast_nodes, attributes=True, save_path=save_path_ast)
+    cfg_nodes = build_cfg(ast_nodes)
+    benchmarks['CFG'] = timeit.default_timer() - start
+    start = micro_benchmark('Successfully produced the CFG in', timeit.default_timer() - start)
+    # draw_cfg(cfg_nodes, attributes=True, save_path=save_path_cfg)
+    unknown_var = UnknownVarList()
+    budget = Budget(*limits)  # Tries to produce DF within 60s per default
+    df_counters = DfCounters() if counters else None
+    reusable = None
+    if previous_pdg is not None and 'function_bodies' in previous_pdg.attributes:
+        reusable = ReusableBodies(previous_pdg, cfg_nodes)
+    elif previous_pdg is not None:
+        logging.warning('The previous PDG of %s was not produced with parallel_dfg, '
+                        'building the PDG from scratch', input_file)
+    if parallel_dfg or reusable is not None:
+        dfg_nodes = df_scoping_parallel(cfg_nodes, var_loc=VarList(), var_glob=VarList(),
+                                        unknown_var=unknown_var, id_list=[], entry=1,
+                                        budget=budget, reusable=reusable,
+                                        counters=df_counters)[0]
+        if reusable is not None:
+            benchmarks['reused bodies'] = reusable.get_nb_reused()
+            logging.info('Reused the data flow of %s/%s function bodies',
+                         reusable.get_nb_reused(), len(dfg_nodes.attributes['function_bodies']))
+    else:
+        dfg_nodes = df_scoping(cfg_nodes, var_loc=VarList(), var_glob=VarList(),
+                               unknown_var=unknown_var, id_list=[], entry=1, budget=budget,
+                               counters=df_counters)[0]
+    if budget.exceeded:
+        logging.error('Timed out for %s, the PDG is truncated', input_file)
+        dfg_nodes.set_attribute('truncated', True)
+    benchmarks['truncated'] = budget.exceeded
+    if df_counters is not None:
+        benchmarks['DFG counters'] = df_counters.get_counters()
+    # draw_pdg(dfg_nodes, attributes=True, save_path=save_path_pdg)
+    benchmarks['undeclared'] = unknown_var.get_summary()
+    if benchmarks['undeclared']:
+        logging.warning('%s undeclared variables in %s: %s', len(unknown_var), input_file,
+                        ', '.join(var_name + ' (' + str(nb) + ')' for var_name, nb
+                                  in benchmarks['undeclared'].items()))
+    benchmarks['PDG'] = timeit.default_timer() - start
+    micro_benchmark('Successfully produced the PDG in', timeit.default_timer() - start)
+    return [dfg_nodes, unknown_var]
+
+
+def get_data_flow_edges(pdg):
+    """ Data flow edges of pdg as (begin, extremity, id_begin, id_end) positions of the nodes in
+    pre-order, so that the edges of two PDGs of the same file can be compared. """
+
+    positions = {node.id: i for i, node in enumerate(get_all_nodes(pdg))}
+    edges = set()
+    for node in get_all_nodes(pdg):
+        for dep in node.data_dep_children:
+            edges.add((positions[node.id], positions[dep.extremity.id],
+                       None if dep.id_begin is None else positions[dep.id_begin.id],
+                       None if dep.id_end is None else positions[dep.id_end.id]))
+    return edges
+
+
+def get_check_inputs(folder):
+    """ [path, content] of the JS files of folder, read here not to write the helper JSON files
+    in folder. """
+
+    inputs = []
+    for root, _, files in os.walk(folder):
+        for js in sorted(files):
+            if js.endswith('.js'):
+                with open(os.path.join(root, js), 'rb') as js_file:
+                    inputs.append([os.path.join(root, js), js_file.read()])
+    return inputs
+
+
+def check_parallel_dfg(folder=os.path.join(os.path.dirname(__file__), '..', 'example')):
+    """
+        Checks that build_dfg_parallel.py gives the same data flow as df_scoping, on the JS
+        files of folder and on DFG_CHECK_CASES. Both are built without time or steps limit.
+
+        -------
+        Parameter:
+        - folder: str
+            Path of the folder containing the JS files. Default: the example folder.
+
+        -------
+        Returns:
+        - dict
+            JS file path or case name -> [number of sequential edges, number of parallel edges,
+            number of edges found by only one of them].
+    """
+
+    results = dict()
+    for [js_path, source] in get_check_inputs(folder) + DFG_CHECK_CASES:
+        edges = []
+        for parallel_dfg in [False, True]:
+            pdg = get_data_flow(js_path, dict(), limits=[None, None],
+                                parallel_dfg=parallel_dfg, source=source)
+            edges.append(None if pdg is None else get_data_flow_edges(pdg))
+        if None in edges:
+            logging.error('Could not produce the PDG of %s', js_path)
+            continue
+        results[js_path] = [len(edges[0]), len(edges[1]), len(edges[0] ^ edges[1])]
+        if edges[0] != edges[1]:
+            logging.error('The parallel data flow of %s differs from the sequential one: '
+                          '%s edges only found sequentially, %s only in parallel', js_path,
+                          len(edges[0] - edges[1]), len(edges[1] - edges[0]))
+        else:
+            logging.info('Same %s data flow edges for %s', len(edges[0]), js_path)
+    return results
+
+
+def check_incremental_pdg(cases=INCREMENTAL_CHECK_CASES):
+    """
+        Checks that the PDG of an edited file built from its previous PDG, kept in memory or
+        stored and loaded again, has the same data flow as the PDG built from scratch. All are
+        built without time or steps limit.
+
+        -------
+        Parameter:
+        - cases: list
+            [name, source, edited source] of the files. Default: INCREMENTAL_CHECK_CASES.
+
+        -------
+        Returns:
+        - dict
+            Name -> [number of edges from scratch, number of edges found by only one of the
+            versions, number of function bodies reused], for the previous PDG in memory then
+            loaded.
+    """
+
+    results = dict()
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        for [name, source, edited_source] in cases:
+            previous_pdg = get_data_flow(name, dict(), limits=[None, None], parallel_dfg=True,
+                                         source=source)
+            pdg = get_data_flow(name, dict(), limits=[None, None], source=edited_source)
+            if previous_pdg is None or pdg is None:
+                logging.error('Could not produce the PDG of %s', name)
+                continue
+            pdg_path = os.path.join(tmp_folder, 'previous')
+            store_flat_pdg(previous_pdg, pdg_path)
+            edges = get_data_flow_edges(pdg)
+            results[name] = []
+            for [origin, previous] in [['in memory', previous_pdg],
+                                       ['loaded', load_flat_pdg(pdg_path)]]:
+                benchmarks = dict()
+                incremental_edges = get_data_flow_edges(
+                    get_data_flow(name, benchmarks, limits=[None, None], previous_pdg=previous,
+                                  source=edited_source))
+                results[name].append([len(edges), len(edges ^ incremental_edges),
+                                      benchmarks['reused bodies']])
+                if edges != incremental_edges:
+                    logging.error('The data flow of %s built from its previous PDG (%s) differs '
+                                  'from scratch: %s edges only found from scratch, %s only '
+                                  'incrementally', name, origin, len(edges - incremental_edges),
+                                  len(incremental_edges - edges))
+                else:
+                    logging.info('Same %s data flow edges for %s built from its previous PDG '
+                                 '(%s), %s function bodies reused', len(edges), name, origin,
+                                 benchmarks['reused bodies'])
+    return results
+
+
+def get_pdg_name(root, js, store_pdgs, source=None):
+    """ Name of the PDG of js located in root, store_pdgs being in the input folder, cf.
+    store_pdg_folder. With source, js is a member of the archive root, cf. js_archives.py. """
+
+    if source is None:
+        return js.replace('.js', '')
+    folder_js = os.path.dirname(os.path.normpath(store_pdgs))
+    return get_member_pdg_name(js, os.path.relpath(root, folder_js))
+
+
+def handle_one_pdg(root, js, store_pdgs, archive_writer=None, source=None):
+    """ Stores the PDG of js located in root, in store_pdgs or with archive_writer. With source,
+    js is a member of the archive root, cf. js_archives.py. Returns True if the PDG could be
+    stored. """
 
     benchmarks = dict()
-    print(os.path.join(store_pdgs, js.replace('.js', '')))
-    get_data_flow(input_file=os.path.join(root, js), benchmarks=benchmarks,
-                  store_pdgs=store_pdgs)
+    input_file = os.path.join(root, js) if source is None else js
+    pdg_name = get_pdg_name(root, js, store_pdgs, source)
+    pdg_path = os.path.join(store_pdgs, pdg_name)
+    print(pdg_path)
+    if archive_writer is None:
+        dfg_nodes = get_data_flow(input_file=input_file, benchmarks=benchmarks,
+                                  store_pdgs=store_pdgs, source=source, pdg_name=pdg_name)
+        return dfg_nodes is not None and os.path.isfile(pdg_path)
+    dfg_nodes = get_data_flow(input_file=input_file, benchmarks=benchmarks, source=source)
+    if dfg_nodes is not None:
+        archive_writer.add_pdg(pdg_name, dfg_nodes)
+        store_sidecar(dfg_nodes, pdg_path)
+        store_def_use_index(build_def_use_index(dfg_nodes), pdg_path)
+        return True
+    return False
 
 
-def worker(my_queue):
-    """ Worker """
+def worker(my_queue, archive_prefix=None, results=None):
+    """ Worker, until it gets None. """
 
+    archive_writer = None
     while True:
-        try:
-            item = my_queue.get(timeout=2)
-            handle_one_pdg(item[0], item[1], item[2])
-        except Exception as e:
+        item = my_queue.get()
+        if item is None:
             break
+        if archive_prefix is not None and archive_writer is None:
+            archive_writer = PdgArchiveWriter(item[2], archive_prefix, codec=PDG_CODEC)
+        try:
+            stored = handle_one_pdg(item[0], item[1], item[2], archive_writer, item[3])
+        except Exception:
+            logging.exception('Could not store the PDG of %s', os.path.join(item[0], item[1]))
+            stored = False
+        if results is not None:
+            results.put([item[0], item[1], stored])
+    if archive_writer is not None:
+        archive_writer.close()
+
+
+class PdgPool:
+    """ Processes each handling files from start to end (cf. worker), the default executor of
+    store_pdg_folder. """
+
+    def __init__(self, workers=NUM_WORKERS):
+        self.workers = workers
+        # Bounded, so that the files are handled in the order of get_pdg_inputs and the sources
+        # of the archives are not all loaded in memory
+        self.my_queue = Queue(maxsize=2 * workers)
+        self.results = Queue()
+        self.processes = list()
+
+    def start(self, run_id=None):
+        """ Starts the processes. run_id names the shards of the archive the PDGs are packed
+        into, None if they are stored one file per PDG. """
+
+        for i in range(self.workers):
+            p = Process(target=worker, args=(self.my_queue, 'worker' + str(i) + '-' + run_id
+                                             if run_id is not None else None, self.results))
+            p.start()
+            print("Starting process")
+            self.processes.append(p)
+
+    def put(self, item):
+        """ Handles item, [folder, file name, PDG folder, source], cf. get_pdg_inputs. """
+
+        self.my_queue.put(item)
+
+    def close(self, nb_items):
+        """ Waits for the nb_items put. Returns {input path: True if its PDG could be
+        stored}. """
+
+        for _ in self.processes:
+            self.my_queue.put(None)
+        statuses = dict()
+        while len(statuses) < nb_items\
+                and (any(p.is_alive() for p in self.processes) or not self.results.empty()):
+            try:
+                [root, js, stored] = self.results.get(timeout=1)
+                statuses[os.path.join(root, js)] = stored
+            except queue.Empty:
+                pass
+        for p in self.processes:
+            p.join()
+        return statuses
+
+
+def get_pdg_inputs(folder_js, store_pdgs):
+    """
+        Files of folder_js to get the PDG of, the members of the tar and zip archives being read
+        without extracting them (cf. js_archives.py). The largest files come first, so that
+        the longest jobs start early and do not leave a long tail; then the members of the
+        archives, largest archive first, in the order in which they are streamed.
 
+        -------
+        Parameters:
+        - folder_js: str
+            Path of the folder containing the files to get the PDG of.
+        - store_pdgs: str
+            Path of the folder to store the PDGs in, whose outputs are not inputs.
 
-def store_pdg_folder(folder_js):
+        -------
+        Returns:
+        - generator
+            [folder, file name, None, None] for a file;
+            [archive path, member path, content (bytes), mtime] for a member of an archive.
     """
-        Stores the PDGs of the JS files from folder_js.
+
+    files, archives = [], []  # [size, folder, file name]
+    for root, dirs, file_names in os.walk(folder_js):
+        dirs[:] = [d for d in dirs if not is_output_folder(os.path.join(root, d), store_pdgs)]
+        for js in file_names:
+            js_path = os.path.join(root, js)
+            if root == folder_js and is_output_folder(js_path, store_pdgs):
+                continue  # Manifest
+            (archives if is_js_archive(js) else files).append([os.path.getsize(js_path),
+                                                               root, js])
+
+    for [_, root, js] in sorted(files, key=lambda file: file[0], reverse=True):
+        yield [root, js, None, None]
+    for [_, root, archive_name] in sorted(archives, key=lambda file: file[0], reverse=True):
+        archive_path = os.path.join(root, archive_name)
+        for [member_path, source, mtime] in get_archive_members(archive_path):
+            yield [archive_path, member_path, source, mtime]
+
+
+def store_pdg_folder(folder_js, archive=False, force=False, retry_failed=False,
+                     workers=NUM_WORKERS, executor=None):
+    """
+        Stores the PDGs of the JS files from folder_js. The members of the tar and zip archives
+        of folder_js are read without being extracted, their PDGs being named after their path
+        in the archive (cf. js_archives.py). Only the files which are new or changed since the
+        previous run, or whose PDG is missing, are processed, and the PDGs of the files which
+        disappeared are removed, cf. pdg_manifest.py. The files are handled by a pool of
+        processes, largest first (cf. get_pdg_inputs), or by another executor, e.g. a
+        pdg_pipeline.PdgPipeline.
 
         -------
         Parameters:
         - folder_js: str
             Path of the folder containing the files to get the PDG of.
+        - archive: bool
+            Packs the PDGs into the shards of the archive folder_js/PDG-archive (cf.
+            pdg_archive.py), instead of one file per PDG in folder_js/PDG. Default: False.
+        - force: bool
+            Processes all the files, even the ones which are up to date. Default: False.
+        - retry_failed: bool
+            Processes again the files whose PDG failed, even if they did not change. Default:
+            False.
+        - workers: int
+            Number of processes producing the PDGs. Default: NUM_WORKERS.
+        - executor: PdgPool
+            Or any object with the same start, put and close methods, which handles the files.
+            Default: None, i.e. PdgPool(workers).
+
+        -------
+        Returns:
+        - dict
+            Number of files 'skipped' (up to date), 'rebuilt', 'failed' and of PDGs 'deleted'.
+        - or None.
     """
 
     start = timeit.default_timer()
-
-    my_queue = Queue()
-    workers = list()
+    executor = PdgPool(workers) if executor is None else executor
 
     if not os.path.exists(folder_js):
         logging.exception('The path %s does not exist', folder_js)
-        return
-    store_pdgs = os.path.join(folder_js, 'PDG')
+        return None
+    store_pdgs = os.path.join(folder_js, 'PDG-archive' if archive else 'PDG')
+    if force and archive and os.path.exists(store_pdgs):
+        shutil.rmtree(store_pdgs)  # Shards cannot be partly overwritten
     if not os.path.exists(store_pdgs):
         os.makedirs(store_pdgs)
 
-    for root, _, files in os.walk(folder_js):
-        for js in files:
-            my_queue.put([root, js, store_pdgs])
+    run_id = str(time.time_ns())  # Not to overwrite the shards of the previous runs
+    executor.start(run_id if archive else None)
+
+    manifest = dict() if force else load_manifest(store_pdgs)
+    stored_pdgs = set(list_pdgs(store_pdgs))  # A PDG which was removed is produced again
+    new_manifest = dict()
+    summary = {'skipped': 0, 'rebuilt': 0, 'failed': 0, 'deleted': 0}
+    to_process = dict()  # Input path -> manifest key
+    for [root, js, source, mtime] in get_pdg_inputs(folder_js, store_pdgs):
+        js_path = os.path.join(root, js)
+        key = os.path.relpath(js_path, folder_js)
+        if source is None:
+            new_manifest[key] = get_manifest_entry(js_path, manifest.get(key))
+        else:
+            new_manifest[key] = get_source_entry(source, mtime)
+        new_manifest[key]['pdg'] = get_pdg_name(root, js, store_pdgs, source)
+        if is_up_to_date(new_manifest[key], manifest.get(key), stored_pdgs, retry_failed):
+            new_manifest[key]['status'] = manifest[key]['status']
+            summary['skipped'] += 1
+        else:
+            to_process[js_path] = key
+            remove_output_files(store_pdgs, [new_manifest[key]['pdg']])
+            executor.put([root, js, store_pdgs, source])
 
-    for i in range(NUM_WORKERS):
-        p = Process(target=worker, args=(my_queue,))
-        p.start()
-        print("Starting process")
-        workers.append(p)
+    # PDGs of the files which disappeared or are processed again
+    stored_names = set(entry['pdg'] for entry in new_manifest.values())
+    deleted_names = [entry.get('pdg', os.path.basename(key).replace('.js', ''))
+                     for key, entry in manifest.items() if key not in new_manifest]
+    deleted_names = [pdg_name for pdg_name in deleted_names if pdg_name not in stored_names]
+    summary['deleted'] = len(deleted_names)
+    remove_output_files(store_pdgs, deleted_names)
+    if archive:  # Before the new indexes are written, when the workers get None
+        remove_archived_pdgs(store_pdgs, deleted_names + [new_manifest[key]['pdg']
+                                                          for key in to_process.values()])
+    statuses = executor.close(len(to_process))
 
-    for w in workers:
-        w.join()
+    for js_path, key in to_process.items():
+        if statuses.get(js_path, False):
+            new_manifest[key]['status'] = 'stored'
+            summary['rebuilt'] += 1
+        else:
+            new_manifest[key]['status'] = 'failed'
+            summary['failed'] += 1
+    store_manifest(new_manifest, store_pdgs)
+    if archive:
+        close_archive(store_pdgs)
 
+    logging.info('%s files skipped (up to date), %s rebuilt, %s failed, %s PDGs deleted',
+                 summary['skipped'], summary['rebuilt'], summary['failed'], summary['deleted'])
     micro_benchmark('Total elapsed time:', timeit.default_timer() - start)
+    return summary
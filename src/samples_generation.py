@@ -19,97 +19,747 @@
     Possibility for multiprocessing (NUM_WORKERS defined in utility_df.py).
 """
 
+import heapq
+import queue
+import random
 import pickle
-from multiprocessing import Process, Queue
+import tempfile
+from collections import OrderedDict
 
 from utility_df import *
 from pdgs_generation import get_data_flow
 from clone_detection import *
+from pdg_format import is_flat_pdg, load_flat_pdg, get_all_nodes, LazyPdg, store_flat_pdg,\
+    get_synthetic_pdg
+from pdg_archive import is_pdg_archive, load_archived_pdg, load_archived_lazy_pdg,\
+    list_pdgs
+from pdg_sidecar import load_sidecar
+from pair_journal import *
+from worker_slots import WorkerSlots
+
+
+def worker(my_queue, events, start, prefilter=False, journal_path=None, max_tasks=None,
+           max_rss=None):
+    """ Worker of a slot of a WorkerPool, until it gets None. Stops earlier, to be replaced,
+    after max_tasks tasks or once its RSS exceeds max_rss MB, the pairs of its task not analyzed
+    yet being handed back. Gets [task id, task] from my_queue and sends [event, data] to events,
+    cf. WorkerPool. The pairs which raise an exception are not journaled, the WorkerPool retrying
+    them. """
+
+    journal = PairJournal(journal_path) if journal_path is not None else None
+    cache = PdgCache()
+    nb_tasks, reason = 0, 'stopped'
+    while True:
+        item = my_queue.get()
+        if item is None:
+            break
+        [task_id, task] = item
+        events.put(['start', task_id])
+        # print(task)
+        handed_back = []
+        for i, [malicious_pdg_path, json_analysis] in enumerate(task[1]):
+            pair_start = timeit.default_timer()
+            try:
+                status = analyze_valid_pdgs(task[0], malicious_pdg_path, json_analysis,
+                                            prefilter=prefilter, cache=cache)
+            except Exception:
+                logging.exception('Could not analyze %s and %s', malicious_pdg_path, task[0])
+                status = None
+            if journal is not None and status is not None:
+                journal.add_pair(task[0], malicious_pdg_path, status,
+                                 timeit.default_timer() - pair_start)
+            events.put(['pair', status])
+            if max_rss is not None and (get_rss() or 0) > max_rss:
+                handed_back = task[1][i + 1:]
+                break
+        events.put(['done', handed_back])
+        nb_tasks += 1
+        if max_tasks is not None and nb_tasks >= max_tasks:
+            reason = 'max tasks'
+            break
+        if max_rss is not None and (get_rss() or 0) > max_rss:
+            reason = 'max RSS'
+            break
+    if journal is not None:
+        journal.close()
+    events.put(['exit', [reason, nb_tasks, cache.nb_hits, cache.nb_misses]])
+    print('Total elapsed time: ' + str(timeit.default_timer() - start) + 's')
+
 
+class WorkerPool:
+    """ nb_workers processes of worker, one per slot, each one with its own task queue and
+    event queue (cf. worker_slots.py). Each task put is recorded, with an id, as assigned to its
+    slot until the process reports it done: no task is lost, even if the process is killed as it
+    gets it.
+    At most TASKS_PER_SLOT tasks are assigned to a slot, the others waiting (back-pressure).
+
+    A process which stops before getting None is replaced: either recycled (after max_tasks
+    tasks or once its RSS exceeded max_rss MB), the pairs of its task it did not analyze being
+    handed back; or killed, e.g. by the OOM killer or because it spent more than pair_timeout
+    seconds on a pair, the pairs it did not analyze of the tasks assigned to it being handed
+    back. The pair which raised an exception, or was being analyzed when its process was
+    killed, is put again as a task of its own, at most max_attempts times in all. Then it is
+    quarantined: journaled as 'quarantined' and reported at the end.
+
+    Each process sends [event, data] to the events of its slot: 'start' (data: the task id),
+    'pair' (one more pair of the task analyzed, data: its status, None for an exception), 'done'
+    (data: the pairs handed back) and 'exit' (data: [reason, number of tasks, cache hits, cache
+    misses]). """
+
+    def __init__(self, nb_workers, worker_args, max_tasks=WORKER_MAX_TASKS,
+                 max_rss=WORKER_MAX_RSS, max_attempts=MAX_PAIR_ATTEMPTS,
+                 pair_timeout=PAIR_TIMEOUT):
+        self.worker_args = worker_args  # [start, prefilter, journal_path]
+        self.max_tasks = max_tasks
+        self.max_rss = max_rss
+        self.max_attempts = max_attempts
+        self.pair_timeout = pair_timeout
+        self.journal = PairJournal(worker_args[2]) if worker_args[2] is not None else None
+        self.assigned = [list() for _ in range(nb_workers)]  # Per slot: [task id, task]
+        self.in_flight = [None] * nb_workers  # Per slot: [task, number of pairs analyzed]
+        self.last_pair = [None] * nb_workers  # Per slot: time of the last 'start' or 'pair' event
+        self.timed_out = [False] * nb_workers
+        self.exit_reasons = [None] * nb_workers  # Per slot: reason of the last 'exit' event
+        self.pending = list()  # Tasks handed back, to be put again
+        self.attempts = dict()  # (benign PDG path, malicious PDG path) -> failed attempts
+        self.quarantine = list()  # [benign PDG path, malicious PDG path, reason]
+        self.nb_tasks = 0  # Ids given
+        self.stopping = False
+        self.stats = {'recycled': 0, 'killed': 0, 'timed out': 0, 'retried': 0, 'hits': 0,
+                      'misses': 0}
+        self.slots = WorkerSlots(nb_workers, worker, [*worker_args, max_tasks, max_rss])
+        for slot in range(nb_workers):
+            self.start_worker(slot)
+
+    def start_worker(self, slot):
+        self.slots.start(slot)
+        print("Starting process")
 
-def worker(my_queue, start):
-    """ Worker """
+    def retry_pair(self, benign_pdg_path, pair, reason):
+        """ Puts pair, [malicious PDG path, folder of the JSON analysis files], again or
+        quarantines it, after a failed attempt. """
+
+        key = (benign_pdg_path, pair[0])
+        self.attempts[key] = self.attempts.get(key, 0) + 1
+        if self.attempts[key] < self.max_attempts:
+            self.stats['retried'] += 1
+            self.pending.append([benign_pdg_path, [pair]])
+            return
+        logging.error('Quarantined %s and %s after %s attempts (%s)', pair[0], benign_pdg_path,
+                      self.attempts[key], reason)
+        self.quarantine.append([benign_pdg_path, pair[0], reason])
+        if self.journal is not None:
+            self.journal.add_pair(benign_pdg_path, pair[0], 'quarantined', 0)
+
+    def handle_events(self, slot, events):
+        for [event, data] in events:
+            if event in ['start', 'pair']:
+                self.last_pair[slot] = timeit.default_timer()
+            if event == 'start':
+                [task_id, task] = self.assigned[slot][0]
+                if task_id != data:  # Tasks are got in the order they are put
+                    logging.error('Worker %s started the task %s instead of %s',
+                                  self.slots.processes[slot].pid, data, task_id)
+                self.in_flight[slot] = [task, 0]
+            elif event == 'pair':
+                [task, nb_analyzed] = self.in_flight[slot]
+                if data is None:
+                    self.retry_pair(task[0], task[1][nb_analyzed], 'exception')
+                self.in_flight[slot][1] += 1
+            elif event == 'done':
+                if data:
+                    self.pending.append([self.in_flight[slot][0][0], data])
+                self.assigned[slot].pop(0)
+                self.in_flight[slot] = None
+            else:
+                self.exit_reasons[slot] = data[0]
+                self.stats['hits'] += data[2]
+                self.stats['misses'] += data[3]
+                if data[0] == 'max RSS' and data[1] <= 1:
+                    logging.warning('A worker exceeded %s MB after %s task, WORKER_MAX_RSS may be '
+                                    'below the RSS of a new worker', self.max_rss, data[1])
+
+    def hand_back(self, slot, reason):
+        """ Hands back the tasks assigned to the slot of a process which was killed. """
+
+        if self.in_flight[slot] is not None:
+            [task, nb_analyzed] = self.in_flight[slot]
+            pairs = task[1][nb_analyzed:]
+            if pairs:  # The first one was being analyzed when the process was killed
+                self.retry_pair(task[0], pairs[0], reason)
+            if pairs[1:]:
+                self.pending.append([task[0], pairs[1:]])
+            self.assigned[slot].pop(0)
+            self.in_flight[slot] = None
+        # Not started yet, or got by the process as it was killed
+        self.pending.extend(task for [_, task] in self.assigned[slot])
+        self.assigned[slot] = list()
+
+    def supervise(self):
+        """ Replaces the processes which stopped without getting None. Returns False if no
+        process is alive any more. """
+
+        for slot, p in enumerate(self.slots.processes):
+            [events, alive] = self.slots.get_outputs(slot)
+            self.handle_events(slot, events)
+            if alive and self.pair_timeout is not None and self.in_flight[slot] is not None\
+                    and timeit.default_timer() - self.last_pair[slot] > self.pair_timeout:
+                logging.error('Worker %s spent more than %ss on a pair, killing it', p.pid,
+                              self.pair_timeout)
+                self.timed_out[slot] = True
+                p.kill()
+            if alive or self.exit_reasons[slot] == 'stopped':
+                continue
+            p.join()
+            if self.exit_reasons[slot] is None:
+                reason = 'timeout' if self.timed_out[slot] else 'killed'
+                self.stats['timed out' if self.timed_out[slot] else 'killed'] += 1
+                if not self.timed_out[slot]:
+                    logging.error('Worker %s was killed (exit code %s)', p.pid, p.exitcode)
+                self.timed_out[slot] = False
+                self.hand_back(slot, reason)
+            else:
+                self.stats['recycled'] += 1
+                self.pending.extend(task for [_, task] in self.assigned[slot])  # Not started
+                self.assigned[slot] = list()
+            if self.stopping:  # Not to wait for a process which would not get None
+                self.exit_reasons[slot] = 'stopped'
+            else:
+                self.exit_reasons[slot] = None
+                self.start_worker(slot)
+        return self.slots.is_alive()
+
+    def dispatch(self):
+        """ Assigns the pending tasks, in order, to the least busy slots with room for them. """
+
+        while self.pending:
+            slot = min(range(len(self.slots)), key=lambda i: len(self.assigned[i]))
+            if len(self.assigned[slot]) >= TASKS_PER_SLOT:
+                return
+            self.assigned[slot].append([self.nb_tasks, self.pending.pop(0)])
+            self.slots.put(slot, self.assigned[slot][-1])
+            self.nb_tasks += 1
+
+    def put(self, task):
+        """ Puts task once a slot has room for it, after the tasks handed back. Returns False if
+        no process is alive any more. """
+
+        self.pending.append(task)
+        while True:
+            self.dispatch()
+            if not self.pending:
+                return True
+            time.sleep(POLL_INTERVAL)
+            if not self.supervise():
+                logging.error('All the workers stopped')
+                return False
+
+    def close(self, progress):
+        """ Waits for the tasks put and handed back, then stops the processes. Returns the
+        quarantined pairs, [benign PDG path, malicious PDG path, reason]. """
+
+        while self.pending or any(self.assigned):
+            self.dispatch()
+            time.sleep(POLL_INTERVAL)
+            if not self.supervise():
+                logging.error('All the workers stopped')
+                break
+            progress.report_if_due()
+        self.stopping = True
+        self.slots.stop()
+        for p in self.slots.processes:
+            while p.is_alive():
+                p.join(PROGRESS_INTERVAL)
+                progress.report()
+        self.supervise()
+        if self.journal is not None:
+            self.journal.close()
+        if any(self.stats[key] for key in ['recycled', 'killed', 'timed out', 'retried']):
+            logging.info('%s workers recycled, %s killed, %s timed out, %s pairs retried',
+                         self.stats['recycled'], self.stats['killed'], self.stats['timed out'],
+                         self.stats['retried'])
+        if self.stats['hits'] + self.stats['misses'] > 0:
+            logging.info('PDG cache: %s hits, %s misses (%s%% hit rate)', self.stats['hits'],
+                         self.stats['misses'], round(100 * self.stats['hits']
+                                                     / (self.stats['hits'] + self.stats['misses']),
+                                                     1))
+        if self.quarantine:
+            logging.error('%s pairs quarantined:\n%s', len(self.quarantine),
+                          '\n'.join(malicious + ' and ' + benign + ' (' + reason + ')'
+                                    for [benign, malicious, reason] in self.quarantine))
+        return self.quarantine
+
+
+def put_task(my_queue, task, workers):
+    """ Puts task in the bounded my_queue once the workers made room for it. Returns False if
+    they all stopped in the meantime. """
 
     while True:
         try:
-            item = my_queue.get(timeout=2)
-            # print(item)
-            analyze_valid_pdgs(item[0], item[1], item[2])
-        except Exception as e:
-            break
-    print('Total elapsed time: ' + str(timeit.default_timer() - start) + 's')
+            my_queue.put(task, timeout=1)
+            return True
+        except queue.Full:
+            if not any(w.is_alive() for w in workers):
+                logging.error('All the workers stopped')
+                return False
 
 
-def replace_ast_df_folder(benign_pdgs, malicious_pdgs):
+def get_tasks(benign_pdg_list, malicious_pdg_list, benign_pdgs, malicious_pdgs, skipped_pairs,
+              block_size=BLOCK_SIZE):
     """
-        Replaces some benign parts of benign file with malicious ones. Loops over JS directories.
+        Generates the tasks one by one, instead of storing them all. A task is a benign PDG and
+        a block of malicious PDGs to analyze against it. The blocks are the outer loop, so that
+        a worker analyzes the same malicious PDGs against many benign ones in a row, finding
+        them in its PdgCache, while each benign PDG is loaded once per block.
 
         -------
         Parameters:
+        - benign_pdg_list: list
+            Names of the benign PDGs.
+        - malicious_pdg_list: list
+            Names of the malicious PDGs.
         - benign_pdgs: str
-            Path of the folder containing benign PDGs to test.
+            Path of the folder or archive containing the benign PDGs.
         - malicious_pdgs: str
-            Path of the folder containing malicious PDGs to test.
+            Path of the folder or archive containing the malicious PDGs.
+        - skipped_pairs: set
+            (benign PDG path, malicious PDG path) of the pairs not to analyze.
+        - block_size: int
+            Malicious PDGs per task. Default: BLOCK_SIZE.
+
+        -------
+        Returns:
+        - generator
+            [benign PDG path, [[malicious PDG path, folder of the JSON analysis files], ...]].
+    """
+
+    for i in range(0, len(malicious_pdg_list), block_size):
+        block = [[os.path.join(malicious_pdgs, malicious_pdg),
+                  os.path.join(os.path.dirname(malicious_pdgs), malicious_pdg + '-analysis')]
+                 for malicious_pdg in malicious_pdg_list[i:i + block_size]]
+        for benign_pdg in benign_pdg_list:
+            benign_pdg_path = os.path.join(benign_pdgs, benign_pdg)
+            pairs = [pair for pair in block if (benign_pdg_path, pair[0]) not in skipped_pairs]
+            if pairs:
+                yield [benign_pdg_path, pairs]
+
+
+def get_pdg_profile(pdg_path):
+    """ [number of nodes, equivalence class -> number of statements] of a PDG, from its sidecar
+    if it has been stored, cf. get_pair_cost. """
+
+    sidecar = load_sidecar(pdg_path)
+    if sidecar is not None:
+        return [sidecar['nb_nodes'], {kind: len(node_ids) for kind, node_ids
+                                      in sidecar['equivalence'].items()}]
+    try:
+        pdg = load_pdg(pdg_path)
+    except Exception:
+        logging.exception('Could not load %s', pdg_path)
+        pdg = None
+    if pdg is None:
+        return [0, dict()]
+    return [len(get_all_nodes(pdg)), {kind: len(equivalence_class.list1) for kind, equivalence_class
+                                      in get_equivalence_classes_graph(pdg, 1, dict()).items()}]
+
+
+def get_pair_cost(benign_profile, malicious_profile):
+    """ Estimated cost of the clone detection between 2 PDGs of get_pdg_profile: find_all_clones
+    compares each statement of an equivalence class of one PDG with each statement of the same
+    class of the other, and both PDGs are traversed a few times. """
+
+    return benign_profile[0] + malicious_profile[0]\
+        + sum(nb * benign_profile[1].get(kind, 0) for kind, nb in malicious_profile[1].items())
+
+
+def get_scheduled_tasks(benign_pdg_list, malicious_pdg_list, benign_pdgs, malicious_pdgs,
+                        skipped_pairs, workers=NUM_WORKERS, block_size=BLOCK_SIZE,
+                        window=SCHEDULE_WINDOW):
+    """
+        Tasks of get_tasks, most expensive first according to get_pair_cost, so that the
+        workers which are done first take the cheap tasks instead of waiting for one which
+        started last. The tasks costing more than 1 / (TASKS_PER_WORKER * workers) of the total
+        are split into one task per pair.
+
+        The profile of each PDG is computed once, then the tasks are generated lazily, as in
+        get_tasks: the PDGs are sorted by their mean cost against the PDGs of the other list, so
+        that the tasks come roughly most expensive first, and are reordered within a window of
+        the next window tasks. The total cost is computed from the profiles, without the tasks.
+
+        -------
+        Parameters:
+        - benign_pdg_list, malicious_pdg_list, benign_pdgs, malicious_pdgs, skipped_pairs,
+          block_size: cf. get_tasks.
+        - workers: int
+            Number of processes the tasks are dispatched to. Default: NUM_WORKERS.
+        - window: int
+            Tasks generated in advance, at most. Default: SCHEDULE_WINDOW.
+
+        -------
+        Returns:
+        - generator
+            [task, estimated cost], task as yielded by get_tasks.
     """
 
     start = timeit.default_timer()
+    profiles = dict()  # PDG path -> get_pdg_profile
+    kind_sums = [dict(), dict()]  # Benign, malicious: equivalence class -> sum of the sizes
+    node_sums = [0, 0]
+    for i, [pdg_list, pdgs] in enumerate([[benign_pdg_list, benign_pdgs],
+                                          [malicious_pdg_list, malicious_pdgs]]):
+        for pdg_name in pdg_list:
+            profile = profiles[os.path.join(pdgs, pdg_name)] = get_pdg_profile(
+                os.path.join(pdgs, pdg_name))
+            node_sums[i] += profile[0]
+            for kind, nb in profile[1].items():
+                kind_sums[i][kind] = kind_sums[i].get(kind, 0) + nb
+    micro_benchmark('Profiled ' + str(len(profiles)) + ' PDGs in',
+                    timeit.default_timer() - start)
+
+    # Sum of get_pair_cost over all the pairs, minus the skipped ones
+    total_cost = len(malicious_pdg_list) * node_sums[0] + len(benign_pdg_list) * node_sums[1]\
+        + sum(nb * kind_sums[0].get(kind, 0) for kind, nb in kind_sums[1].items())
+    total_cost -= sum(get_pair_cost(profiles[pair[0]], profiles[pair[1]])
+                      for pair in skipped_pairs if pair[0] in profiles and pair[1] in profiles)
+
+    def get_mean_cost(pdg_name, pdgs, other):
+        # Mean cost of pdg_name against the PDGs of the list other, minus their mean size
+        profile = profiles[os.path.join(pdgs, pdg_name)]
+        other_size = max(len([benign_pdg_list, malicious_pdg_list][other]), 1)
+        return profile[0] + sum(nb * kind_sums[other].get(kind, 0) for kind, nb
+                                in profile[1].items()) / other_size
+
+    benign_pdg_list = sorted(benign_pdg_list, reverse=True,
+                             key=lambda pdg_name: get_mean_cost(pdg_name, benign_pdgs, 1))
+    malicious_pdg_list = sorted(malicious_pdg_list, reverse=True,
+                                key=lambda pdg_name: get_mean_cost(pdg_name, malicious_pdgs, 0))
+
+    next_tasks = list()  # Heap of [- cost, order, [task, cost]]
+    nb_tasks = 0
+    for task in get_tasks(benign_pdg_list, malicious_pdg_list, benign_pdgs, malicious_pdgs,
+                          skipped_pairs, block_size):
+        costs = [get_pair_cost(profiles[task[0]], profiles[pair[0]]) for pair in task[1]]
+        if sum(costs) > total_cost / (TASKS_PER_WORKER * workers) and len(costs) > 1:
+            scheduled_tasks = [[[task[0], [pair]], cost] for pair, cost in zip(task[1], costs)]
+        else:
+            scheduled_tasks = [[task, sum(costs)]]
+        for scheduled_task in scheduled_tasks:
+            heapq.heappush(next_tasks, [- scheduled_task[1], nb_tasks, scheduled_task])
+            nb_tasks += 1
+            if len(next_tasks) > window:
+                yield heapq.heappop(next_tasks)[2]
+    while next_tasks:
+        yield heapq.heappop(next_tasks)[2]
+
+
+def simulate_dispatch(durations, workers):
+    """ Time at which each of workers processes is done, each one taking the next of durations
+    as soon as it is free, as from the queue of replace_ast_df_folder. """
+
+    finish_times = [0] * workers
+    for duration in durations:
+        finish_times[finish_times.index(min(finish_times))] += duration
+    return finish_times
+
+
+def benchmark_scheduling(benign_pdgs=None, malicious_pdgs=None, workers=4, nb_pdgs=(20, 20)):
+    """
+        Compares the dispatch of the tasks in the order of get_tasks and of get_scheduled_tasks.
+        The time of each pair is measured here, one pair after the other, then the dispatch to
+        workers processes is simulated (cf. simulate_dispatch).
 
-    my_queue = Queue()
-    workers = list()
+        -------
+        Parameters:
+        - benign_pdgs, malicious_pdgs: str
+            Paths of the folders or archives containing the PDGs. Default: None, i.e. nb_pdgs
+            synthetic PDGs of heavy-tailed sizes (cf. get_synthetic_pdg).
+        - workers: int
+            Number of simulated processes. Default: 4.
+        - nb_pdgs: tuple
+            (benign, malicious) sizes of the synthetic corpus. Default: (20, 20).
 
-    for malicious_pdg in os.listdir(malicious_pdgs):
+        -------
+        Returns:
+        - dict
+            'get_tasks' and 'cost model' -> {'makespan': seconds until the last process is done,
+            'tail': seconds between the first and the last process being done}; 'correlation'
+            between the estimated costs and the measured times of the pairs.
+    """
 
-        json_analysis = os.path.join(os.path.dirname(malicious_pdgs), malicious_pdg + '-analysis')
-        if not os.path.exists(json_analysis):
-            os.makedirs(json_analysis)
+    if benign_pdgs is None:
+        rand = random.Random(0)
+        with tempfile.TemporaryDirectory() as tmp_folder:
+            for [folder, nb] in zip(['benign', 'malicious'], nb_pdgs):
+                os.makedirs(os.path.join(tmp_folder, folder))
+                for i in range(nb):
+                    nb_statements = min(int(10 * rand.paretovariate(1.2)), 1000)
+                    store_flat_pdg(get_synthetic_pdg(nb_statements, rand.random()),
+                                   os.path.join(tmp_folder, folder, folder + str(i)))
+            return benchmark_scheduling(os.path.join(tmp_folder, 'benign'),
+                                        os.path.join(tmp_folder, 'malicious'), workers)
+
+    benign_pdg_list, malicious_pdg_list = list_pdgs(benign_pdgs), list_pdgs(malicious_pdgs)
+    cache = PdgCache(len(benign_pdg_list) + len(malicious_pdg_list))
+    pair_times, pair_costs = dict(), dict()  # (benign PDG path, malicious PDG path) -> value
+    for [task, cost] in get_scheduled_tasks(benign_pdg_list, malicious_pdg_list, benign_pdgs,
+                                            malicious_pdgs, set(), workers, block_size=1):
+        [benign_pdg_path, [[malicious_pdg_path, _]]] = task
+        pdgs = []
+        for pdg_path in [benign_pdg_path, malicious_pdg_path]:
+            pdgs.append(cache.get_pdg(pdg_path) if cache.get_lazy_pdg(pdg_path) else None)
+        start = timeit.default_timer()
+        if None not in pdgs:
+            detect_clones(pdgs[0], pdgs[1], dict(), sidecars=[load_sidecar(benign_pdg_path),
+                                                              load_sidecar(malicious_pdg_path)])
+        pair_times[(benign_pdg_path, malicious_pdg_path)] = timeit.default_timer() - start
+        pair_costs[(benign_pdg_path, malicious_pdg_path)] = cost
 
-        for benign_pdg in os.listdir(benign_pdgs):
-            my_queue.put([os.path.join(benign_pdgs, benign_pdg),
-                          os.path.join(malicious_pdgs, malicious_pdg),
-                          json_analysis])
-            # time.sleep(0.1)  # Just enough to let the Queue finish
+    results = dict()
+    for [order, tasks] in [['get_tasks', get_tasks(benign_pdg_list, malicious_pdg_list,
+                                                   benign_pdgs, malicious_pdgs, set())],
+                           ['cost model', [task for [task, _] in get_scheduled_tasks(
+                               benign_pdg_list, malicious_pdg_list, benign_pdgs, malicious_pdgs,
+                               set(), workers)]]]:
+        finish_times = simulate_dispatch([sum(pair_times[(task[0], pair[0])] for pair in task[1])
+                                          for task in tasks], workers)
+        results[order] = {'makespan': max(finish_times),
+                          'tail': max(finish_times) - min(finish_times)}
+        logging.info('%s order: makespan %.3fs, tail %.3fs', order, results[order]['makespan'],
+                     results[order]['tail'])
+
+    times, costs = list(pair_times.values()), [pair_costs[pair] for pair in pair_times]
+    mean_time, mean_cost = sum(times) / len(times), sum(costs) / len(costs)
+    covariance = sum((t - mean_time) * (c - mean_cost) for t, c in zip(times, costs))
+    deviations = (sum((t - mean_time) ** 2 for t in times)
+                  * sum((c - mean_cost) ** 2 for c in costs)) ** 0.5
+    results['correlation'] = covariance / deviations if deviations else 0
+    logging.info('Correlation between the estimated costs and the times of %s pairs: %.2f',
+                 len(times), results['correlation'])
+    return results
+
+
+def replace_ast_df_folder(benign_pdgs, malicious_pdgs, prefilter=False, retry_failed=False,
+                          cost_model=False, max_tasks=WORKER_MAX_TASKS, max_rss=WORKER_MAX_RSS,
+                          pair_timeout=PAIR_TIMEOUT):
+    """
+        Replaces some benign parts of benign file with malicious ones. Loops over JS directories.
+        The pairs are generated as the workers handle them, at most TASKS_PER_SLOT tasks being
+        assigned to each worker, grouped in tasks of a benign PDG and BLOCK_SIZE malicious ones
+        (cf. get_tasks). Each worker keeps the last PDG_CACHE_SIZE PDGs it loaded (cf.
+        PdgCache). The workers which stop are replaced, cf. WorkerPool.
 
-    for i in range(NUM_WORKERS):
-        p = Process(target=worker, args=(my_queue, start,))
-        p.start()
-        print("Starting process")
-        workers.append(p)
+        -------
+        Parameters:
+        - benign_pdgs: str
+            Path of the folder or archive (cf. pdg_archive.py) containing benign PDGs to test.
+        - malicious_pdgs: str
+            Path of the folder or archive containing malicious PDGs to test.
+        - prefilter: bool
+            Skips the pairs which cannot be 100% cloned, cf. analyze_valid_pdgs. Default: False.
+        - retry_failed: bool
+            Analyzes again the pairs which failed or were quarantined during the previous runs.
+            The pairs recorded as analyzed in the journal (cf. pair_journal.py) are skipped
+            anyway. Default: False.
+        - cost_model: bool
+            Dispatches the tasks most expensive first, cf. get_scheduled_tasks, instead of
+            generating them as the workers handle them. Default: False.
+        - max_tasks: int
+            Tasks after which a worker is replaced, None for never, cf. WorkerPool. Default:
+            WORKER_MAX_TASKS.
+        - max_rss: int
+            Resident memory in MB above which a worker is replaced, None for never. Default:
+            WORKER_MAX_RSS.
+        - pair_timeout: int
+            Seconds after which the worker analyzing a pair is killed, the pair being retried
+            then quarantined (cf. WorkerPool), None for never. Default: PAIR_TIMEOUT.
 
-    for w in workers:
-        w.join()
+        -------
+        Returns:
+        - list
+            [benign PDG path, malicious PDG path, reason] of the pairs quarantined during this
+            run, after MAX_PAIR_ATTEMPTS exceptions, kills or timeouts.
+    """
 
+    start = timeit.default_timer()
+
+    benign_pdg_list = list_pdgs(benign_pdgs)
+    malicious_pdg_list = list_pdgs(malicious_pdgs)
+    journal_path = get_journal_path(malicious_pdgs)
+    benign_pdg_paths = set(os.path.join(benign_pdgs, benign_pdg) for benign_pdg in benign_pdg_list)
+    malicious_pdg_paths = set(os.path.join(malicious_pdgs, malicious_pdg)
+                              for malicious_pdg in malicious_pdg_list)
+    skipped_pairs = set(pair for pair, record in load_journal(journal_path).items()
+                        if pair[0] in benign_pdg_paths and pair[1] in malicious_pdg_paths
+                        and not (retry_failed and record['status'] in ['failed', 'quarantined']))
+    nb_pairs = len(benign_pdg_list) * len(malicious_pdg_list) - len(skipped_pairs)
+
+    logging.info('%s pairs to analyze, %s already analyzed according to %s', nb_pairs,
+                 len(skipped_pairs), journal_path)
+    progress = JournalProgress(journal_path, nb_pairs)
+
+    if not nb_pairs:
+        return []
+    workers = WorkerPool(NUM_WORKERS, [start, prefilter, journal_path], max_tasks, max_rss,
+                         pair_timeout=pair_timeout)
+
+    if cost_model:
+        tasks = (task for [task, _] in get_scheduled_tasks(benign_pdg_list, malicious_pdg_list,
+                                                           benign_pdgs, malicious_pdgs,
+                                                           skipped_pairs, NUM_WORKERS))
+    else:
+        tasks = get_tasks(benign_pdg_list, malicious_pdg_list, benign_pdgs, malicious_pdgs,
+                          skipped_pairs)
+    for task in tasks:
+        if not workers.put(task):
+            break
+        progress.report_if_due()
+    return workers.close(progress)
 
-def unpickle_pdg(pdg_path):
-    """ Tries to unpickle a PDG. """
+
+def load_pdg(pdg_path):
+    """ Tries to load a PDG, stored in the flat binary format, in an archive (pdg_path being
+    <archive folder>/<PDG name>) or pickled (previous versions). """
 
     try:
+        if not os.path.exists(pdg_path) and is_pdg_archive(os.path.dirname(pdg_path)):
+            return load_archived_pdg(pdg_path)
+        if is_flat_pdg(pdg_path):
+            return load_flat_pdg(pdg_path)
         pdg = pickle.load(open(pdg_path, 'rb'))
         return pdg
     except IsADirectoryError as error_message:
-        logging.exception('%s %s%s %s', 'Tried to unpickle the directory', pdg_path, ':',
+        logging.exception('%s %s%s %s', 'Tried to load the directory', pdg_path, ':',
+                          str(error_message))
+        return None
+
+
+def load_lazy_pdg(pdg_path):
+    """ Tries to load a PDG as a LazyPdg, only the kinds of its nodes being read first. Same
+    formats as load_pdg, pickled PDGs being fully loaded. """
+
+    try:
+        if not os.path.exists(pdg_path) and is_pdg_archive(os.path.dirname(pdg_path)):
+            return load_archived_lazy_pdg(pdg_path)
+        with open(pdg_path, 'rb') as pdg_file:
+            if is_flat_pdg(pdg_path):
+                return LazyPdg(pdg_file.read(), pdg_path)
+            return LazyPdg(None, pdg_path, pdg=pickle.load(pdg_file))
+    except IsADirectoryError as error_message:
+        logging.exception('%s %s%s %s', 'Tried to load the directory', pdg_path, ':',
                           str(error_message))
         return None
 
 
-def analyze_valid_pdgs(benign_pdg_path, malicious_pdg_path, json_analysis):
+def get_pdg_mtime(pdg_path):
+    """ mtime of a PDG file, or of its archive folder for a PDG of an archive. """
+
+    if not os.path.exists(pdg_path) and is_pdg_archive(os.path.dirname(pdg_path)):
+        return os.path.getmtime(os.path.dirname(pdg_path))
+    return os.path.getmtime(pdg_path)
+
+
+class PdgCache:
+    """ Bounded LRU cache of the PDGs loaded by a worker, keyed by path and mtime. The clone
+    detection marks the nodes of the PDGs (Node.clone), hence reset for each pair. """
+
+    def __init__(self, max_size=PDG_CACHE_SIZE):
+        self.max_size = max(max_size, 2)  # The 2 PDGs of a pair
+        self.entries = OrderedDict()  # PDG path -> [mtime, LazyPdg, nodes, Node.clone values]
+        self.nb_hits = 0
+        self.nb_misses = 0
+
+    def get_lazy_pdg(self, pdg_path):
+        mtime = get_pdg_mtime(pdg_path)
+        entry = self.entries.get(pdg_path)
+        if entry is not None and entry[0] == mtime:
+            self.nb_hits += 1
+            self.entries.move_to_end(pdg_path)
+            return entry[1]
+        self.nb_misses += 1
+        self.entries.pop(pdg_path, None)
+        lazy_pdg = load_lazy_pdg(pdg_path)
+        if lazy_pdg is not None:
+            self.entries[pdg_path] = [mtime, lazy_pdg, None, None]
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return lazy_pdg
+
+    def get_pdg(self, pdg_path):
+        """ PDG of pdg_path, whose LazyPdg was just got with get_lazy_pdg. """
+
+        entry = self.entries[pdg_path]
+        pdg = entry[1].get_pdg()
+        if entry[2] is None:
+            entry[2] = get_all_nodes(pdg)
+            entry[3] = [node.clone for node in entry[2]]
+        else:
+            for node, clone in zip(entry[2], entry[3]):
+                node.clone = clone
+        return pdg
+
+
+def get_json_analysis_path(json_analysis, res_dict):
+    """ Path of the JSON analysis file of the pair res_dict['benign'], res_dict['malicious']. """
+
+    malicious = os.path.basename(res_dict['malicious'])
+    benign = os.path.basename(res_dict['benign'])
+    return os.path.join(json_analysis, benign.replace('.js', '') + '_'
+                        + malicious.replace('.js', '') + '.json')
+
+
+def analyze_valid_pdgs(benign_pdg_path, malicious_pdg_path, json_analysis, limits=CLONE_LIMITS,
+                       prefilter=False, cache=None):
     """ Take one benign and one malicious PDG paths and call the replace_ast_df function if both of
-    them are valid. """
+    them are valid. Returns 'done', 'rejected' (prefilter) or 'failed' (invalid PDG).
+    With prefilter, the PDGs are first loaded as LazyPdg objects: if some kinds of malicious
+    nodes are not in the benign PDG, the malicious PDG cannot be 100% cloned, and the pair is
+    skipped before the PDGs are fully deserialized (JSON analysis with 'rejected').
+    The sidecars of the PDGs (cf. pdg_sidecar.py), if stored, provide these kinds without reading
+    the PDGs and are passed to the clone detection. The PDGs are got from cache, a PdgCache, if
+    given. """
 
     results = dict()
-    dfg_nodes_benign = unpickle_pdg(benign_pdg_path)
+    sidecars = [load_sidecar(benign_pdg_path), load_sidecar(malicious_pdg_path)]
+    cache = PdgCache(2) if cache is None else cache
+    lazy_benign = cache.get_lazy_pdg(benign_pdg_path)
+    lazy_malicious = cache.get_lazy_pdg(malicious_pdg_path) if lazy_benign is not None else None
+    if lazy_malicious is None:
+        return 'failed'
+    if prefilter:
+        if None not in sidecars:
+            missing = set(sidecars[1]['kinds']) - set(sidecars[0]['kinds'])
+        else:
+            missing = lazy_malicious.get_node_kinds() - lazy_benign.get_node_kinds()
+        if missing:
+            logging.info('Skipped %s and %s, %s kinds of nodes are not in the benign PDG',
+                         os.path.basename(malicious_pdg_path), os.path.basename(benign_pdg_path),
+                         len(missing))
+            results['malicious'] = malicious_pdg_path
+            results['benign'] = benign_pdg_path
+            results['rejected'] = sorted(missing)
+            os.makedirs(json_analysis, exist_ok=True)
+            with open(get_json_analysis_path(json_analysis, results), 'w') as json_data:
+                json.dump(results, json_data)
+            return 'rejected'
+    dfg_nodes_benign = cache.get_pdg(benign_pdg_path)
     if dfg_nodes_benign is not None:
-        dfg_nodes_malicious = unpickle_pdg(malicious_pdg_path)
+        dfg_nodes_malicious = cache.get_pdg(malicious_pdg_path)
         if dfg_nodes_malicious is not None:
             print('Analysis of ' + os.path.basename(malicious_pdg_path) + ' and '
                   + os.path.basename(benign_pdg_path) + '\n')
             results['malicious'] = malicious_pdg_path
             results['benign'] = benign_pdg_path
-            replace_ast_df(dfg_nodes_benign, dfg_nodes_malicious, results, json_analysis)
+            replace_ast_df(dfg_nodes_benign, dfg_nodes_malicious, results, json_analysis, limits,
+                           sidecars)
+            return 'done'
+    return 'failed'
 
 
-def replace_ast_df(dfg_nodes_benign, dfg_nodes_malicious, res_dict, json_analysis):
+def detect_clones(dfg_nodes_benign, dfg_nodes_malicious, res_dict, limits=CLONE_LIMITS,
+                  sidecars=None):
     """
-        Replaces benign sub ASTs with their malicious equivalents.
+        Detects the clones between two PDGs and stores the findings in res_dict, without
+        displaying or storing them.
 
         -------
         Parameters:
@@ -119,23 +769,26 @@ def replace_ast_df(dfg_nodes_benign, dfg_nodes_malicious, res_dict, json_analysi
             PDG of the malicious file considered.
         - res_dict: dict
             Contains the different results obtained so far.
-        - json_analysis: str
-            Path of the directory to store the JSON analysis file.
+        - limits: list
+            [seconds, steps] allowed to detect clones, None meaning unlimited. Once reached, the
+            clones found so far are kept and res_dict['truncated'] is True. Default: CLONE_LIMITS.
+        - sidecars: list
+            [benign sidecar, malicious sidecar] precomputed when storing the PDGs, each possibly
+            None, cf. pdg_sidecar.py. Default: None.
 
         -------
         Returns:
         - list
-            Contains the clones found between the benign and malicious AST.
-        - or None.
+            [clones found between the benign and malicious AST, proportion of malicious nodes
+            found in the benign AST].
     """
 
     start = timeit.default_timer()
     benchmarks = dict()
 
-    malicious = os.path.basename(res_dict['malicious'])
-    benign = os.path.basename(res_dict['benign'])
-
-    all_clones_list = find_all_clones(dfg_nodes_benign, dfg_nodes_malicious)
+    budget = Budget(*limits)
+    all_clones_list = find_all_clones(dfg_nodes_benign, dfg_nodes_malicious, budget, sidecars)
+    res_dict['truncated'] = budget.exceeded
     benchmarks['Clones detected'] = timeit.default_timer() - start
     start = micro_benchmark('Successfully detected ' + str(len(all_clones_list))
                             + ' clones without duplicate suppression in',
@@ -150,30 +803,53 @@ def replace_ast_df(dfg_nodes_benign, dfg_nodes_malicious, res_dict, json_analysi
                     + ' clones in', timeit.default_timer() - start)
 
     nb_clones = get_percentage_cloned(dfg_nodes_benign, dfg_nodes_malicious, res_dict)
-    print_clones(all_clones_list)  # Comment for multiprocessing!
+    res_dict['benchmarks'] = benchmarks
+    return [all_clones_list, nb_clones]
 
-    logging.info('Could find %s%% of the malicious nodes in the benign AST', nb_clones * 100)
 
-    if nb_clones * 100 == 100:  # Only if malicious AST can be found in benign one
-        res_dict['benchmarks'] = benchmarks
+def replace_ast_df(dfg_nodes_benign, dfg_nodes_malicious, res_dict, json_analysis,
+                   limits=CLONE_LIMITS, sidecars=None):
+    """
+        Replaces benign sub ASTs with their malicious equivalents.
 
-        with open(os.path.join(json_analysis, benign.replace('.js', '') + '_'\
-                                              + malicious.replace('.js', '') + '.json'),
-                  'w') as json_data:
-            json.dump(res_dict, json_data)
+        -------
+        Parameters:
+        - dfg_nodes_benign: Node
+            PDG of the benign file considered.
+        - dfg_nodes_malicious: Node
+            PDG of the malicious file considered.
+        - res_dict: dict
+            Contains the different results obtained so far.
+        - json_analysis: str
+            Path of the directory to store the JSON analysis file.
+        - limits: list
+            [seconds, steps] allowed to detect clones, cf. detect_clones. Default: CLONE_LIMITS.
+        - sidecars: list
+            [benign sidecar, malicious sidecar], cf. detect_clones. Default: None.
 
-        return all_clones_list
+        -------
+        Returns:
+        - list
+            Contains the clones found between the benign and malicious AST.
+        - or None.
+    """
 
-    res_dict['benchmarks'] = benchmarks
-    with open(os.path.join(json_analysis, benign.replace('.js', '') + '_'\
-                                          + malicious.replace('.js', '') + '.json'),
-              'w') as json_data:
+    [all_clones_list, nb_clones] = detect_clones(dfg_nodes_benign, dfg_nodes_malicious, res_dict,
+                                                 limits, sidecars)
+    print_clones(all_clones_list)  # Comment for multiprocessing!
+
+    logging.info('Could find %s%% of the malicious nodes in the benign AST', nb_clones * 100)
+
+    os.makedirs(json_analysis, exist_ok=True)  # On demand, for replace_ast_df_folder
+    with open(get_json_analysis_path(json_analysis, res_dict), 'w') as json_data:
         json.dump(res_dict, json_data)
 
+    if nb_clones * 100 == 100:  # Only if malicious AST can be found in benign one
+        return all_clones_list
     return None
 
 
-def replace_ast(input_benign, input_malicious):
+def replace_ast(input_benign, input_malicious, dfg_limits=DFG_LIMITS, clone_limits=CLONE_LIMITS):
     """
         Replaces some benign parts of a given file with malicious ones.
 
@@ -183,6 +859,10 @@ def replace_ast(input_benign, input_malicious):
             Path of the benign file considered.
         - input_malicious: str
             Path of the malicious file considered.
+        - dfg_limits: list
+            [seconds, steps] allowed to produce the data flow of each file. Default: DFG_LIMITS.
+        - clone_limits: list
+            [seconds, steps] allowed to detect clones. Default: CLONE_LIMITS.
 
         -------
         Returns:
@@ -197,14 +877,16 @@ def replace_ast(input_benign, input_malicious):
         os.makedirs(json_analysis)
     start = timeit.default_timer()
 
-    dfg_nodes_benign = get_data_flow(input_file=input_benign, benchmarks=benchmarks)
-    dfg_nodes_malicious = get_data_flow(input_file=input_malicious, benchmarks=benchmarks)
+    dfg_nodes_benign = get_data_flow(input_file=input_benign, benchmarks=benchmarks,
+                                     limits=dfg_limits)
+    dfg_nodes_malicious = get_data_flow(input_file=input_malicious, benchmarks=benchmarks,
+                                        limits=dfg_limits)
     if dfg_nodes_benign is not None and dfg_nodes_malicious is not None:
         res_dict = dict()
         res_dict['malicious'] = input_malicious
         res_dict['benign'] = input_benign
         replaced_ast = replace_ast_df(dfg_nodes_benign, dfg_nodes_malicious, res_dict=res_dict,
-                                      json_analysis=json_analysis)
+                                      json_analysis=json_analysis, limits=clone_limits)
         # same_ast(benign_file, malicious_file)
         micro_benchmark('Elapsed time:', timeit.default_timer() - start)
         return replaced_ast
@@ -0,0 +1,46 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Definition of class UnknownVarList: variables used before being declared, keyed by name.
+"""
+
+
+class UnknownVarList:
+
+    def __init__(self):
+        self.var_dict = dict()  # Variable name -> Identifier nodes using it
+        self.var_names = set()  # Names of the variables which have been unknown at some point
+
+    def __len__(self):
+        return sum(len(nodes) for nodes in self.var_dict.values())
+
+    def add_var(self, identifier_node):
+        self.var_dict.setdefault(identifier_node.attributes['name'], []).append(identifier_node)
+        self.var_names.add(identifier_node.attributes['name'])
+
+    def get_var(self, var_name):
+        return self.var_dict.get(var_name, [])
+
+    def pop_var(self, var_name):
+        return self.var_dict.pop(var_name, [])
+
+    def was_unknown(self, var_name):
+        return var_name in self.var_names
+
+    def get_var_list(self):
+        return [node for nodes in self.var_dict.values() for node in nodes]
+
+    def get_summary(self):
+        return {var_name: len(nodes) for var_name, nodes in self.var_dict.items()}
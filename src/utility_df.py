@@ -16,15 +16,35 @@
     Utility file, stores shared information.
 """
 
+import os
 import sys
+import time
 import timeit
 import logging
-import signal
 
 
 sys.setrecursionlimit(400000)
 
 NUM_WORKERS = 1
+PDG_CODEC = None  # Compression of the stored PDGs: None, 'zlib', 'lzma' or 'bz2'
+PDG_CACHE_SIZE = 64  # PDGs kept in memory by each worker of replace_ast_df_folder
+BLOCK_SIZE = 16  # Malicious PDGs analyzed against a benign one per replace_ast_df_folder task
+TASKS_PER_WORKER = 4  # With cost_model, the tasks costing more than 1 / (TASKS_PER_WORKER *
+# workers) of the estimated total are split into one task per pair
+SCHEDULE_WINDOW = 1024  # With cost_model, tasks generated in advance to be sorted by cost
+
+# Recycling of the workers of replace_ast_df_folder, None meaning never
+WORKER_MAX_TASKS = None  # Tasks handled by a worker before it is replaced
+WORKER_MAX_RSS = None  # Resident memory of a worker, in MB, above which it is replaced
+MAX_PAIR_ATTEMPTS = 3  # Attempts of a pair which crashes or times out before it is quarantined
+PAIR_TIMEOUT = None  # Seconds after which the worker analyzing a pair is killed, None for never
+TASKS_PER_SLOT = 2  # Tasks assigned to a worker of replace_ast_df_folder at most
+POLL_INTERVAL = 0.01  # Seconds between two checks of the workers by a WorkerPool
+
+# Per-stage limits [seconds, steps], None meaning unlimited. Once a limit is reached, the stage
+# stops and its partial result is flagged as truncated.
+DFG_LIMITS = [60, None]  # Data flow of one file
+CLONE_LIMITS = [None, None]  # Clone detection between two PDGs
 
 
 class UpperThresholdFilter(logging.Filter):
@@ -46,27 +66,87 @@ LOGGER = logging.getLogger()
 LOGGER.addFilter(UpperThresholdFilter(logging.CRITICAL))
 
 
+def get_rss():
+    """ Resident memory of this process in MB, or None if it is unknown (only on Linux). """
+
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError, IndexError):
+        return None
+
+
 def micro_benchmark(message, elapsed_time):
     """ Micro benchmarks. """
     logging.info('%s %s%s', message, str(elapsed_time), 's')
     return timeit.default_timer()
 
 
-class Timeout:
-    """ Timeout class using ALARM signal. """
+class Budget:
+    """ Cooperative budget (number of steps and/or seconds), checked by the DFG and clone
+    detection loops. Contrary to the ALARM signal, it works outside of the main thread. """
 
-    class Timeout(Exception):
+    class Exceeded(Exception):
         pass
 
-    def __init__(self, sec):
+    def __init__(self, sec=None, steps=None):
         self.sec = sec
-
-    def __enter__(self):
-        signal.signal(signal.SIGALRM, self.raise_timeout)
-        signal.alarm(self.sec)
-
-    def __exit__(self, *args):
-        signal.alarm(0)  # disable alarm
-
-    def raise_timeout(self, *args):
-        raise Timeout.Timeout()
+        self.steps = steps
+        self.nb_steps = 0
+        self.exceeded = False
+        self.deadline = None if sec is None else time.monotonic() + sec
+
+    def step(self):
+        self.nb_steps += 1
+        if (self.steps is not None and self.nb_steps > self.steps)\
+                or (self.deadline is not None and time.monotonic() > self.deadline):
+            self.exceeded = True
+            raise Budget.Exceeded()
+
+
+class DfCounters:
+    """ Instrumentation of the data flow production, enabled with get_data_flow(counters=True).
+    Given to df_scoping, which threads it through the frames with var_loc and var_glob (cf.
+    VarList.counters). When disabled, it is None and the instrumented code only checks it. """
+
+    def __init__(self):
+        self.frames = dict()  # Handler -> number of calls
+        self.node_time = dict()  # ESTree node kind -> seconds spent, children excluded
+        self.node_kinds = []  # Kinds of the nodes currently handled
+        self.last_time = timeit.default_timer()
+        self.nb_copies = 0  # VarList copies
+        self.copied_vars = 0  # Variables copied with them
+        self.max_var_loc = 0
+        self.max_var_glob = 0
+        self.nb_merges = 0  # merge_var_boolean_cf calls
+        self.nb_edges = 0  # Data flow edges added by set_df
+
+    def spend_time(self):
+        current_time = timeit.default_timer()
+        if self.node_kinds:
+            kind = self.node_kinds[-1]
+            self.node_time[kind] = self.node_time.get(kind, 0) + current_time - self.last_time
+        self.last_time = current_time
+
+    def enter_node(self, kind, var_loc, var_glob):
+        self.spend_time()
+        self.node_kinds.append(kind)
+        self.max_var_loc = max(self.max_var_loc, len(var_loc.var_list))
+        self.max_var_glob = max(self.max_var_glob, len(var_glob.var_list))
+
+    def exit_node(self):
+        self.spend_time()
+        self.node_kinds.pop()
+
+    def count_frame(self, handler):
+        self.frames[handler] = self.frames.get(handler, 0) + 1
+
+    def count_copy(self, nb_vars):
+        self.nb_copies += 1
+        self.copied_vars += nb_vars
+
+    def get_counters(self):
+        return {'handler calls': self.frames, 'node time': self.node_time,
+                'VarList copies': self.nb_copies, 'copied variables': self.copied_vars,
+                'max var_loc': self.max_var_loc, 'max var_glob': self.max_var_glob,
+                'merge_var_boolean_cf': self.nb_merges, 'set_df edges': self.nb_edges}
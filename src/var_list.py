@@ -34,6 +34,7 @@ class VarList:
         self.ref_list = []
         self.fun_list = []
         self.limited_scope = LimitedScope()
+        self.counters = None  # DfCounters of the data flow being produced, cf. df_scoping
 
     def get_var_list(self):
         return self.var_list
@@ -82,12 +83,22 @@ class VarList:
         return False
 
     def copy_var_list(self):
+        if self.counters is not None:
+            self.counters.count_copy(len(self.var_list))
         var_list = VarList()
+        var_list.counters = self.counters
         var_list.set_var_list(copy.copy(self.var_list))
         var_list.set_ref_list(copy.copy(self.ref_list))
         var_list.set_fun_list(copy.copy(self.fun_list))
         return var_list
 
+    def copy_var_list_limited_scope(self):
+        var_list = self.copy_var_list()
+        var_list.set_limit(self.get_limit())
+        var_list.set_before_limit_list(self.get_before_limit_list())
+        var_list.set_after_limit_list(self.get_after_limit_list())
+        return var_list
+
     def get_limit(self):
         return self.limited_scope.limit
 
@@ -0,0 +1,78 @@
+# Copyright (C) 2020 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Processes of a pool, one per slot, each one with its own input queue and output queue,
+    shared by samples_generation.WorkerPool and pdg_stream.RecordPool.
+
+    A process which is killed (e.g. by the OOM killer, or a Segfault) cannot leave a lock of a
+    queue shared with the others held. The outputs go through SimpleQueues, so that they are
+    written before a process can be killed. The pool keeps track of what each slot was given,
+    and starts the process of a slot again once it stopped, cf. start.
+"""
+
+from multiprocessing import Process, Queue, SimpleQueue
+
+
+class WorkerSlots:
+    """ nb_workers processes running target(input queue, output queue, *args), until they get
+    None, each one being started by start. """
+
+    def __init__(self, nb_workers, target, args):
+        self.target = target
+        self.args = args
+        self.processes = [None] * nb_workers
+        self.queues = [None] * nb_workers
+        self.outputs = [None] * nb_workers
+
+    def __len__(self):
+        return len(self.processes)
+
+    def start(self, slot):
+        """ Starts the process of slot, with new queues, the previous ones possibly holding
+        inputs which the pool hands back or reports as lost, if it was started before. """
+
+        if self.queues[slot] is not None:
+            self.queues[slot].close()
+            self.queues[slot].cancel_join_thread()  # Not to wait for its inputs at exit
+        self.queues[slot] = Queue()
+        self.outputs[slot] = SimpleQueue()
+        p = Process(target=self.target, args=(self.queues[slot], self.outputs[slot], *self.args))
+        p.start()
+        self.processes[slot] = p
+
+    def put(self, slot, item):
+        self.queues[slot].put(item)
+
+    def get_outputs(self, slot):
+        """ [outputs of the process of slot sent so far, whether it is alive], checked before
+        reading them so that the last outputs of a process which stopped are not missed. """
+
+        alive = self.processes[slot].is_alive()
+        outputs = list()
+        while not self.outputs[slot].empty():
+            outputs.append(self.outputs[slot].get())
+        return [outputs, alive]
+
+    def is_alive(self):
+        """ Indicates whether a process is still alive. """
+
+        return any(p.is_alive() for p in self.processes)
+
+    def stop(self):
+        """ Sends None to the processes still alive. """
+
+        for slot, p in enumerate(self.processes):
+            if p.is_alive():
+                self.queues[slot].put(None)
@@ -0,0 +1,94 @@
+# Copyright (C) 2019 Aurore Fass
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Round trip of the PDGs of the examples, built sequentially and with parallel_dfg, through
+    the flat binary format with each codec (cf. pdg_format.py) and through a PDG archive (cf.
+    pdg_archive.py). Esprima is needed to build the PDGs.
+"""
+
+import os
+import sys
+
+import pytest
+
+SRC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+EXAMPLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'example')
+sys.path.insert(0, SRC_PATH)
+
+from node import COMMENTS
+from pdg_format import CODECS, LazyPdg, get_all_nodes, dump_flat_pdg, compress_flat_pdg,\
+    store_flat_pdg, load_flat_pdg, same_pdg
+from pdg_archive import PdgArchiveWriter, PdgArchive
+from pdgs_generation import get_data_flow, get_check_inputs
+
+
+ALL_CODECS = [None] + sorted(CODECS)
+
+
+def get_node_kinds(pdg):
+    """ Names of the nodes of pdg, without the comments, as LazyPdg.get_node_kinds. """
+
+    return set(node.name for node in get_all_nodes(pdg)) - set(COMMENTS)
+
+
+@pytest.fixture(scope='module', params=[False, True], ids=['sequential', 'parallel'])
+def pdgs(request):
+    """ [name, PDG] of the example files, built from their content so that no helper file is
+    written in the example folder. """
+
+    pdgs = []
+    for [js_path, source] in get_check_inputs(EXAMPLE_PATH):
+        pdg = get_data_flow(js_path, dict(), parallel_dfg=request.param, source=source)
+        if pdg is None:
+            pytest.skip('Esprima could not produce the AST of ' + js_path)
+        pdgs.append([os.path.basename(js_path).replace('.js', ''), pdg])
+    assert pdgs
+    return pdgs
+
+
+@pytest.mark.parametrize('codec', ALL_CODECS)
+def test_round_trip(pdgs, codec, tmp_path):
+    for [pdg_name, pdg] in pdgs:
+        pdg_path = str(tmp_path / pdg_name)
+        store_flat_pdg(pdg, pdg_path, codec=codec)
+        assert same_pdg(pdg, load_flat_pdg(pdg_path))
+
+
+@pytest.mark.parametrize('codec', ALL_CODECS)
+def test_lazy_pdg(pdgs, codec):
+    for [pdg_name, pdg] in pdgs:
+        lazy_pdg = LazyPdg(compress_flat_pdg(dump_flat_pdg(pdg), codec), pdg_name)
+        assert lazy_pdg.get_node_kinds() == get_node_kinds(pdg)
+        assert same_pdg(pdg, lazy_pdg.get_pdg())
+
+
+@pytest.mark.parametrize('codec', ALL_CODECS)
+def test_archive_round_trip(pdgs, codec, tmp_path):
+    archive_folder = str(tmp_path / 'PDG-archive')
+    writer = PdgArchiveWriter(archive_folder, 'test', shard_size=1, codec=codec)  # 1 PDG/shard
+    for [pdg_name, pdg] in pdgs:
+        writer.add_pdg(pdg_name, pdg)
+    writer.close()
+
+    archive = PdgArchive(archive_folder)
+    try:
+        assert sorted(archive.get_names()) == sorted(pdg_name for [pdg_name, _] in pdgs)
+        for [pdg_name, pdg] in pdgs:
+            assert same_pdg(pdg, archive.get_pdg(pdg_name))
+            lazy_pdg = archive.get_lazy_pdg(pdg_name)
+            assert lazy_pdg.get_node_kinds() == get_node_kinds(pdg)
+            assert same_pdg(pdg, lazy_pdg.get_pdg())
+    finally:
+        archive.close()